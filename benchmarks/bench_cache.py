@@ -0,0 +1,57 @@
+"""Compare reading a large midi file with loading the score from
+midani_cache.
+
+Without an argument, the synthetic file from bench_smf is used.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_cache [MIDI_FILE]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+from midani import midani_cache
+from midani import midani_smf
+from midani import midani_time
+
+from . import bench_smf
+
+REPEAT = 3
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if len(sys.argv) > 1:
+            path = sys.argv[1]
+        else:
+            path = os.path.join(temp_dir, "bench.mid")
+            bench_smf.write_midi(path)
+        cache = midani_cache.ScoreCache(os.path.join(temp_dir, "cache"))
+        key = midani_cache.cache_key([path])
+        score = midani_smf.read_smf(path, columnar=True)
+        cache.store(key, score)
+
+        def _read():
+            score = midani_smf.read_smf(path, columnar=True)
+            midani_time.TempoChanges(score)
+
+        def _load():
+            score = cache.load(midani_cache.cache_key([path]))
+            midani_time.TempoChanges(score)
+            # Touch all the notes
+            for voice in score.voices:
+                voice.attack.sum()
+
+        read_time = min(timeit.repeat(_read, number=1, repeat=REPEAT))
+        load_time = min(timeit.repeat(_load, number=1, repeat=REPEAT))
+    print(
+        f"{len(score)} notes\n"
+        f"  read:            {read_time:7.3f} s\n"
+        f"  load from cache: {load_time:7.3f} s "
+        f"({read_time / load_time:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Time blending note colors with a highlight color and formatting them for
+the R backend, as tuples (midani_colors.blend_colors()) and as packed colors
+(midani_colors.blend_packed()).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_colors
+"""
+
+import random
+import timeit
+
+from midani import midani_colors
+
+NUM_COLORS = 8
+NUM_BLENDS = 1000
+REPEAT = 5
+
+
+def _format_tuple(color):
+    # As the backends formatted colors before they were packed
+    return f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}{color[3]:02x}"
+
+
+def main():
+    random.seed(0)
+    colors = [
+        tuple(random.randrange(256) for _ in range(3)) + (255,)
+        for _ in range(NUM_COLORS)
+    ]
+    highlight_color = (255, 255, 255, 255)
+    blends = [random.random() for _ in range(NUM_BLENDS)]
+
+    def _tuples():
+        for color in colors:
+            for blend in blends:
+                blended = midani_colors.blend_colors(
+                    color, highlight_color, blend
+                )
+                _format_tuple(blended)
+
+    packed_colors = [midani_colors.pack_color(color) for color in colors]
+
+    def _packed():
+        for color in packed_colors:
+            for blend in blends:
+                midani_colors.hex_color(
+                    midani_colors.blend_packed(
+                        color, midani_colors.pack_color(highlight_color), blend
+                    )
+                )
+
+    tuple_time = min(timeit.repeat(_tuples, number=1, repeat=REPEAT))
+    packed_time = min(timeit.repeat(_packed, number=1, repeat=REPEAT))
+    num_blends = NUM_COLORS * NUM_BLENDS
+    print(
+        f"{num_blends} blends\n"
+        f"  tuples: {1e9 * tuple_time / num_blends:7.0f} ns per blend\n"
+        f"  packed: {1e9 * packed_time / num_blends:7.0f} ns per blend "
+        f"({tuple_time / packed_time:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compare note_classes.Score with midani_notes.ColumnarScore: memory per
+note, and the time to read, iterate over, and crop the score.
+
+Without an argument, the synthetic file from bench_smf is used.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_columnar [MIDI_FILE]
+"""
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from midani import midani_smf
+
+from . import bench_smf
+
+REPEAT = 3
+
+
+def _measure(path, columnar):
+    tracemalloc.start()
+    score = midani_smf.read_smf(path, ticks=True, columnar=columnar)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    num_notes = len(score)
+    total_len = score.get_total_len()
+
+    def _read():
+        midani_smf.read_smf(path, ticks=True, columnar=columnar)
+
+    def _iterate():
+        for voice in score.voices:
+            for _ in voice:
+                pass
+
+    def _crop():
+        score.get_passage(
+            passage_start_time=total_len / 3,
+            passage_end_time=2 * total_len / 3,
+        )
+
+    times = [
+        min(timeit.repeat(stage, number=1, repeat=REPEAT))
+        for stage in (_read, _iterate, _crop)
+    ]
+    return [memory / num_notes] + times
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if len(sys.argv) > 1:
+            path = sys.argv[1]
+        else:
+            path = os.path.join(temp_dir, "bench.mid")
+            bench_smf.write_midi(path)
+        score = _measure(path, columnar=False)
+        columnar = _measure(path, columnar=True)
+    print(f"{'':16}{'Score':>10}{'Columnar':>10}")
+    print(f"{'bytes per note':16}{score[0]:10.0f}{columnar[0]:10.0f}")
+    for name, score_time, columnar_time in zip(
+        ("read", "iterate", "crop"), score[1:], columnar[1:]
+    ):
+        print(f"{name:16}{score_time:9.3f}s{columnar_time:9.3f}s")
+
+
+if __name__ == "__main__":
+    main()
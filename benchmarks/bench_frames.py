@@ -0,0 +1,88 @@
+"""Time the per-frame work of midani_plot (traversing the notes to build the
+rect and line tuples and emit their primitives, and culling and flushing the
+primitives to the plot boss) with a plot boss that discards what it is asked
+to draw, so that only midani's own work is measured. Also print how many
+primitives per frame were drawn and culled.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_frames [MIDI_FILE]
+"""
+import contextlib
+import os
+import random
+import sys
+import time
+
+from midani import midani_misc_classes
+from midani import midani_plot
+from midani import midani_score
+from midani import midani_settings
+from midani import midani_time
+
+DEFAULT_MIDI_FILE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "..",
+    "sample_music",
+    "effrhy_732.mid",
+)
+NUM_FRAMES = 200
+
+
+class NullBoss:
+    """Counts draw calls instead of drawing."""
+
+    def __init__(self):
+        self.plot_count = 0
+
+    @contextlib.contextmanager
+    def make_png(self, window):  # pylint: disable=unused-argument
+        yield
+        self.plot_count += 1
+
+    def plot_rect(self, *args, **kwargs):
+        pass
+
+    def plot_line(self, *args, **kwargs):
+        pass
+
+
+def main():
+    random.seed(0)
+    midi_fname = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MIDI_FILE
+    settings = midani_settings.Settings(midi_fname=midi_fname, midi_cache=False)
+    score = midani_score.read_score(settings)
+    tempo_changes = midani_time.TempoChanges(score)
+    settings.update_from_score(score, tempo_changes)
+    score = midani_score.crop_score(score, settings, tempo_changes)
+    table = midani_misc_classes.PitchTable(score, settings, tempo_changes)
+    window = midani_misc_classes.Window(settings)
+    plot_boss = NullBoss()
+    step = (settings.end_time - settings.start_time) / NUM_FRAMES
+    nows = [settings.start_time + i * step for i in range(NUM_FRAMES)]
+
+    rect_tuples = line_tuples = None
+    buckets = midani_misc_classes.PrimitiveBuckets(settings)
+    traverse_time = flush_time = 0.0
+    for now in nows:
+        window.update(now)
+        with plot_boss.make_png(window):
+            start = time.perf_counter()
+            rect_tuples, line_tuples = midani_plot.get_voice_and_line_tuples(
+                now, settings, table, rect_tuples, line_tuples, window, buckets
+            )
+            traverse_time += time.perf_counter() - start
+            start = time.perf_counter()
+            buckets.flush(plot_boss, window)
+            flush_time += time.perf_counter() - start
+    print(
+        f"{NUM_FRAMES} frames\n"
+        f"  traverse: {1000 * traverse_time / NUM_FRAMES:7.2f} ms per frame\n"
+        f"  flush:    {1000 * flush_time / NUM_FRAMES:7.2f} ms per frame"
+    )
+    print("primitives per frame:")
+    for key, count in sorted(buckets.total_counts.items()):
+        print(f"  {key + ':':10} {count / NUM_FRAMES:7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Compare the per-frame cost of note and line scale factors when they are
+computed as before (settings looked up and scale functions called for every
+note), evaluated directly, or read from lookup tables.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_lookup_tables [MIDI_FILE]
+"""
+import math
+import os
+import sys
+import timeit
+
+from midani import midani_misc_classes
+from midani import midani_plot
+from midani import midani_score
+from midani import midani_settings
+from midani import midani_time
+
+SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
+DEFAULT_MIDI = os.path.join(SCRIPT_PATH, "..", "sample_music", "effrhy_105.mid")
+N_FRAMES = 100
+REPEAT = 5
+
+
+class PerCallPitchTable(midani_misc_classes.PitchTable):
+    """Looks up settings and calls the scale functions on every call, as
+    PitchTable did before scale factors were tabulated."""
+
+    def _per_call(self, t_until, voice_i, end, start, size_attr, voice_size):
+        voice_settings = self.settings[voice_i]
+        if t_until >= 0:
+            return self._get_scale_factor(
+                t_until,
+                getattr(voice_settings, f"frame_{end}"),
+                getattr(voice_settings, f"{end}_{size_attr}"),
+                voice_size(voice_settings),
+                voice_settings.end_scale_function,
+            )
+        return self._get_scale_factor(
+            -t_until,
+            getattr(voice_settings, f"frame_{start}"),
+            getattr(voice_settings, f"{start}_{size_attr}"),
+            voice_size(voice_settings),
+            voice_settings.start_scale_function,
+        )
+
+    def _scale_x_factor(self, t_until, voice_i):
+        return self._per_call(
+            t_until,
+            voice_i,
+            "note_end",
+            "note_start",
+            "width",
+            lambda voice_settings: voice_settings.note_width,
+        )
+
+    def _scale_y_factor(self, t_until, voice_i):
+        return self._per_call(
+            t_until,
+            voice_i,
+            "note_end",
+            "note_start",
+            "height",
+            lambda voice_settings: voice_settings.note_height,
+        )
+
+    def line_scale_factor(self, t_until, voice_i):
+        if t_until >= 0:
+            return self._get_scale_factor(
+                t_until,
+                self.settings[voice_i].frame_line_end,
+                self.settings[voice_i].line_end_size,
+                1,
+                self.settings[voice_i].end_scale_function,
+            )
+        return self._get_scale_factor(
+            -t_until,
+            self.settings[voice_i].frame_line_start,
+            self.settings[voice_i].line_start_size,
+            1,
+            self.settings[voice_i].start_scale_function,
+        )
+
+
+def get_table(midi_fname, lookup_table_max_error, table_cls):
+    settings = midani_settings.Settings(
+        midi_fname=midi_fname,
+        seed=0,
+        # A long frame makes for many visible notes per frame
+        frame_len=30,
+        note_start_height=0.5,
+        note_end_width=2,
+        start_scale_function=lambda x: (1 - math.cos(math.pi * x)) / 2,
+        end_scale_function=lambda x: x * x * (3 - 2 * x),
+        lookup_table_max_error=lookup_table_max_error,
+    )
+    score = midani_score.read_score(settings)
+    tempo_changes = midani_time.TempoChanges(score)
+    settings.update_from_score(score, tempo_changes)
+    score = midani_score.crop_score(score, settings, tempo_changes)
+    table = table_cls(score, settings, tempo_changes)
+    return settings, table
+
+
+def get_visible(settings, table):
+    step = (settings.end_time - settings.start_time) / N_FRAMES
+    visible = []
+    for frame_i in range(N_FRAMES):
+        now = settings.start_time + frame_i * step
+        visible.append(
+            [
+                (note.start - now, voice_i)
+                for voice_i, voice in zip(settings.voice_order, table)
+                for note in voice
+                if -settings.frame_len < note.start - now < settings.frame_len
+            ]
+        )
+    return visible
+
+
+def time_scale_factors(table, visible):
+    """Returns seconds per frame spent on scale factors."""
+
+    def _evaluations():
+        for notes in visible:
+            for t_until, voice_i in notes:
+                table.scale_factors(t_until, voice_i)
+                table.line_scale_factor(t_until, voice_i)
+
+    return min(timeit.repeat(_evaluations, number=1, repeat=REPEAT)) / N_FRAMES
+
+
+def time_frames(settings, table):
+    """Returns seconds per frame for get_voice_and_line_tuples()."""
+    step = (settings.end_time - settings.start_time) / N_FRAMES
+
+    def _frames():
+        for frame_i in range(N_FRAMES):
+            midani_plot.get_voice_and_line_tuples(
+                settings.start_time + frame_i * step, settings, table
+            )
+
+    return min(timeit.repeat(_frames, number=1, repeat=REPEAT)) / N_FRAMES
+
+
+def main():
+    midi_fname = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MIDI
+    results = {}
+    for label, max_error, table_cls in (
+        ("per-call lookups", 0, PerCallPitchTable),
+        ("direct evaluation", 0, midani_misc_classes.PitchTable),
+        (
+            "lookup tables",
+            midani_settings.Settings.lookup_table_max_error,
+            midani_misc_classes.PitchTable,
+        ),
+    ):
+        settings, table = get_table(midi_fname, max_error, table_cls)
+        visible = get_visible(settings, table)
+        results[label] = (
+            time_scale_factors(table, visible),
+            time_frames(settings, table),
+        )
+    n_notes = sum(len(voice) for voice in table)
+    n_visible = sum(len(notes) for notes in visible) / N_FRAMES
+    print(f"{midi_fname}: {n_notes} notes, {N_FRAMES} frames")
+    print(f"{n_visible:.0f} visible notes per frame on average")
+    for label, (scale_factors, frame) in results.items():
+        print(
+            f"{label + ':':<20}{scale_factors * 1000:8.3f} ms/frame scale "
+            f"factors, {frame * 1000:8.3f} ms/frame total"
+        )
+    baseline, baseline_frame = results["per-call lookups"]
+    tabulated, tabulated_frame = results["lookup tables"]
+    print(
+        f"saving: {(1 - tabulated / baseline) * 100:.1f}% of scale factors, "
+        f"{(1 - tabulated_frame / baseline_frame) * 100:.1f}% of total"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compare reading the whole of a large midi file and then cropping it with
+reading just the window with a midani_seek index, for a window near the end
+of the file (as when previewing a late section).
+
+Without an argument, the synthetic file from bench_smf is used.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_seek [MIDI_FILE]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+from midani import midani_seek
+from midani import midani_smf
+
+from . import bench_smf
+
+REPEAT = 3
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if len(sys.argv) > 1:
+            path = sys.argv[1]
+        else:
+            path = os.path.join(temp_dir, "bench.mid")
+            bench_smf.write_midi(path)
+        score = midani_smf.read_smf(path, columnar=True)
+        total_len = score.get_total_len()
+        start, end = 9 * total_len // 10, 19 * total_len // 20
+
+        def _full():
+            midani_smf.read_smf(path, columnar=True).get_passage(start, end)
+
+        def _window():
+            midani_seek.get_index(path, temp_dir).read_window(
+                start, end
+            ).get_passage(start, end)
+
+        build_time = min(
+            timeit.repeat(
+                lambda: midani_seek.SeekIndex.build(path),
+                number=1,
+                repeat=REPEAT,
+            )
+        )
+        full_time = min(timeit.repeat(_full, number=1, repeat=REPEAT))
+        _window()
+        midani_seek._INDEXES.clear()  # pylint: disable=protected-access
+        load_time = min(
+            timeit.repeat(
+                lambda: midani_seek.get_index(path, temp_dir),
+                number=1,
+                repeat=1,
+            )
+        )
+        window_time = min(timeit.repeat(_window, number=1, repeat=REPEAT))
+        index_size = os.path.getsize(midani_seek.index_path(path, temp_dir))
+    print(
+        f"{len(score)} notes, window from {start} to {end} of {total_len} "
+        "ticks\n"
+        f"  build index:           {build_time:7.3f} s ({index_size} bytes)\n"
+        f"  load index:            {load_time:7.3f} s\n"
+        f"  full read and crop:    {full_time:7.3f} s\n"
+        f"  window read and crop:  {window_time:7.3f} s "
+        f"({full_time / window_time:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
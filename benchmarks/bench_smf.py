@@ -0,0 +1,111 @@
+"""Compare reading a large midi file with
+midi_funcs.read_midi_to_internal_data() (mido) and midani_smf.read_smf().
+
+Without an argument, a synthetic performance-style file (many short notes
+with pitch bends and sustain pedal changes) is written to a temporary
+directory and read.
+
+The file is also read with its tracks read in parallel, with one worker
+process per CPU.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_smf [MIDI_FILE]
+"""
+import concurrent.futures
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+import mido
+
+import midani.from_my_other_projects.midi_funcs as midi_funcs
+from midani import midani_smf
+
+N_TRACKS = 8
+N_NOTES_PER_TRACK = 20000
+REPEAT = 3
+
+
+def write_midi(path):
+    random.seed(0)
+    mid = mido.MidiFile()
+    meta_track = mido.MidiTrack()
+    meta_track.append(mido.MetaMessage("set_tempo", tempo=500000))
+    mid.tracks.append(meta_track)
+    for track_i in range(N_TRACKS):
+        track = mido.MidiTrack()
+        for i in range(N_NOTES_PER_TRACK):
+            note = random.randrange(36, 96)
+            track.append(
+                mido.Message(
+                    "pitchwheel",
+                    channel=track_i,
+                    pitch=0,
+                    time=random.randrange(60),
+                )
+            )
+            track.append(
+                mido.Message(
+                    "control_change",
+                    channel=track_i,
+                    control=64,
+                    value=127 * (i % 2),
+                )
+            )
+            track.append(
+                mido.Message("note_on", channel=track_i, note=note, velocity=80)
+            )
+            track.append(
+                mido.Message(
+                    "note_off",
+                    channel=track_i,
+                    note=note,
+                    time=random.randrange(1, 240),
+                )
+            )
+        mid.tracks.append(track)
+    mid.save(path)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if len(sys.argv) > 1:
+            path = sys.argv[1]
+        else:
+            path = os.path.join(temp_dir, "bench.mid")
+            write_midi(path)
+        mido_time = min(
+            timeit.repeat(
+                lambda: midi_funcs.read_midi_to_internal_data(path),
+                number=1,
+                repeat=REPEAT,
+            )
+        )
+        smf_time = min(
+            timeit.repeat(
+                lambda: midani_smf.read_smf(path), number=1, repeat=REPEAT
+            )
+        )
+        num_processes = os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(num_processes) as executor:
+            parallel_time = min(
+                timeit.repeat(
+                    lambda: midani_smf.read_smf(path, executor=executor),
+                    number=1,
+                    repeat=REPEAT,
+                )
+            )
+        n_notes = len(midani_smf.read_smf(path))
+    print(
+        f"{n_notes} notes\n"
+        f"  mido:     {mido_time:7.2f} s\n"
+        f"  read_smf: {smf_time:7.2f} s ({mido_time / smf_time:.1f}x)\n"
+        f"  read_smf with {num_processes} processes: {parallel_time:7.2f} s "
+        f"({mido_time / parallel_time:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compare converting many beat times to clock times one at a time with
+converting them in a single call to TempoChanges.ctimes_from_btimes().
+
+The score has a dense tempo map (a tempo change every sixteenth note), as
+produced by e.g. rubato or accelerandi exported from a DAW.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_tempo_map [N_TEMPO_CHANGES] [N_TIMES]
+"""
+import random
+import sys
+import timeit
+
+import mido
+import numpy as np
+
+import midani.from_my_other_projects.note_classes as note_classes
+from midani import midani_time
+
+N_TEMPO_CHANGES = 5000
+N_TIMES = 100000
+REPEAT = 5
+
+
+def build_score(n_tempo_changes):
+    score = note_classes.Score()
+    for i in range(n_tempo_changes):
+        msg = mido.MetaMessage(
+            "set_tempo", tempo=mido.bpm2tempo(random.uniform(60, 180))
+        )
+        msg.time = i / 4
+        score.meta_messages.append(msg)
+    return score
+
+
+def main():
+    n_tempo_changes = (
+        int(sys.argv[1]) if len(sys.argv) > 1 else N_TEMPO_CHANGES
+    )
+    n_times = int(sys.argv[2]) if len(sys.argv) > 2 else N_TIMES
+    random.seed(0)
+    score = build_score(n_tempo_changes)
+    tempo_changes = midani_time.TempoChanges(score)
+    beat_times = np.sort(
+        np.random.default_rng(0).uniform(0, n_tempo_changes / 4, n_times)
+    )
+    beat_list = beat_times.tolist()
+
+    scalar = min(
+        timeit.repeat(
+            lambda: [tempo_changes.ctime_from_btime(t) for t in beat_list],
+            number=1,
+            repeat=REPEAT,
+        )
+    )
+    vector = min(
+        timeit.repeat(
+            lambda: tempo_changes.ctimes_from_btimes(beat_times),
+            number=1,
+            repeat=REPEAT,
+        )
+    )
+    print(
+        f"{n_times} times, {n_tempo_changes} tempo changes\n"
+        f"  scalar:     {scalar * 1000:9.2f} ms\n"
+        f"  vectorized: {vector * 1000:9.2f} ms ({scalar / vector:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Compare the parse, crop and clock-time conversion stages with note times
+stored as fractions of a beat and as integer midi ticks.
+
+Without an argument, the synthetic file from bench_smf is used.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_ticks [MIDI_FILE]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+from midani import midani_smf
+from midani import midani_time
+
+from . import bench_smf
+
+REPEAT = 3
+
+
+def _stages(path, ticks):
+    def _parse():
+        return midani_smf.read_smf(path, ticks=ticks)
+
+    score = _parse()
+    tempo_changes = midani_time.TempoChanges(score)
+    total_len = score.get_total_len()
+
+    def _crop():
+        # The middle third of the score
+        return score.get_passage(
+            passage_start_time=total_len / 3,
+            passage_end_time=2 * total_len / 3,
+        )
+
+    def _convert():
+        for voice in score.voices:
+            tempo_changes.ctimes_from_ticks(
+                [note.attack_time for note in voice]
+            )
+
+    return [
+        min(timeit.repeat(stage, number=1, repeat=REPEAT))
+        for stage in (_parse, _crop, _convert)
+    ]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if len(sys.argv) > 1:
+            path = sys.argv[1]
+        else:
+            path = os.path.join(temp_dir, "bench.mid")
+            bench_smf.write_midi(path)
+        beats = _stages(path, ticks=False)
+        ticks = _stages(path, ticks=True)
+    print(f"{'':10}{'beats':>10}{'ticks':>10}")
+    for name, beat_time, tick_time in zip(
+        ("parse", "crop", "convert"), beats, ticks
+    ):
+        print(f"{name:10}{beat_time:9.3f}s{tick_time:9.3f}s")
+
+
+if __name__ == "__main__":
+    main()
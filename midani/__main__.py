@@ -1,4 +1,5 @@
 import argparse
+import contextlib
 import os
 import re
 import shutil
@@ -6,6 +7,9 @@ import sys
 import typing as t
 
 from . import midani_av
+from . import midani_frame_store
+from . import midani_live
+from . import midani_live_midi
 from . import midani_plot
 from . import midani_settings
 
@@ -20,8 +24,12 @@ specified with the "midi_fname" keyword argument in a settings file provided wit
 -s/--settings."""
 
 
-def parse_args():
-    parser = argparse.ArgumentParser(description=ARGPARSE_DESCRIPTION)
+MERGE_DESCRIPTION = """Merge the videos (or frame stores) rendered by shards
+with --frame-range into the complete video, adding audio if there is any. Pass
+the same midi file and settings as were used to render the shards."""
+
+
+def _add_settings_args(parser):
     parser.add_argument("-m", "--midi", help="path to midi file to animate")
     parser.add_argument(
         "-a", "--audio", help="path to audio file to add to video"
@@ -46,7 +54,13 @@ def parse_args():
         ),
         action="store_true",
     )
-    parser.add_argument(
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=ARGPARSE_DESCRIPTION)
+    _add_settings_args(parser)
+    frames_group = parser.add_mutually_exclusive_group()
+    frames_group.add_argument(
         "-f",
         "--frames",
         help=(
@@ -58,12 +72,46 @@ def parse_args():
         type=get_frames,
         default=None,
     )
+    frames_group.add_argument(
+        "--frame-range",
+        help=(
+            "render only frames START to END - 1 (counting from 0) of the "
+            "video, as a shard to be joined with the others by "
+            "'midani merge'. Pass START:END, or START: to render to the end."
+        ),
+        type=get_frame_range,
+        default=None,
+    )
+    frames_group.add_argument(
+        "--live",
+        help=(
+            "play the video in real time (rendering with matplotlib), "
+            "lowering the quality if rendering falls behind, rather than "
+            "making a video file. Pass 'stdout' to write raw bgr24 video to "
+            "stdout (e.g., to pipe to ffplay), or 'http' to serve it as MJPEG "
+            "on localhost (see the live_http_port setting)."
+        ),
+        choices=("stdout", "http"),
+        default=None,
+    )
+    parser.add_argument(
+        "--midi-in",
+        help=(
+            "with --live, play midi as it arrives from MIDI_IN rather than a "
+            "midi file: '-' (stdin), 'tcp://HOST:PORT' (accept a connection), "
+            "or the path of a named pipe, device, or file that is being "
+            "appended to. The midi must be raw midi messages."
+        ),
+        default=None,
+    )
     parser.add_argument(
         "--mpl",
         help=("use matplotlib (rather than R) for plotting. Much slower."),
         action="store_true",
     )
     args = parser.parse_args()
+    if args.midi_in is not None and args.live is None:
+        parser.error("--midi-in requires --live")
     return (
         args.midi,
         args.audio,
@@ -71,10 +119,37 @@ def parse_args():
         args.settings,
         args.eval,
         args.frames,
+        args.frame_range,
+        args.live,
+        args.midi_in,
         args.mpl,
     )
 
 
+def parse_merge_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="midani merge", description=MERGE_DESCRIPTION
+    )
+    _add_settings_args(parser)
+    parser.add_argument(
+        "shards",
+        nargs="+",
+        help=(
+            "paths to the videos or frame stores output by the shards (list "
+            "them before -s/--settings, which takes any number of paths)"
+        ),
+    )
+    args = parser.parse_args(argv)
+    return (
+        args.midi,
+        args.audio,
+        args.test,
+        args.settings,
+        args.eval,
+        args.shards,
+    )
+
+
 def check_requirements(mpl):
     if not mpl:
         if not shutil.which("Rscript"):
@@ -98,20 +173,12 @@ def check_requirements(mpl):
             sys.exit(1)
 
 
-def main():
-
-    print("Midani: make piano-roll animations from midi files")
-    print("==================================================")
-    print("https://github.com/malcolmsailor/midani\n")
-    (
-        midi_path,
-        audio_path,
-        test_flag,
-        user_settings_paths,
-        use_eval,
-        frame_list,
-        mpl,
-    ) = parse_args()
+def read_settings(
+    midi_path, audio_path, test_flag, user_settings_paths, use_eval, **kwargs
+) -> midani_settings.Settings:
+    """Returns the Settings given by the command-line arguments. kwargs
+    override the settings files.
+    """
     if user_settings_paths is None:
         user_settings = {}
     else:
@@ -119,7 +186,10 @@ def main():
             user_settings_paths, use_eval
         )
     if midi_path is None:
-        if "midi_fname" not in user_settings or not user_settings["midi_fname"]:
+        if not user_settings.get("midi_fname") and not (
+            kwargs.get("midi_live_input")
+            or user_settings.get("midi_live_input")
+        ):
             print(NO_PATH_MSG)
             sys.exit(1)
     else:
@@ -136,12 +206,160 @@ def main():
         else:
             user_settings["frame_increment"] = 0.5
         user_settings["_test"] = True
-    settings = midani_settings.Settings(**user_settings)
+    user_settings.update(kwargs)
+    # Unlike library use, the command line caches scores unless told not to
+    user_settings.setdefault("midi_cache", True)
+    return midani_settings.Settings(**user_settings)
+
+
+def _print_banner():
+    print("Midani: make piano-roll animations from midi files")
+    print("==================================================")
+    print("https://github.com/malcolmsailor/midani\n")
+
+
+def merge(argv):
+    (
+        midi_path,
+        audio_path,
+        test_flag,
+        user_settings_paths,
+        use_eval,
+        shard_fnames,
+    ) = parse_merge_args(argv)
+    settings = read_settings(
+        midi_path,
+        audio_path,
+        test_flag,
+        user_settings_paths,
+        use_eval,
+        frame_range=None,
+    )
+    try:
+        success = midani_av.merge_shards(settings, shard_fnames)
+    except ValueError as exc:
+        sys.exit(f"Fatal error: {exc}")
+    if not success:
+        print("Merging failed.")
+        sys.exit(1)
+    if settings.audio_fname:
+        midani_av.add_audio(settings)
+    print(f"The output file is\n{settings.video_fname}")
+
+
+def live(settings, output, stdout):
+    """Plays the video in real time to output ("stdout", i.e., to the binary
+    file stdout, or "http").
+    """
+    if output == "stdout":
+        sink = midani_live.RawVideoSink(stdout)
+        print(
+            f"Writing {settings.out_width}x{settings.out_height} bgr24 video "
+            f"at {settings.fps:g} fps to stdout. To play it, pipe it to\n"
+            "ffplay -f rawvideo -pixel_format bgr24 -video_size "
+            f"{settings.out_width}x{settings.out_height} "
+            f"-framerate {settings.fps:g} -"
+        )
+    else:
+        sink = midani_live.MJPEGServer(
+            settings.live_http_port, settings.live_jpeg_quality
+        )
+        print(f"Serving the video at\n{sink.url}")
+    if settings.midi_live_input:
+        print(f"Playing midi from {settings.midi_live_input}")
+        player = midani_live_midi.LiveMidiPlayer(
+            settings,
+            sink,
+            midani_live_midi.MidiInput(settings.midi_live_input),
+        )
+    else:
+        player = midani_live.Player(settings, sink)
+    try:
+        player.play()
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # The reader of stdout has gone; don't complain when stdout is
+        # flushed on exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), stdout.fileno())
+    finally:
+        if output == "http":
+            sink.close()
+    stats = player.stats
+    print(
+        f"\nShowed {stats.shown} frames, skipped {stats.skipped}; "
+        f"{stats.missed} missed their deadlines. Longest render: "
+        f"{stats.max_render_time:.3f}s (budget: "
+        f"{settings.frame_increment:.3f}s)"
+    )
+
+
+def main():
+    if sys.argv[1:2] == ["merge"]:
+        _print_banner()
+        merge(sys.argv[2:])
+        return
+    (
+        midi_path,
+        audio_path,
+        test_flag,
+        user_settings_paths,
+        use_eval,
+        frame_list,
+        frame_range,
+        live_output,
+        midi_in,
+        mpl,
+    ) = parse_args()
+    if live_output is not None:
+        check_requirements(mpl=True)
+        stdout = sys.stdout.buffer
+        # When the video is written to stdout, everything else is printed to
+        # stderr
+        with contextlib.redirect_stdout(
+            sys.stderr if live_output == "stdout" else sys.stdout
+        ):
+            _print_banner()
+            kwargs = {}
+            if midi_in is not None:
+                kwargs["midi_live_input"] = midi_in
+            settings = read_settings(
+                midi_path,
+                audio_path,
+                test_flag,
+                user_settings_paths,
+                use_eval,
+                **kwargs,
+            )
+            live(settings, live_output, stdout)
+        return
+    _print_banner()
+    kwargs = {}
+    if frame_range is not None:
+        kwargs["frame_range"] = frame_range
+    settings = read_settings(
+        midi_path,
+        audio_path,
+        test_flag,
+        user_settings_paths,
+        use_eval,
+        **kwargs,
+    )
     plot_success = True
     if settings.process_video != "only":
         check_requirements(mpl)
+    encode_video = frame_list is None and settings.process_video != "no"
     if frame_list is not None or settings.process_video != "only":
-        plot_success, n_frames = midani_plot.plot(settings, mpl, frame_list)
+        # The video is encoded while the frames are plotted
+        plot_success, n_frames = midani_plot.plot(
+            settings, mpl, frame_list, encode_video=encode_video
+        )
+    elif settings.frame_format == "raw":
+        with midani_frame_store.FrameStore.open(
+            settings.frame_store_fname
+        ) as store:
+            n_frames = len(store)
+        midani_av.process_video(settings, n_frames)
     else:
         png_pattern = re.compile(
             os.path.basename(settings.png_fname_base) + r"\d+\.png"
@@ -153,15 +371,20 @@ def main():
                 if re.match(png_pattern, f)
             ]
         )
+        midani_av.process_video(settings, n_frames)
     if plot_success:
-        if frame_list is None and settings.process_video != "no":
-            midani_av.process_video(settings, n_frames)
-
-            if settings.audio_fname:
+        if encode_video:
+            # Audio is added to shards when they are merged
+            if settings.audio_fname and settings.frame_range is None:
                 midani_av.add_audio(settings)
 
             print(f"The output file is\n{settings.video_fname}")
-        if frame_list is not None:
+        if (
+            frame_list is not None
+            and midani_plot.saved_frame_format(settings, mpl) == "raw"
+        ):
+            print(f"The {n_frames} frames are in\n{settings.frame_store_fname}")
+        elif frame_list is not None:
             print("The output files are:")
             for i in range(1, n_frames + 1):
                 print(
@@ -197,5 +420,24 @@ def get_frames(in_str: str) -> t.Tuple[float]:
     return tuple(out)
 
 
+def get_frame_range(in_str: str) -> t.Tuple[int, t.Optional[int]]:
+    start, sep, end = in_str.partition(":")
+    try:
+        if not sep:
+            raise ValueError
+        frame_range = (int(start), int(end) if end else None)
+        if frame_range[0] < 0 or (
+            frame_range[1] is not None and frame_range[1] <= frame_range[0]
+        ):
+            raise ValueError
+    except ValueError:
+        sys.exit(
+            "Fatal error: Didn't understand '--frame-range' argument "
+            f"'{in_str}'. Pass START:END, where 0 <= START < END, or START:, "
+            "e.g., '--frame-range 0:1000' or '--frame-range 1000:'"
+        )
+    return frame_range
+
+
 if __name__ == "__main__":
     main()
@@ -81,7 +81,12 @@ def _note_on_handler(
 
 
 def _note_off_handler(
-    note_on_dict, track_i, msg, ticks_per_beat, max_denominator=8192
+    note_on_dict,
+    track_i,
+    msg,
+    ticks_per_beat,
+    max_denominator=8192,
+    ticks=False,
 ):
     """Used by read_midi_to_internal_data()."""
 
@@ -93,6 +98,10 @@ def _note_off_handler(
     tick_attack = note_on_msg.time
 
     tick_dur = tick_release - tick_attack
+    if ticks:
+        return note_classes.Note(
+            pitch, tick_attack, tick_dur, velocity=velocity, choir=channel
+        )
     attack = fractions.Fraction(tick_attack, ticks_per_beat).limit_denominator(
         max_denominator=max_denominator
     )
@@ -142,6 +151,7 @@ def read_midi_to_internal_data(
     min_attack_to_adjust=4,
     split_tracks_to_voices=True,
     split_channels_to_voices=False,
+    ticks=False,
 ) -> note_classes.Score:
     """Reads midi file into a Score() instance.
 
@@ -170,6 +180,12 @@ def read_midi_to_internal_data(
         split_channels_to_voices: boolean. If True, notes from different midi
             channels are mapped to different "voices" in the output Score.
             Default: False
+        ticks: boolean. If True, note attack times and durations, and meta
+            message times, are integer midi ticks rather than fractions of a
+            beat, and the ticks_per_beat attribute of the returned Score is
+            the ticks_per_beat of the midi file. (min_attack_to_adjust is
+            still in beats.)
+            Default: False
 
     Returns:
         Score() instance
@@ -195,7 +211,10 @@ def read_midi_to_internal_data(
         num_voices *= NUM_CHANNELS
 
     internal_data = note_classes.Score(
-        tet=tet, num_voices=num_voices, time_sig=time_sig
+        tet=tet,
+        num_voices=num_voices,
+        time_sig=time_sig,
+        ticks_per_beat=ticks_per_beat if ticks else 1,
     )
     if track_num_offset:
         for voice in internal_data.voices:
@@ -243,6 +262,7 @@ def read_midi_to_internal_data(
                     msg,
                     ticks_per_beat,
                     max_denominator=max_denominator,
+                    ticks=ticks,
                 )
                 voice_i = track_i - 1 if split_tracks_to_voices else 0
                 if split_channels_to_voices:
@@ -251,7 +271,8 @@ def read_midi_to_internal_data(
                     voice_i, note_object, update_sort=False
                 )
             else:
-                msg.time = fractions.Fraction(msg.time, ticks_per_beat)
+                if not ticks:
+                    msg.time = fractions.Fraction(msg.time, ticks_per_beat)
                 if track_i == 0:
                     internal_data.add_meta_message(msg)
                 else:
@@ -260,6 +281,20 @@ def read_midi_to_internal_data(
         # if track_i != 0:
         # internal_data.voices[track_i - 1].update_sort()
 
+    return finish_score(
+        internal_data,
+        first_note_at_0,
+        min_attack_to_adjust * internal_data.ticks_per_beat,
+    )
+
+
+def finish_score(internal_data, first_note_at_0, min_attack_to_adjust):
+    """Sorts the voices of a Score read from a midi file, removes any empty
+    voices, and, if first_note_at_0 is True, displaces the score so that the
+    first note is at time 0.
+
+    See read_midi_to_internal_data() for the arguments.
+    """
     for voice in internal_data.voices:
         voice.update_sort()
     internal_data.remove_empty_voices()
@@ -694,6 +694,10 @@ class Score:
         total_len: Total length of the music that will be stored. Only used
             in calculation of "harmony_times_dict", so you can add notes
             beyond this time without consequence.
+        ticks_per_beat: the number of units of time per beat. If 1 (the
+            default), times are in beats (and are usually fractions).
+            Scores read from midi files with ticks=True store times as
+            integer midi ticks, and this is the ticks_per_beat of the file.
 
     """
 
@@ -1048,7 +1052,9 @@ class Score:
                 *end* before passage_end_time (inclusive) are included. Default True.
         """
         passage = Score(
-            tet=self.tet, harmony_times_dict=self.harmony_times_dict
+            tet=self.tet,
+            harmony_times_dict=self.harmony_times_dict,
+            ticks_per_beat=self.ticks_per_beat,
         )
         for voice in self.voices:
             new_voice = voice.get_passage(
@@ -1258,6 +1264,7 @@ class Score:
         ranges=(None,),
         time_sig=None,
         existing_score=None,
+        ticks_per_beat=1,
     ):
 
         if harmony_times_dict:
@@ -1283,6 +1290,7 @@ class Score:
         self.num_voices = 0
         self.time_sig = time_sig
         self.attacks_adjusted_by = 0
+        self.ticks_per_beat = ticks_per_beat
 
         for i in range(num_voices):
             self.add_voice(voice_range=ranges[i % len(ranges)])
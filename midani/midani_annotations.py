@@ -35,18 +35,17 @@ class Lyricist:
         else:
             self.next_time, self.next_lyric = next(self.lyrics)
 
-    def _update(self, now=None):
-        if self.next_time is None:
-            return
-        if now is not None:
-            if now < self.next_time:
-                return
-        self.prev_time, self.prev_lyric = self.next_time, self.next_lyric
-        try:
-            self.next_time, self.next_lyric = next(self.lyrics)
-        except StopIteration:
-            self.next_time = self.next_lyric = None
+    def _update(self, now):
+        # Several lyrics may have passed since the last call (e.g., if they
+        # are less than a frame apart, or the first frame is well into the
+        # video), in which case the last of them is current
+        while self.next_time is not None and now >= self.next_time:
+            self.prev_time, self.prev_lyric = self.next_time, self.next_lyric
+            try:
+                self.next_time, self.next_lyric = next(self.lyrics)
+            except StopIteration:
+                self.next_time = self.next_lyric = None
 
     def __call__(self, now):
-        self._update(now=now)
+        self._update(now)
         return self.prev_lyric
@@ -1,5 +1,8 @@
 """Functions for compiling video and adding audio.
 """
+import collections
+import concurrent.futures
+import dataclasses
 import os
 import shutil
 import subprocess
@@ -7,20 +10,304 @@ import tempfile
 
 import cv2
 
+from . import midani_frame_store
+from . import midani_settings
 
-def process_video(settings, n):
+# Videos are only encoded in segments if each segment would be at least this
+# many frames long
+MIN_SEGMENT_FRAMES = 150
+
+
+def open_video_writer(settings):
+    """Returns a cv2.VideoWriter that writes settings.video_fname."""
     os.makedirs(os.path.dirname(settings.video_fname), exist_ok=True)
     # After http://tsaith.github.io/combine-images-into-a-video-with-python-3-and-opencv-3.html
 
     # For some reason, pylint doesn't recognize any of the members I
     # import from cv2
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")  # pylint: disable=no-member
-    out = cv2.VideoWriter(  # pylint: disable=no-member
+    return cv2.VideoWriter(  # pylint: disable=no-member
         settings.video_fname,
         fourcc,
         1 / settings.frame_increment,
         (settings.out_width, settings.out_height),
     )
+
+
+def png_path(settings, i):
+    """Returns the path of the png of frame i (counting from 1)."""
+    return (
+        f"{settings.png_fname_base}"
+        f"{str(i).zfill(settings.png_fnum_digits)}.png"
+    )
+
+
+def png_write_params(settings):
+    """Returns the params to pass to cv2.imwrite() to write pngs with
+    settings.png_compression.
+    """
+    if settings.png_compression is None:
+        return []
+    return [
+        cv2.IMWRITE_PNG_COMPRESSION,  # pylint: disable=no-member
+        settings.png_compression,
+    ]
+
+
+def _read_png(img_path, clean_up):
+    # Runs in a worker thread. cv2 releases the GIL while decoding, so several
+    # pngs are decoded at once.
+    frame = cv2.imread(img_path)  # pylint: disable=no-member
+    if frame is not None and clean_up:
+        os.remove(img_path)
+    return frame
+
+
+class PngReader:
+    """Reads pngs in worker threads, ahead of the frames that are being
+    encoded.
+
+    The pngs are decoded by settings.video_decoder_threads threads (if None,
+    the number of CPUs), and at most twice that many decoded frames are held
+    in memory waiting to be encoded. If settings.clean_up_png_files is True,
+    each png is removed by the thread that decoded it.
+
+    Can be used as a context manager, which calls close() on exit.
+    """
+
+    def __init__(self, settings, num_threads=None):
+        self.settings = settings
+        if num_threads is None:
+            num_threads = settings.video_decoder_threads or os.cpu_count() or 1
+        self.prefetch = 2 * num_threads
+        self._executor = concurrent.futures.ThreadPoolExecutor(num_threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def read(self, first, last):
+        """Yields (i, frame) for the pngs of frames first to last (inclusive,
+        counting from 1), in order. frame is None if the png couldn't be
+        read.
+        """
+        futures = collections.deque()
+        next_i = first
+        for i in range(first, last + 1):
+            while next_i <= last and len(futures) < self.prefetch:
+                futures.append(
+                    self._executor.submit(
+                        _read_png,
+                        png_path(self.settings, next_i),
+                        self.settings.clean_up_png_files,
+                    )
+                )
+                next_i += 1
+            yield i, futures.popleft().result()
+
+    def write(self, out, first, last, progress=None) -> bool:
+        """Writes the pngs of frames first to last (inclusive, counting from
+        1) to the cv2.VideoWriter out, calling progress(i) (if passed) before
+        writing frame i.
+
+        Returns False if any png couldn't be read.
+        """
+        success = True
+        for i, frame in self.read(first, last):
+            if progress is not None:
+                progress(i)
+            if frame is None:
+                print(f"\nError: couldn't read {png_path(self.settings, i)}")
+                success = False
+                continue
+            out.write(frame)
+        return success
+
+
+@dataclasses.dataclass
+class _SegmentSettings:
+    """The settings needed to encode a segment, which, unlike Settings, can be
+    pickled and sent to a worker process.
+    """
+
+    png_fname_base: str
+    png_fnum_digits: int
+    clean_up_png_files: bool
+    frame_format: str
+    frame_store_fname: str
+    frame_increment: float
+    out_width: int
+    out_height: int
+    video_fname: str
+
+
+def _segment_bounds(n, n_segments):
+    """Returns a list of (first frame, last frame) tuples that divide frames 1
+    to n into n_segments segments of (almost) equal length.
+    """
+    return [
+        (i * n // n_segments + 1, (i + 1) * n // n_segments)
+        for i in range(n_segments)
+    ]
+
+
+def _num_segments(settings, n):
+    num_processes = settings.video_encoder_processes or os.cpu_count() or 1
+    if num_processes < 2 or not shutil.which("ffmpeg"):
+        return 1
+    return max(1, min(num_processes, n // MIN_SEGMENT_FRAMES))
+
+
+def _write_frames(out, settings, first, last, progress=None, num_threads=None):
+    """Writes frames first to last (inclusive, counting from 1) to the
+    cv2.VideoWriter out, from png files or, if settings.frame_format is
+    "raw", from the frame store. See PngReader.write().
+    """
+    if settings.frame_format != "raw":
+        with PngReader(settings, num_threads) as reader:
+            return reader.write(out, first, last, progress=progress)
+    with midani_frame_store.FrameStore.open(
+        settings.frame_store_fname
+    ) as store:
+        for i in range(first, last + 1):
+            if progress is not None:
+                progress(i)
+            out.write(store[i - 1])
+    return True
+
+
+def _encode_segment(segment_settings, first, last, num_threads) -> bool:
+    # Runs in a worker process
+    out = open_video_writer(segment_settings)
+    success = _write_frames(
+        out, segment_settings, first, last, num_threads=num_threads
+    )
+    out.release()
+    return success
+
+
+def _concat_segments(segment_fnames, video_fname) -> bool:
+    """Joins the segments into video_fname with ffmpeg's concat demuxer,
+    without re-encoding them.
+    """
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".txt", encoding="utf-8", delete=False
+    ) as outf:
+        list_fname = outf.name
+        for segment_fname in segment_fnames:
+            # Single quotes are escaped as in a shell
+            escaped = segment_fname.replace("'", "'\\''")
+            outf.write(f"file '{escaped}'\n")
+    try:
+        proc = subprocess.run(
+            [
+                "ffmpeg",
+                "-y",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                list_fname,
+                "-c",
+                "copy",
+                video_fname,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            check=False,
+        )
+    finally:
+        os.remove(list_fname)
+    if proc.returncode != 0:
+        print(f"ffmpeg returned error code {proc.returncode}")
+        print(proc.stdout.decode())
+        return False
+    return True
+
+
+def _process_segments(settings, n, n_segments) -> bool:
+    """Encodes frames 1 to n as n_segments segments in parallel worker
+    processes, then joins them.
+
+    Each segment is encoded by its own VideoWriter, so it begins with a
+    keyframe, and the segments can be joined without re-encoding.
+    """
+    print(
+        f"Building {settings.video_fname} from {n_segments} segments "
+        "encoded in parallel..."
+    )
+    os.makedirs(os.path.dirname(settings.video_fname), exist_ok=True)
+    num_threads = max(
+        1,
+        (settings.video_decoder_threads or os.cpu_count() or 1) // n_segments,
+    )
+    segment_kwargs = {
+        field.name: getattr(settings, field.name)
+        for field in dataclasses.fields(_SegmentSettings)
+    }
+    root, ext = os.path.splitext(os.path.basename(settings.video_fname))
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(settings.video_fname)
+    ) as temp_dir:
+        segment_fnames = [
+            os.path.join(temp_dir, f"{root}_{i:04d}{ext}")
+            for i in range(n_segments)
+        ]
+        with concurrent.futures.ProcessPoolExecutor(n_segments) as executor:
+            futures = [
+                executor.submit(
+                    _encode_segment,
+                    _SegmentSettings(
+                        **dict(segment_kwargs, video_fname=segment_fname)
+                    ),
+                    first,
+                    last,
+                    num_threads,
+                )
+                for segment_fname, (first, last) in zip(
+                    segment_fnames, _segment_bounds(n, n_segments)
+                )
+            ]
+            success = all([future.result() for future in futures])
+        print("Joining segments...")
+        success = (
+            _concat_segments(segment_fnames, settings.video_fname) and success
+        )
+    print("Done.")
+    return success
+
+
+def process_video(settings, n) -> bool:
+    """Encodes frames 1 to n into settings.video_fname.
+
+    The frames are read from png files or, if settings.frame_format is "raw",
+    from the frame store at settings.frame_store_fname. Either way, they are
+    removed afterwards if settings.clean_up_png_files is True.
+
+    If settings.video_encoder_processes (or, if it is None, the number of
+    CPUs) is more than 1, the video is long enough, and ffmpeg is available,
+    the video is encoded in segments in parallel (see _process_segments()).
+
+    Returns False if any png couldn't be read.
+    """
+    n_segments = _num_segments(settings, n)
+    if n_segments > 1:
+        success = _process_segments(settings, n, n_segments)
+    else:
+        success = _process_sequentially(settings, n)
+    if settings.frame_format == "raw" and settings.clean_up_png_files:
+        os.remove(settings.frame_store_fname)
+    return success
+
+
+def _process_sequentially(settings, n) -> bool:
+    out = open_video_writer(settings)
     try:
         terminal_width = os.get_terminal_size().columns
     except OSError:  # Thrown when running with pytest
@@ -33,20 +320,105 @@ def process_video(settings, n):
     else:
         print_png = settings.png_fname_base
     print(f"Building {settings.video_fname}...")
-    for i in range(1, n):
+
+    def _progress(i):
         str_i = str(i).zfill(settings.png_fnum_digits)
-        img_path = f"{settings.png_fname_base}{str_i}.png"
-        print(f"\rAdding {print_png}{str_i}.png", end="")
-        frame = cv2.imread(img_path)  # pylint: disable=no-member
-        if frame is None:
-            print(f"\nError: couldn't read {img_path}")
-        elif settings.clean_up_png_files:
-            os.remove(img_path)
-        out.write(frame)
+        if settings.frame_format == "raw":
+            print(f"\rAdding frame {str_i}", end="")
+        else:
+            print(f"\rAdding {print_png}{str_i}.png", end="")
+
+    success = _write_frames(out, settings, 1, n, progress=_progress)
     print("\nDone.")
 
     out.release()
     cv2.destroyAllWindows()  # pylint: disable=no-member
+    return success
+
+
+def _check_shards(shard_fnames):
+    """Returns shard_fnames sorted by their first frames.
+
+    Raises:
+        ValueError if they aren't all named like the output files of shards
+            (see Settings.frame_range), aren't all videos or all frame
+            stores, or don't cover the whole video (from frame 0 to the
+            end) without gaps or overlaps.
+    """
+    shards = []
+    for shard_fname in shard_fnames:
+        frame_range = midani_settings.parse_shard_suffix(shard_fname)
+        if frame_range is None:
+            raise ValueError(
+                f"{shard_fname} isn't named like the output of a shard"
+            )
+        shards.append((frame_range, shard_fname))
+    shards.sort(key=lambda shard: shard[0][0])
+    first_start = shards[0][0][0]
+    if first_start != 0:
+        raise ValueError(f"No shard contains frames 0 to {first_start - 1}")
+    last_end = shards[-1][0][1]
+    if last_end is not None:
+        raise ValueError(f"No shard contains the frames from {last_end} on")
+    for ((_, end), shard_fname), ((next_start, _), _) in zip(
+        shards, shards[1:]
+    ):
+        if end is None or end > next_start:
+            raise ValueError(f"{shard_fname} overlaps the next shard")
+        if end < next_start:
+            raise ValueError(
+                f"No shard contains frames {end} to {next_start - 1}"
+            )
+    stores = [
+        shard_fname.endswith(midani_settings.FRAME_STORE_EXT)
+        for _, shard_fname in shards
+    ]
+    if any(stores) and not all(stores):
+        raise ValueError("Can't merge frame stores with videos")
+    return [shard_fname for _, shard_fname in shards]
+
+
+def merge_shards(settings, shard_fnames) -> bool:
+    """Joins the videos or frame stores output by shards (see
+    Settings.frame_range) into settings.video_fname.
+
+    Videos are joined with ffmpeg's concat demuxer, without re-encoding (or,
+    if ffmpeg isn't available, are re-encoded with OpenCV). Frame stores are
+    encoded.
+
+    Returns False if joining the videos failed.
+
+    Raises:
+        ValueError if the shards can't be merged (see _check_shards()).
+    """
+    shard_fnames = _check_shards(shard_fnames)
+    os.makedirs(os.path.dirname(settings.video_fname), exist_ok=True)
+    print(f"Merging {len(shard_fnames)} shards into {settings.video_fname}")
+    if shard_fnames[0].endswith(midani_settings.FRAME_STORE_EXT):
+        out = open_video_writer(settings)
+        for shard_fname in shard_fnames:
+            with midani_frame_store.FrameStore.open(shard_fname) as store:
+                for frame in store:
+                    out.write(frame)
+        out.release()
+        return True
+    if shutil.which("ffmpeg"):
+        return _concat_segments(
+            [os.path.abspath(shard_fname) for shard_fname in shard_fnames],
+            settings.video_fname,
+        )
+    print("ffmpeg not found! Re-encoding shards with OpenCV.")
+    out = open_video_writer(settings)
+    for shard_fname in shard_fnames:
+        cap = cv2.VideoCapture(shard_fname)  # pylint: disable=no-member
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            out.write(frame)
+        cap.release()
+    out.release()
+    return True
 
 
 def add_audio(settings):
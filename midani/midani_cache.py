@@ -0,0 +1,254 @@
+"""Provides an on-disk cache of scores read from midi files.
+
+Each entry is a directory whose name is the cache key (see cache_key()). It
+contains one .npy file for each column of the score (pitch, attack, etc.),
+with the notes of all the voices concatenated, and a JSON file with
+everything else. The .npy files are loaded memory-mapped, so loading a
+cached score doesn't read the notes until they are used, and the voices of
+the loaded score are views onto the mapped files (this is safe since
+ColumnarVoice never modifies its arrays in place).
+
+The seek indexes of midani_seek are saved in a subdirectory of the cache
+directory (SEEK_SUBDIR). Each counts as an entry of its own, so that they are
+evicted along with the scores.
+
+When the total size of the cache exceeds its maximum size, the least recently
+used entries are deleted.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import typing
+
+import mido.midifiles.meta
+import numpy as np
+
+from . import midani_notes
+from . import midani_smf
+
+# Change this whenever the contents of entries change. Entries of other
+# versions are never found (since the version is part of the key), and are
+# eventually evicted.
+CACHE_VERSION = 1
+
+COLUMNS = ("pitch", "attack", "dur", "velocity", "channel")
+SCORE_FNAME = "score.json"
+SEEK_SUBDIR = "seek"
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+
+def default_cache_dir():
+    """Returns $XDG_CACHE_HOME/midani, or ~/.cache/midani."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "midani")
+
+
+def cache_key(midi_fnames, **read_settings) -> str:
+    """Returns the key of the score read from midi_fnames with read_settings.
+
+    The key depends on the contents of the midi files (not their names or
+    modification times) and the settings, which should include all the
+    settings that affect the score that is read.
+    """
+    key = hashlib.sha256()
+    key.update(
+        json.dumps(
+            [CACHE_VERSION, sorted(read_settings.items())], default=repr
+        ).encode()
+    )
+    for midi_fname in midi_fnames:
+        with open(midi_fname, "rb") as inf:
+            key.update(hashlib.sha256(inf.read()).digest())
+    return key.hexdigest()
+
+
+def _encode_meta_message(msg):
+    # msg.bytes() is [0xFF, meta type, length as variable length int, data]
+    msg_bytes = bytes(msg.bytes())
+    # pylint: disable=protected-access
+    _, data_start = midani_smf._read_var_len(msg_bytes, 2)
+    return [msg.time, msg_bytes[1], msg_bytes[data_start:].hex()]
+
+
+def _decode_meta_message(encoded):
+    time, meta_type, data = encoded
+    msg = mido.midifiles.meta.build_meta_message(
+        meta_type, list(bytes.fromhex(data))
+    )
+    msg.time = time
+    return msg
+
+
+class ScoreCache:
+    """On-disk cache of ColumnarScores. See the module docstring.
+
+    Args:
+        cache_dir: str. Created if it doesn't exist. If empty, the value of
+            default_cache_dir() is used.
+        max_bytes: int. Maximum total size of the cache.
+    """
+
+    def __init__(self, cache_dir="", max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir if cache_dir else default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key) -> typing.Optional[midani_notes.ColumnarScore]:
+        """Returns the cached score, or None if there isn't one."""
+        entry_dir = self._entry_dir(key)
+        score_path = os.path.join(entry_dir, SCORE_FNAME)
+        try:
+            with open(score_path, "r", encoding="utf-8") as inf:
+                contents = json.load(inf)
+            if contents["version"] != CACHE_VERSION:
+                return None
+            columns = [
+                np.load(os.path.join(entry_dir, column + ".npy"), mmap_mode="r")
+                for column in COLUMNS
+            ]
+            score = midani_notes.ColumnarScore(
+                tet=contents["tet"], ticks_per_beat=contents["ticks_per_beat"]
+            )
+            for voice_i, voice_range, start, end in contents["voices"]:
+                score.add_voice(
+                    midani_notes.ColumnarVoice(
+                        *(column[start:end] for column in columns),
+                        voice_i=voice_i,
+                        tet=contents["tet"],
+                        voice_range=(
+                            None if voice_range is None else tuple(voice_range)
+                        ),
+                        presorted=True,
+                    )
+                )
+            score.meta_messages = [
+                _decode_meta_message(encoded)
+                for encoded in contents["meta_messages"]
+            ]
+            score.attacks_adjusted_by = contents["attacks_adjusted_by"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        # The modification time of the score file records when the entry was
+        # last used
+        try:
+            os.utime(score_path)
+        except OSError:
+            pass
+        return score
+
+    def store(self, key, score: midani_notes.ColumnarScore):
+        """Stores score, then evicts least recently used entries if the cache
+        is too large.
+
+        Errors writing to the cache are ignored.
+        """
+        voices = []
+        start = 0
+        for voice in score.voices:
+            voices.append(
+                [voice.voice_i, voice.range, start, start + len(voice)]
+            )
+            start += len(voice)
+        contents = {
+            "version": CACHE_VERSION,
+            "tet": score.tet,
+            "ticks_per_beat": score.ticks_per_beat,
+            "attacks_adjusted_by": score.attacks_adjusted_by,
+            "voices": voices,
+            "meta_messages": [
+                _encode_meta_message(msg) for msg in score.meta_messages
+            ],
+        }
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary directory and then rename it, so that other
+            # processes never see partly written entries
+            temp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp")
+            try:
+                for column in COLUMNS:
+                    np.save(
+                        os.path.join(temp_dir, column + ".npy"),
+                        np.concatenate(
+                            [getattr(voice, column) for voice in score.voices]
+                            or [np.empty(0)]
+                        ),
+                    )
+                with open(
+                    os.path.join(temp_dir, SCORE_FNAME), "w", encoding="utf-8"
+                ) as outf:
+                    json.dump(contents, outf)
+                os.replace(temp_dir, self._entry_dir(key))
+            except (OSError, TypeError):
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise
+            self.evict()
+        except (OSError, TypeError):
+            pass
+
+    def _entries(self):
+        """Returns a list of (last used time, size, entry path) tuples. The
+        entry path is a directory, or the file of a seek index.
+        """
+        out = []
+        try:
+            with os.scandir(
+                os.path.join(self.cache_dir, SEEK_SUBDIR)
+            ) as file_entries:
+                for file_entry in file_entries:
+                    if file_entry.name.startswith("."):
+                        continue
+                    try:
+                        stat = file_entry.stat()
+                    except OSError:
+                        continue
+                    out.append(
+                        (stat.st_mtime_ns, stat.st_size, file_entry.path)
+                    )
+        except OSError:
+            pass
+        with os.scandir(self.cache_dir) as dir_entries:
+            for dir_entry in dir_entries:
+                if (
+                    dir_entry.name.startswith(".")
+                    or dir_entry.name == SEEK_SUBDIR
+                    or not dir_entry.is_dir()
+                ):
+                    continue
+                try:
+                    last_used = os.stat(
+                        os.path.join(dir_entry.path, SCORE_FNAME)
+                    ).st_mtime_ns
+                    size = sum(
+                        file_entry.stat().st_size
+                        for file_entry in os.scandir(dir_entry.path)
+                    )
+                except OSError:
+                    continue
+                out.append((last_used, size, dir_entry.path))
+        return out
+
+    def evict(self):
+        """Deletes least recently used entries until the total size of the
+        cache is no more than max_bytes.
+        """
+        entries = sorted(self._entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total_size <= self.max_bytes:
+                break
+            if os.path.isdir(entry_path):
+                shutil.rmtree(entry_path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    pass
+            total_size -= size
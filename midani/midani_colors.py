@@ -1,5 +1,6 @@
 """Functions for working with colors.
 """
+import functools
 import random
 
 
@@ -10,6 +11,103 @@ def blend_colors(base_color, added_color, blend):
     )
 
 
+_memoized_blend_colors = functools.lru_cache(maxsize=1024)(blend_colors)
+
+
+def cached_blend_colors(base_color, added_color, blend):
+    """As blend_colors(), but memoized, so that blends whose arguments are the
+    same on every frame (e.g., of per-voice settings) return the same tuple
+    rather than constructing a new one each time.
+    """
+    try:
+        return _memoized_blend_colors(base_color, added_color, blend)
+    except TypeError:
+        # Colors given as lists aren't hashable
+        return blend_colors(base_color, added_color, blend)
+
+
+# Blends of packed colors are quantized to multiples of 1 / BLEND_STEPS
+BLEND_STEPS = 4096
+
+# Rounding blend to a multiple of 1 / BLEND_STEPS changes (added - base) *
+# blend by at most 255 / 2 / BLEND_STEPS. Adding this much (in units of
+# 1 / BLEND_STEPS) before flooring means that a blend whose exact value is a
+# whole number isn't floored to the number below (e.g., 200 blended toward
+# 100 by 0.3 is 170, as with blend_colors(), not 169).
+_BLEND_TOLERANCE = 128
+
+
+def _pack_color(color):
+    red, green, blue, alpha = color
+    return red << 24 | green << 16 | blue << 8 | alpha
+
+
+_memoized_pack_color = functools.lru_cache(maxsize=1024)(_pack_color)
+
+
+def pack_color(color) -> int:
+    """Returns an RGBA color tuple packed into an int, 0xRRGGBBAA."""
+    try:
+        return _memoized_pack_color(color)
+    except TypeError:
+        # Colors given as lists aren't hashable
+        return _pack_color(color)
+
+
+def unpack_color(packed):
+    """Inverse of pack_color()."""
+    return (
+        packed >> 24,
+        (packed >> 16) & 0xFF,
+        (packed >> 8) & 0xFF,
+        packed & 0xFF,
+    )
+
+
+@functools.lru_cache(maxsize=8192)
+def _blend_packed_steps(base_color, added_color, steps):
+    out = 0
+    for shift in (24, 16, 8, 0):
+        base = (base_color >> shift) & 0xFF
+        added = (added_color >> shift) & 0xFF
+        out |= (
+            base + ((added - base) * steps + _BLEND_TOLERANCE) // BLEND_STEPS
+        ) << shift
+    return out
+
+
+def blend_packed(base_color, added_color, blend):
+    """As blend_colors(), but for packed colors (see pack_color()), and with
+    blend rounded to the nearest multiple of 1 / BLEND_STEPS.
+
+    The blended colors are computed with integer arithmetic and cached, so
+    blending the same colors again only costs a dictionary lookup.
+    """
+    return _blend_packed_steps(
+        base_color, added_color, round(blend * BLEND_STEPS)
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _hex_color(color):
+    if isinstance(color, int):
+        return f"#{color:08x}"
+    # Will raise a ValueError if color has floats (rather than ints)
+    return f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}{color[3]:02x}"
+
+
+def hex_color(color) -> str:
+    """Returns a color, either a tuple or packed (see pack_color()), as an
+    "#rrggbbaa" string.
+
+    Each distinct color is only formatted once.
+    """
+    try:
+        return _hex_color(color)
+    except TypeError:
+        return _hex_color(tuple(color))
+
+
 def get_color_vary_ns(variation_amount, min_n=None, max_n=None):
     rand_floats = [random.random() for _ in range(3)]
     rand_sum = sum(rand_floats)
@@ -0,0 +1,126 @@
+"""Provides FrameStore, a single file of raw frames, which can be used instead
+of a png file per frame (see Settings.frame_format).
+
+The file consists of a header of HEADER_SIZE bytes followed by the frames,
+each of which is height * width * 3 bytes (BGR, as used by OpenCV), in order.
+Since every frame is the same size, frame i is at a known offset, and the file
+is memory-mapped both to write the frames and to read them: frames are
+written and read in place, with no per-file overhead or (de)compression.
+
+The header is the bytes of MAGIC followed by the format version, the height,
+the width, and the number of frames, as little-endian unsigned 64-bit ints.
+It is padded to HEADER_SIZE bytes so that frames are page-aligned.
+"""
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"MIDANIFS"
+VERSION = 1
+HEADER_SIZE = 4096
+_HEADER_FORMAT = "<8s4Q"
+
+
+class FrameStoreError(Exception):
+    """Raised when FrameStore.open() can't read a file."""
+
+
+class FrameStore:
+    """A memory-mapped file of frames. See the module docstring.
+
+    Use create() to make a new file or open() to read an existing one. Frames
+    are indexed from 0.
+
+    Can be used as a context manager, which calls close() on exit.
+    """
+
+    def __init__(self, fname, frames):
+        self.fname = fname
+        self._frames = frames
+
+    @classmethod
+    def create(cls, fname, n_frames, height, width):
+        """Creates (or overwrites) fname, with room for n_frames frames.
+
+        The frames are initially black.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+        with open(fname, "wb") as outf:
+            outf.write(
+                struct.pack(
+                    _HEADER_FORMAT, MAGIC, VERSION, height, width, n_frames
+                ).ljust(HEADER_SIZE, b"\0")
+            )
+            # The rest of the file is sparse until the frames are written
+            outf.truncate(HEADER_SIZE + n_frames * height * width * 3)
+        return cls(fname, cls._map(fname, "r+", n_frames, height, width))
+
+    @classmethod
+    def open(cls, fname, mode="r"):
+        """Opens fname, which should have been made with create().
+
+        Args:
+            fname: str.
+            mode: str. "r" to read the frames, "r+" to (re)write them.
+
+        Raises:
+            FrameStoreError if fname isn't a frame store.
+        """
+        with open(fname, "rb") as inf:
+            header = inf.read(struct.calcsize(_HEADER_FORMAT))
+        try:
+            magic, version, height, width, n_frames = struct.unpack(
+                _HEADER_FORMAT, header
+            )
+        except struct.error as exc:
+            raise FrameStoreError(f"{fname} is not a frame store") from exc
+        if magic != MAGIC:
+            raise FrameStoreError(f"{fname} is not a frame store")
+        if version != VERSION:
+            raise FrameStoreError(
+                f"{fname} has unsupported frame store version {version}"
+            )
+        return cls(fname, cls._map(fname, mode, n_frames, height, width))
+
+    @staticmethod
+    def _map(fname, mode, n_frames, height, width):
+        if not n_frames:
+            # np.memmap can't map zero bytes
+            return np.empty((0, height, width, 3), dtype=np.uint8)
+        return np.memmap(
+            fname,
+            dtype=np.uint8,
+            mode=mode,
+            offset=HEADER_SIZE,
+            shape=(n_frames, height, width, 3),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __getitem__(self, i):
+        """Returns frame i as a view onto the file; writing to it (if the
+        store was opened for writing) writes the frame.
+        """
+        return self._frames[i]
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    @property
+    def shape(self):
+        """The shape (height, width, 3) of each frame."""
+        return self._frames.shape[1:]
+
+    def close(self):
+        """Flushes any frames that have been written and unmaps the file."""
+        if isinstance(self._frames, np.memmap):
+            self._frames.flush()
+        self._frames = None
@@ -0,0 +1,340 @@
+"""Provides Player, which plays the video in real time, and sinks to stream
+the frames to: RawVideoSink (e.g., to stdout, to be piped to a player) and
+MJPEGServer (over http on localhost).
+
+Frames are rendered with matplotlib, in memory, one at a time. Frame i
+(counting from the first frame played) is due 1 / fps * i seconds after the
+first frame was shown. Each frame is shown at the time it is due, or as soon
+as it has been rendered if that is later, in which case it has missed its
+deadline. Rendering then continues with the next frame that isn't yet due,
+and the frames in between are skipped, so that playback keeps up with real
+time. When frames keep missing their deadlines (see
+Settings.live_degrade_misses), the quality is lowered so that they take less
+time to render.
+"""
+import collections
+import dataclasses
+import http.server
+import math
+import threading
+import time
+import typing as t
+
+import cv2
+import numpy as np
+
+from . import midani_annotations
+from . import midani_misc_classes
+from . import midani_plot
+
+
+@dataclasses.dataclass
+class PlaybackStats:
+    """Statistics of a real-time playback."""
+
+    # The number of frames shown
+    shown: int = 0
+    # The number of frames skipped to catch up
+    skipped: int = 0
+    # The number of frames shown after they were due
+    missed: int = 0
+    # The longest time (in seconds) taken to render a frame
+    max_render_time: float = 0.0
+    # What was done to lower the quality, in order
+    degradations: t.List[str] = dataclasses.field(default_factory=list)
+
+
+class Player:
+    """Plays the video in real time. See the module docstring.
+
+    Args:
+        settings: Settings. The quality settings that are lowered during
+            playback are changed in place.
+        sink: a callable that is called with each frame, as a uint8 array of
+            shape (settings.out_height, settings.out_width, 3) in BGR order,
+            at the time it should be shown. The array is reused for the next
+            frame, so the sink shouldn't keep it.
+        clock: a callable that returns the time in seconds.
+        sleep: a callable that waits for a number of seconds.
+    """
+
+    def __init__(self, settings, sink, clock=time.monotonic, sleep=time.sleep):
+        self.settings = settings
+        self.sink = sink
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = PlaybackStats()
+        self._first_i, self._end_i = settings.frame_range or (0, None)
+        # The index of the frame that is being rendered
+        self._frame_i = None
+        self._render_start = None
+        # The time at which the first frame was shown
+        self._t0 = None
+        # The time (in the video) of frame 0
+        self._first_now = None
+        self._table = None
+        # The indices of the frames that missed their deadlines within the
+        # last second
+        self._missed = collections.deque()
+        self._buckets = None
+        self._flutter = True
+
+    def due(self, frame_i):
+        """Returns the time at which frame frame_i should be shown."""
+        return (
+            self._t0 + (frame_i - self._first_i) * self.settings.frame_increment
+        )
+
+    def _next_frame_i(self):
+        if self._frame_i is None:
+            return self._first_i
+        # The first frame that isn't yet due
+        not_due = self._first_i + math.ceil(
+            (self.clock() - self._t0) / self.settings.frame_increment
+        )
+        return max(self._frame_i + 1, not_due)
+
+    def _frame_times(self, window):
+        self._first_now = window.get_first_now()
+        while True:
+            frame_i = self._next_frame_i()
+            if self._end_i is not None and frame_i >= self._end_i:
+                if self._frame_i is not None:
+                    self.stats.skipped += self._end_i - self._frame_i - 1
+                return
+            # As in midani_plot._frame_times()
+            now = self._first_now + frame_i * self.settings.frame_increment
+            self._before_frame(now, window)
+            if not window.in_range(now):
+                return
+            if self._frame_i is not None:
+                self.stats.skipped += frame_i - self._frame_i - 1
+            self._frame_i = frame_i
+            self._render_start = self.clock()
+            yield now
+
+    def _show(self, frame):
+        now = self.clock()
+        self.stats.max_render_time = max(
+            self.stats.max_render_time, now - self._render_start
+        )
+        if self._t0 is None:
+            # Playback starts once the first frame has been rendered
+            self._t0 = now
+        else:
+            delay = self.due(self._frame_i) - now
+            if delay > 0:
+                self.sleep(delay)
+            else:
+                self._miss()
+        self.sink(frame)
+        self.stats.shown += 1
+
+    def _miss(self):
+        self.stats.missed += 1
+        self._missed.append(self._frame_i)
+        while self._missed[0] <= self._frame_i - self.settings.fps:
+            self._missed.popleft()
+        if len(self._missed) >= self.settings.live_degrade_misses:
+            degradation = self._degrade()
+            if degradation is not None:
+                print(f"Falling behind, {degradation}")
+                self.stats.degradations.append(degradation)
+            # Give the lower quality a second to catch up
+            self._missed.clear()
+
+    def _degrade(self):
+        """Lowers the quality of the following frames, and returns what was
+        done, or None if the quality can't be lowered any further.
+        """
+        num_shadows = len(self._buckets.shadow_positions)
+        if num_shadows:
+            self._buckets.keep_shadows(num_shadows // 2)
+            return f"reduced shadows from {num_shadows} to {num_shadows // 2}"
+        if self._flutter:
+            self._flutter = False
+            for voice_i in self.settings.voice_order:
+                self.settings[voice_i].max_flutter_size = 0
+            return "turned off flutter"
+        return None
+
+    def _read_table(self):
+        """Returns the PitchTable to play, or None if there are no notes."""
+        return midani_plot._read_table(  # pylint: disable=protected-access
+            self.settings
+        )
+
+    def _make_window(self):
+        return midani_misc_classes.Window(self.settings)
+
+    def _before_frame(self, now, window):
+        """Called before the frame at time now is rendered, or, if now isn't
+        in the window's range, before playback stops.
+        """
+
+    def play(self) -> PlaybackStats:
+        """Plays the video (or settings.frame_range of it) to the end, and
+        returns the statistics of the playback (also kept in self.stats, in
+        case playback is interrupted).
+        """
+        # we move the import statement here because we don't want to require
+        # matplotlib unless it is actually being used.
+        from . import plt_boss  # pylint: disable=import-outside-toplevel
+
+        self._table = self._read_table()
+        if self._table is None:
+            return self.stats
+        window = self._make_window()
+        lyricist = midani_annotations.Lyricist(self.settings)
+        self._buckets = midani_misc_classes.PrimitiveBuckets(self.settings)
+        frame = np.empty(
+            (self.settings.out_height, self.settings.out_width, 3),
+            dtype=np.uint8,
+        )
+
+        def _to_sink(rgba):
+            midani_plot._rgba_to_bgr(  # pylint: disable=protected-access
+                rgba, frame
+            )
+            self._show(frame)
+
+        # pylint: disable=protected-access
+        for _ in midani_plot._plot_each_frame(
+            self.settings,
+            self._table,
+            window,
+            lyricist,
+            plt_boss.MPLBoss(self.settings, frame_sink=_to_sink),
+            self._frame_times(window),
+            self._buckets,
+        ):
+            pass
+        return self.stats
+
+
+class RawVideoSink:
+    """Writes each frame to a binary file (e.g., sys.stdout.buffer) as raw
+    bgr24 video, which can be played with, e.g.,
+
+        ffplay -f rawvideo -pixel_format bgr24 -video_size WIDTHxHEIGHT \\
+            -framerate FPS -
+    """
+
+    def __init__(self, outf):
+        self.outf = outf
+
+    def __call__(self, frame):
+        self.outf.write(frame.tobytes())
+        self.outf.flush()
+
+
+class MJPEGServer:
+    """Serves the frames passed to it (by calling it with each frame, a BGR
+    array) at url, as an MJPEG stream, which can be opened in a browser or
+    a player (e.g., ffplay or VLC). Each client is sent the latest frame when
+    it connects, then each frame as it arrives; frames are only encoded while
+    a client is connected.
+
+    The server runs in a background thread until close() is called. Can be
+    used as a context manager, which calls close() on exit.
+
+    Args:
+        port: int. If 0, a free port is chosen.
+        quality: int. jpeg quality, from 0 to 100.
+        host: str.
+    """
+
+    BOUNDARY = b"frame"
+
+    def __init__(self, port, quality=80, host="127.0.0.1"):
+        self.quality = quality
+        self._cond = threading.Condition()
+        self._jpeg = None
+        # The number of frames that have been encoded
+        self._n_jpegs = 0
+        self._n_clients = 0
+        self._closed = False
+        server = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                server._stream(self)  # pylint: disable=protected-access
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __call__(self, frame):
+        if not self._n_clients:
+            return
+        # pylint: disable=no-member
+        ok, jpeg = cv2.imencode(
+            ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        )
+        if not ok:
+            return
+        with self._cond:
+            self._jpeg = jpeg.tobytes()
+            self._n_jpegs += 1
+            self._cond.notify_all()
+
+    def _stream(self, handler):
+        with self._cond:
+            self._n_clients += 1
+        try:
+            handler.send_response(200)
+            handler.send_header(
+                "Content-Type",
+                "multipart/x-mixed-replace; boundary=" + self.BOUNDARY.decode(),
+            )
+            handler.send_header("Cache-Control", "no-cache")
+            handler.end_headers()
+            n_sent = 0
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._n_jpegs > n_sent or self._closed
+                    )
+                    if self._closed:
+                        return
+                    jpeg, n_sent = self._jpeg, self._n_jpegs
+                handler.wfile.write(
+                    b"--"
+                    + self.BOUNDARY
+                    + b"\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                    + str(len(jpeg)).encode()
+                    + b"\r\n\r\n"
+                    + jpeg
+                    + b"\r\n"
+                )
+                handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._cond:
+                self._n_clients -= 1
+
+    def close(self):
+        """Disconnects the clients and stops the server."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._httpd.shutdown()
+        self._httpd.server_close()
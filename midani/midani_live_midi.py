@@ -0,0 +1,213 @@
+"""Provides MidiInput, which reads midi messages as they arrive, and
+LiveMidiPlayer, which plays them in real time (see midani_live).
+
+The notes are added to the PitchTable as they arrive (see
+PitchTable.add_note()), rather than the table being built from a complete
+score. A note that has been attacked but not yet released is drawn up to the
+time of each frame; the notes that have scrolled out of the frame are dropped,
+so that the time taken to render a frame doesn't grow as the input goes on.
+
+Messages are timed by when they arrive, and are added to the table before the
+next frame is rendered, so they are drawn within about a frame (plus the
+time taken to render it) of arriving.
+"""
+import math
+import os
+import socket
+import stat
+import sys
+import threading
+import time
+import urllib.parse
+
+import mido
+
+from . import midani_live
+from . import midani_misc_classes
+from . import midani_notes
+from . import midani_time
+
+# How often (in seconds) a regular file is checked for new midi
+POLL_INTERVAL = 0.005
+
+# The number of midi channels, each of which is a voice if
+# settings.midi_channels_to_voices is True
+NUM_MIDI_CHANNELS = 16
+
+
+class MidiInput:
+    """Reads raw midi messages from source (see Settings.midi_live_input) in
+    a background thread, until the input ends or close() is called.
+
+    Args:
+        source: str.
+        clock: a callable that returns the time in seconds, with which each
+            message is timed when it arrives.
+    """
+
+    READ_SIZE = 4096
+
+    def __init__(self, source, clock=time.monotonic):
+        self.source = source
+        self.clock = clock
+        self._parser = mido.Parser()
+        self._lock = threading.Lock()
+        self._messages = []
+        self._closed = False
+        self._error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        try:
+            for data in self._chunks():
+                if self._stop.is_set():
+                    return
+                now = self.clock()
+                self._parser.feed(data)
+                with self._lock:
+                    self._messages.extend((now, msg) for msg in self._parser)
+        except Exception as exc:  # pylint: disable=broad-except
+            # Re-raised in poll()
+            self._error = exc
+        finally:
+            self._closed = True
+
+    def _chunks(self):
+        """Yields the bytes of the input as they arrive, until it ends."""
+        if self.source == "-":
+            yield from self._read_fd(sys.stdin.buffer.fileno())
+            return
+        url = urllib.parse.urlsplit(self.source)
+        if url.scheme == "tcp":
+            with socket.create_server((url.hostname, url.port)) as server:
+                conn, _ = server.accept()
+            with conn:
+                while data := conn.recv(self.READ_SIZE):
+                    yield data
+            return
+        fd = os.open(self.source, os.O_RDONLY)
+        try:
+            if not stat.S_ISREG(os.fstat(fd).st_mode):
+                yield from self._read_fd(fd)
+                return
+            # Follow the file from its end, as it is appended to
+            os.lseek(fd, 0, os.SEEK_END)
+            while not self._stop.is_set():
+                data = os.read(fd, self.READ_SIZE)
+                if data:
+                    yield data
+                else:
+                    self._stop.wait(POLL_INTERVAL)
+        finally:
+            os.close(fd)
+
+    def _read_fd(self, fd):
+        # os.read() returns as soon as any bytes are available
+        while data := os.read(fd, self.READ_SIZE):
+            yield data
+
+    def close(self):
+        """Stops reading the input; any data that arrives afterwards is
+        ignored. (The thread waiting on a pipe, device or socket only stops
+        when more data arrives or the input ends.)
+        """
+        self._stop.set()
+
+    @property
+    def closed(self):
+        """True once the input has ended (and no more messages will arrive).
+        Messages may still be waiting to be polled.
+        """
+        return self._closed
+
+    def poll(self):
+        """Returns a list of the (time, mido.Message) pairs that have arrived
+        since the last call, in order.
+
+        Raises:
+            the exception that stopped the input, if any, once all the
+            messages before it have been returned.
+        """
+        with self._lock:
+            messages, self._messages = self._messages, []
+        if not messages and self._error is not None:
+            raise self._error
+        return messages
+
+
+class LiveMidiPlayer(midani_live.Player):
+    """Plays the notes read from midi_input (a MidiInput) in real time.
+
+    Args are as for midani_live.Player, except for midi_input, whose clock
+    should be the same as the player's.
+    """
+
+    def __init__(self, settings, sink, midi_input, **kwargs):
+        super().__init__(settings, sink, **kwargs)
+        self.midi_input = midi_input
+        # The notes that have been attacked but not released, by
+        # (voice, pitch)
+        self._sounding = {}
+
+    def _read_table(self):
+        """Returns an empty PitchTable, to which notes are added as they
+        arrive.
+        """
+        score = midani_notes.ColumnarScore(tet=self.settings.tet)
+        for _ in range(
+            NUM_MIDI_CHANNELS if self.settings.midi_channels_to_voices else 1
+        ):
+            score.add_voice()
+        tempo_changes = midani_time.TempoChanges(score)
+        self.settings.update_from_score(score, tempo_changes)
+        return midani_misc_classes.PitchTable(
+            score, self.settings, tempo_changes
+        )
+
+    def _make_window(self):
+        window = super()._make_window()
+        # The input has no end that is known in advance
+        window.end_time = window.end_bg_time = window.stop_time = math.inf
+        return window
+
+    def _note_time(self, arrival, now):
+        """Returns the time in the video of a message that arrived at time
+        arrival (by the clock), which is at the latest now, the time of the
+        frame that is about to be rendered.
+        """
+        if self._t0 is None:
+            # Nothing has been shown yet
+            return now
+        return min(
+            now,
+            self._first_now
+            + self._first_i * self.settings.frame_increment
+            + arrival
+            - self._t0,
+        )
+
+    def _before_frame(self, now, window):
+        closed = self.midi_input.closed
+        for arrival, msg in self.midi_input.poll():
+            if msg.type not in ("note_on", "note_off"):
+                continue
+            voice_i = (
+                msg.channel if self.settings.midi_channels_to_voices else 0
+            )
+            note_time = self._note_time(arrival, now)
+            note = self._sounding.pop((voice_i, msg.note), None)
+            if note is not None:
+                self._table.close_note(note, note_time)
+            if msg.type == "note_on" and msg.velocity > 0:
+                note = self._table.add_note(voice_i, msg.note, note_time)
+                if note is not None:
+                    self._sounding[(voice_i, msg.note)] = note
+        if closed and window.stop_time == math.inf:
+            for note in self._sounding.values():
+                self._table.close_note(note, now)
+            self._sounding.clear()
+            window.stop_time = now + self.settings.outro
+        self._table.extend_open_notes(now)
+        self._table.drop_past_notes(now)
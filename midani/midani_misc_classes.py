@@ -1,67 +1,470 @@
 """Provides a number of classes used internally by midani.
 """
 
-import dataclasses
+import collections
 import functools
+import itertools
 import math
 import random
-import typing
-
-
-import midani.from_my_other_projects.note_classes as note_classes
 
 from . import midani_settings
 from . import midani_colors
+from . import midani_notes
 from . import midani_time
 
 
-@dataclasses.dataclass
-class Note:  # pylint: disable=missing-class-docstring
-    pitch: int
-    start: float
-    end: float
-    voice_i: int
-    first_visible: float
-    last_visible: float
+class Note:
+    """A note of the PitchTable, with times in seconds.
+
+    dur and mid are computed once, when the note is constructed.
+    """
+
+    __slots__ = (
+        "pitch",
+        "start",
+        "end",
+        "voice_i",
+        "first_visible",
+        "last_visible",
+        "dur",
+        "mid",
+    )
 
-    def __post_init__(self):
-        self.dur = self.end - self.start
+    def __init__(
+        self,
+        pitch: int,
+        start: float,
+        end: float,
+        voice_i: int,
+        first_visible: float,
+        last_visible: float,
+    ):
+        self.pitch = pitch
+        self.start = start
+        self.end = end
+        self.voice_i = voice_i
+        self.first_visible = first_visible
+        self.last_visible = last_visible
+        self.dur = end - start
+        self.mid = start + self.dur / 2
+
+    def set_end(self, end: float, last_visible: float):
+        """Changes the end of the note (e.g., when a note whose end wasn't
+        known is released).
+        """
+        self.end = end
+        self.last_visible = last_visible
+        self.dur = end - self.start
         self.mid = self.start + self.dur / 2
 
+    def __repr__(self):
+        return (
+            f"Note(pitch={self.pitch}, start={self.start}, end={self.end}, "
+            f"voice_i={self.voice_i})"
+        )
+
 
-@dataclasses.dataclass
 class RectTuple:
-    """Stores data used to plot rectangles."""
+    """Stores data used to plot rectangles. The color is packed (see
+    midani_colors.pack_color()).
 
-    note: Note
-    scale_x_factor: float
-    scale_y_factor: float
-    flutter: float
-    color: typing.Tuple[int, int, int]
-    highlight_factor: float
+    Instances are reused from frame to frame (see RecordList), so references
+    to them shouldn't be kept after a frame is drawn.
+    """
 
-    @functools.cached_property
-    def pitch(self):
-        return self.note.pitch + self.flutter
+    __slots__ = (
+        "note",
+        "scale_x_factor",
+        "scale_y_factor",
+        "flutter",
+        "color",
+        "highlight_factor",
+        "pitch",
+    )
+
+    def __init__(
+        self,
+        note: Note,
+        scale_x_factor: float,
+        scale_y_factor: float,
+        flutter: float,
+        color: int,
+        highlight_factor: float,
+    ):
+        self.set(
+            note,
+            scale_x_factor,
+            scale_y_factor,
+            flutter,
+            color,
+            highlight_factor,
+        )
+
+    def set(
+        self,
+        note,
+        scale_x_factor,
+        scale_y_factor,
+        flutter,
+        color,
+        highlight_factor,
+    ):
+        self.note = note
+        self.scale_x_factor = scale_x_factor
+        self.scale_y_factor = scale_y_factor
+        self.flutter = flutter
+        self.color = color
+        self.highlight_factor = highlight_factor
+        self.pitch = note.pitch + flutter
 
 
-@dataclasses.dataclass
 class LineTuple:
-    """Stores data used to plot lines."""
+    """Stores data used to plot lines. The color is packed (see
+    midani_colors.pack_color()).
 
-    note: Note
-    scale_factor: float
-    flutter: float
-    color: typing.Tuple[int, int, int]
-    highlight_factor: float
+    Instances are reused from frame to frame (see RecordList), so references
+    to them shouldn't be kept after a frame is drawn.
+    """
 
-    @functools.cached_property
-    def pitch(self):
-        return self.note.pitch + self.flutter
+    __slots__ = (
+        "note",
+        "scale_factor",
+        "flutter",
+        "color",
+        "highlight_factor",
+        "pitch",
+    )
+
+    def __init__(
+        self,
+        note: Note,
+        scale_factor: float,
+        flutter: float,
+        color: int,
+        highlight_factor: float,
+    ):
+        self.set(note, scale_factor, flutter, color, highlight_factor)
+
+    def set(self, note, scale_factor, flutter, color, highlight_factor):
+        self.note = note
+        self.scale_factor = scale_factor
+        self.flutter = flutter
+        self.color = color
+        self.highlight_factor = highlight_factor
+        self.pitch = note.pitch + flutter
+
+
+class RecordList:
+    """A list of RectTuples or LineTuples that reuses its records.
+
+    clear() only resets the length of the list, and add() refills the records
+    that are already there before constructing new ones. So once the list has
+    grown to the largest number of records needed by a frame, filling it
+    again for another frame doesn't allocate any records.
+    """
+
+    __slots__ = ("record_type", "_records", "_len")
+
+    def __init__(self, record_type):
+        self.record_type = record_type
+        self._records = []
+        self._len = 0
+
+    def clear(self):
+        self._len = 0
+
+    def add(self, *args):
+        """Adds a record constructed (or refilled) with args, and returns it."""
+        if self._len < len(self._records):
+            record = self._records[self._len]
+            record.set(*args)
+        else:
+            record = self.record_type(*args)
+            self._records.append(record)
+        self._len += 1
+        return record
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.islice(self._records, self._len)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("RecordList index out of range")
+        return self._records[i]
+
+
+class PrimitiveBuckets:
+    """The rects and lines of a frame, collected in buckets that flush() passes
+    to the plot boss in order.
+
+    When the notes of a frame are traversed, each note emits its rect, the
+    connection line from the previous note, and their shadows all at once.
+    The buckets put these back into layering order: for each shadow (from
+    back to front), the connection line shadows, then the note shadows; then
+    the connection lines; then the notes. (The R backend draws in the order it
+    is called, ignoring zorder, so the order of the calls must give the
+    layering.) Within a bucket, primitives are drawn in the order they were
+    added.
+
+    The lists of the buckets are kept from frame to frame.
+
+    If settings.cull_primitives is True, flush() first drops the primitives
+    that wouldn't be visible. If the plot boss draws rects with an edge
+    (plot_boss.rect_edge_width, in pixels, is nonzero), as matplotlib does,
+    even a rect with no area is visible, so rects aren't dropped for being
+    too small, and the edge is allowed for when checking whether they are
+    outside the frame. The numbers of primitives that are drawn and dropped
+    in each frame are counted in `counts`, which also counts the piano roll
+    and metric column rects that are merged (see midani_plot). At the end of
+    each frame, flush() moves `counts` to `last_counts` and adds it to
+    `total_counts`.
+    """
+
+    # zorders of line shadows, note shadows, lines, and notes
+    LINE_SHADOW_Z = 1
+    NOTE_SHADOW_Z = 5
+    LINE_Z = 10
+    NOTE_Z = 15
+
+    # Number of columns of the grid that is used to find the notes that might
+    # cover a shadow
+    OCCLUSION_GRID_SIZE = 32
+
+    def __init__(self, settings):
+        self.shadow_positions = (
+            list(reversed(settings.shadow_positions))
+            if settings.shadows
+            else []
+        )
+        # Primitives are appended directly to these lists, as tuples of
+        # (x1, x2, y1, y2, color) for rects and (x1, x2, y1, y2, color, width)
+        # for lines. There is one list of line shadows and one of note shadows
+        # for each shadow.
+        self.line_shadows = [[] for _ in self.shadow_positions]
+        self.note_shadows = [[] for _ in self.shadow_positions]
+        self.lines = []
+        self.notes = []
+        self._buckets = self._make_buckets()
+        self.cull = settings.cull_primitives
+        self.min_pixels = settings.cull_min_pixels
+        self.counts = collections.Counter()
+        self.last_counts = collections.Counter()
+        self.total_counts = collections.Counter()
+
+    def _make_buckets(self):
+        # Each bucket is (is_line, zorder, primitives)
+        buckets = []
+        for line_shadows, note_shadows in zip(
+            self.line_shadows, self.note_shadows
+        ):
+            buckets.append((True, self.LINE_SHADOW_Z, line_shadows))
+            buckets.append((False, self.NOTE_SHADOW_Z, note_shadows))
+        buckets.append((True, self.LINE_Z, self.lines))
+        buckets.append((False, self.NOTE_Z, self.notes))
+        return buckets
+
+    def keep_shadows(self, num_shadows):
+        """Stops drawing all but the first num_shadows shadows (counting from
+        the back). The shadows that are kept look just as they did before.
+
+        Should only be called between frames.
+        """
+        del self.shadow_positions[num_shadows:]
+        del self.line_shadows[num_shadows:]
+        del self.note_shadows[num_shadows:]
+        self._buckets = self._make_buckets()
+
+    def _cull_lines(self, lines, window):
+        kept = []
+        for line in lines:
+            x1, x2, y1, y2, _, width = line
+            # Allow for the width of the line
+            x_margin = width * window.x_units_per_pixel
+            if (
+                max(x1, x2) + x_margin < window.x_start
+                or min(x1, x2) - x_margin > window.x_end
+                or max(y1, y2) + width < window.bottom
+                or min(y1, y2) - width > window.top
+            ):
+                self.counts["offscreen"] += 1
+            else:
+                kept.append(line)
+        return kept
+
+    def _cull_rects(self, rects, window, edge_width):
+        min_width = self.min_pixels * window.x_units_per_pixel
+        # Allow for the part of the edge that is outside the rect
+        y_margin = edge_width / 2
+        x_margin = y_margin * window.x_units_per_pixel
+        kept = []
+        for rect in rects:
+            x1, x2, y1, y2, _ = rect
+            # Rects that only touch the edge of the frame are kept, since
+            # anti-aliasing may make them visible
+            if (
+                max(x1, x2) + x_margin < window.x_start
+                or min(x1, x2) - x_margin > window.x_end
+                or max(y1, y2) + y_margin < window.bottom
+                or min(y1, y2) - y_margin > window.top
+            ):
+                self.counts["offscreen"] += 1
+            elif not edge_width and (
+                abs(x2 - x1) < min_width
+                or abs(y2 - y1) < self.min_pixels
+                or x1 == x2
+                or y1 == y2
+            ):
+                self.counts["subpixel"] += 1
+            else:
+                kept.append(rect)
+        return kept
+
+    def _cull_occluded(self, shadows, window):
+        """Drops the shadows that are entirely covered by an opaque note, with
+        a margin of a pixel on each side (so that anti-aliased edges are
+        unaffected).
+        """
+        num_cells = self.OCCLUSION_GRID_SIZE
+        cell_width = (window.x_end - window.x_start) / num_cells
+        # The notes that overlap each column of the grid
+        grid = [[] for _ in range(num_cells)]
+        for note in self.notes:
+            x1, x2, y1, y2, color = note
+            if color & 0xFF != 0xFF or y1 > y2:
+                continue
+            first_cell = max(int((x1 - window.x_start) / cell_width), 0)
+            last_cell = min(
+                int((x2 - window.x_start) / cell_width), num_cells - 1
+            )
+            for cell in range(first_cell, last_cell + 1):
+                grid[cell].append(note)
+        x_margin = window.x_units_per_pixel
+        for shadow_i, bucket in enumerate(shadows):
+            kept = []
+            for shadow in bucket:
+                x1, x2, y1, y2, _ = shadow
+                cell = min(
+                    max(int((x1 - window.x_start) / cell_width), 0),
+                    num_cells - 1,
+                )
+                for note_x1, note_x2, note_y1, note_y2, _ in grid[cell]:
+                    if (
+                        note_x1 <= x1 - x_margin
+                        and note_x2 >= x2 + x_margin
+                        and note_y1 <= y1 - 1
+                        and note_y2 >= y2 + 1
+                    ):
+                        self.counts["occluded"] += 1
+                        break
+                else:
+                    kept.append(shadow)
+            bucket[:] = kept
+
+    def _cull(self, window, edge_width):
+        for is_line, _, primitives in self._buckets:
+            if is_line:
+                primitives[:] = self._cull_lines(primitives, window)
+            else:
+                primitives[:] = self._cull_rects(primitives, window, edge_width)
+        if self.notes:
+            self._cull_occluded(self.note_shadows, window)
+
+    def flush(self, plot_boss, window=None):
+        """Draws the primitives in all the buckets and empties them.
+
+        Primitives are only culled if window is passed.
+        """
+        if self.cull and window is not None:
+            self._cull(window, plot_boss.rect_edge_width)
+        for is_line, zorder, primitives in self._buckets:
+            self.counts["drawn"] += len(primitives)
+            if is_line:
+                for x1, x2, y1, y2, color, width in primitives:
+                    plot_boss.plot_line(x1, x2, y1, y2, color, width, zorder)
+            else:
+                for x1, x2, y1, y2, color in primitives:
+                    plot_boss.plot_rect(x1, x2, y1, y2, color, zorder)
+            primitives.clear()
+        self.last_counts = self.counts
+        self.total_counts.update(self.counts)
+        self.counts = collections.Counter()
+
+
+class LookupTable:
+    """Tabulates a function of one variable so that it can be read cheaply.
+
+    The function is sampled at evenly spaced points on [lower, upper] and
+    evaluated by linear interpolation. The number of intervals is doubled
+    (starting from `min_size`) until the interpolation error at the midpoints
+    between samples is at most `max_error`. If that doesn't happen before
+    `max_size` is exceeded (e.g., because the function is discontinuous), or if
+    `max_error` is 0, no table is built and the function is called directly.
+    Arguments outside of [lower, upper) are always passed to the function.
+
+    Since the error is only measured at the midpoints, `max_error` is the
+    approximate maximum error of a smooth function (in the units of its
+    values), not a bound on it.
+    """
+
+    def __init__(
+        self, func, lower, upper, max_error, min_size=64, max_size=16384
+    ):
+        self.func = func
+        self.lower = lower
+        # With size and scale 0, every argument is passed to the function
+        self.size = 0
+        self.scale = 0
+        self.values = None
+        if max_error <= 0 or upper <= lower:
+            return
+        size = min_size
+        step = (upper - lower) / size
+        values = [func(lower + i * step) for i in range(size + 1)]
+        while size <= max_size:
+            mids = [func(lower + (i + 0.5) * step) for i in range(size)]
+            error = max(
+                abs(mid - (values[i] + values[i + 1]) / 2)
+                for i, mid in enumerate(mids)
+            )
+            if error <= max_error:
+                self.size = size
+                self.scale = 1 / step
+                self.values = values
+                return
+            # The midpoints become samples of the table with twice as many
+            # intervals
+            interleaved = [None] * (2 * size + 1)
+            interleaved[::2] = values
+            interleaved[1::2] = mids
+            values = interleaved
+            size *= 2
+            step /= 2
+
+    @property
+    def tabulated(self):
+        return self.values is not None
+
+    def __call__(self, x):
+        pos = (x - self.lower) * self.scale
+        if 0 <= pos < self.size:
+            i = int(pos)
+            y0 = self.values[i]
+            return y0 + (self.values[i + 1] - y0) * (pos - i)
+        return self.func(x)
 
 
 class PitchFlutter:
-    """Calculates 'flutter' according to provided parameters."""
+    """Calculates 'flutter' according to provided parameters.
+
+    Every note at a given pitch shares the same flutter, and all the notes in a
+    frame are evaluated at the same moment, so the most recent value is
+    memoized.
+    """
 
     def __init__(
         self,
@@ -80,16 +483,28 @@ class PitchFlutter:
         )
         self.flutter_offset = random.random() * self.flutter_period
         self.flutter_sin_factor = (2 * math.pi) / self.flutter_period
+        self._last_now = self._last_flutter = None
 
     def __call__(self, now):
-        return (
-            math.sin((now + self.flutter_offset) * self.flutter_sin_factor)
-            * self.flutter_size
-        )
+        if now != self._last_now:
+            self._last_now = now
+            self._last_flutter = (
+                math.sin((now + self.flutter_offset) * self.flutter_sin_factor)
+                * self.flutter_size
+            )
+        return self._last_flutter
 
 
 class Window:
-    """A class that keeps track of frame position and background color."""
+    """A class that keeps track of frame position and background color.
+
+    The x coordinates of the frame are either times in seconds or, if
+    settings.pixel_geometry is True, integer pixels. In the latter case, time
+    t is at pixel round(t * x_scale) in every frame, and the frame moves along
+    this grid by whole pixels. start and end are always in seconds; x_start
+    and x_end are in the units of the x coordinates, and x_position() and
+    x_extent() convert seconds to them.
+    """
 
     def __init__(self, settings):
         self.frame_len = settings.frame_len
@@ -109,15 +524,15 @@ class Window:
         self.bg_color_constant = not self.bg_times
         self.outro_has_begun = False
         self._top = settings.out_height
-        # The next lines are part of an abortive attempt to express
-        # x coordinates in pixels, which I foolishly started before
-        # committing other changes...
-        # self._pixel_width = settings.out_width
-        # self._left_pixel_width = int(self._pixel_width * self.frame_position)
-        # self._right_pixel_width = self._pixel_width - self._left_pixel_width
+        self.pixel_geometry = settings.pixel_geometry
+        # Pixels per second
+        self.x_scale = settings.out_width / self.frame_len
+        self._left_pixel_width = int(settings.out_width * self.frame_position)
+        self._right_pixel_width = settings.out_width - self._left_pixel_width
         # The following attributes are only initialized later
         self.last_now = self.next_bg_time = self.prev_bg_time = None
         self._now = self._start = self._end = None
+        self._x_start = self._x_end = None
 
     #     print(
     #         f"""Initializing window with
@@ -222,12 +637,13 @@ class Window:
         self._now = now
         self._start = now - self.frame_len * self.frame_position
         self._end = now + self.frame_len * (1 - self.frame_position)
-        # The next lines are part of an abortive attempt to express
-        # x coordinates in pixels, which I foolishly started before
-        # committing other changes...
-        # self._pixel_now = round(now / self.frame_len * self._pixel_width)
-        # self._pixel_start = self._pixel_now - self._left_pixel_width
-        # self._pixel_end = self._pixel_now + self._right_pixel_width
+        if self.pixel_geometry:
+            pixel_now = self.x_position(now)
+            self._x_start = pixel_now - self._left_pixel_width
+            self._x_end = pixel_now + self._right_pixel_width
+        else:
+            self._x_start = self._start
+            self._x_end = self._end
 
     @property
     def start(self):  # pylint: disable=missing-docstring
@@ -237,16 +653,48 @@ class Window:
     def end(self):  # pylint: disable=missing-docstring
         return self._end
 
-    # The next lines are part of an abortive attempt to express
-    # x coordinates in pixels, which I foolishly started before
-    # committing other changes...
-    # @property
-    # def pixel_start(self):  # pylint: disable=missing-docstring
-    #     return self._pixel_start
-    #
-    # @property
-    # def pixel_end(self):  # pylint: disable=missing-docstring
-    #     return self._pixel_end
+    @property
+    def x_start(self):  # pylint: disable=missing-docstring
+        return self._x_start
+
+    @property
+    def x_end(self):  # pylint: disable=missing-docstring
+        return self._x_end
+
+    @property
+    def x_units_per_pixel(self):
+        """The length of a pixel in the units of the x coordinates."""
+        return 1 if self.pixel_geometry else 1 / self.x_scale
+
+    def x_position(self, time):
+        """Returns the x coordinate of a time in seconds."""
+        if self.pixel_geometry:
+            return round(time * self.x_scale)
+        return time
+
+    def time_at_x_start(self, x_start):
+        """Returns the time of the frame that starts at pixel x_start (when
+        settings.pixel_geometry is True).
+        """
+        return (x_start + self._left_pixel_width) / self.x_scale
+
+    def x_extent(self, mid, dur):
+        """Returns the x coordinates (x1, x2) of a shape centered at time mid
+        that lasts dur seconds, clipped to the frame.
+
+        With pixel geometry, the width of the shape is rounded to a whole
+        number of pixels before being divided on either side of mid.
+        """
+        if self.pixel_geometry:
+            x_mid = round(mid * self.x_scale)
+            width = round(dur * self.x_scale)
+            left_width = width // 2
+            return (
+                max(self._x_start, x_mid - left_width),
+                min(self._x_end, x_mid - left_width + width),
+            )
+        half_dur = dur / 2
+        return max(self._start, mid - half_dur), min(self._end, mid + half_dur)
 
     @property
     def bottom(self):
@@ -286,15 +734,6 @@ class Window:
         """
         return round(y * self._top)
 
-    # The next lines are part of an abortive attempt to express
-    # x coordinates in pixels, which I foolishly started before
-    # committing other changes...
-    # def x_width(self, x):
-    #     return round(x * self._pixel_width / self.frame_len)
-    #
-    # def x_position(self, x):
-    #     return round(x * self._pixel_width / self.frame_len)
-
 
 class PitchRange:
     """Used by child classes below to determine where pitches lie in range."""
@@ -308,15 +747,19 @@ class PitchRange:
         self._pitch_range = None
 
     def update_from_pitch(self, pitch):
+        changed = self._pitch_range is None
         if self._update_l_pitch and (
             self._l_pitch is None or pitch < self._l_pitch
         ):
             self._l_pitch = pitch
+            changed = True
         if self._update_h_pitch and (
             self._h_pitch is None or pitch > self._h_pitch
         ):
             self._h_pitch = pitch
-        self._update_pitch_range()
+            changed = True
+        if changed:
+            self._update_pitch_range()
 
     @property
     def pitch_range(self):  # pylint: disable=missing-docstring
@@ -354,12 +797,25 @@ class VoiceList(PitchRange, list):
     """A list/PitchRange object.
 
     The only implemented method for adding objects is append().
+
+    Notes that will no longer be drawn can be removed from the start of the
+    list with drop_first(); first_note_i is then the index the first note had
+    before any were removed.
     """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.first_note_i = 0
+
     def append(self, note):
         super().append(note)
         self.update_from_pitch(note.pitch)
 
+    def drop_first(self, n):
+        """Removes the first n notes. The pitch range is unchanged."""
+        del self[:n]
+        self.first_note_i += n
+
     def insert(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -381,11 +837,36 @@ class Channel(PitchRange):
         self.height = settings.channel_heights[channel_i]
         self.offset = settings.channel_offsets[channel_i]
         self.h_factor = settings.out_height / self.height
+        self._y_positions = {}
+        self._unit_height = None
+
+    def _update_pitch_range(self):
+        super()._update_pitch_range()
+        self._update_layout()
+
+    def _update_layout(self):
+        """Tabulates the y position of each pitch in the channel and the
+        height of a semitone, so that they aren't recomputed for every note on
+        every frame. Called whenever the pitch range changes.
+        """
+        try:
+            pitches = range(self._l_pitch, self._h_pitch + 1)
+        except TypeError:
+            # The channel is still empty (or its range isn't integral)
+            self._y_positions = {}
+            self._unit_height = None
+            return
+        self._y_positions = {
+            pitch: self.proportion(pitch) + self.offset for pitch in pitches
+        }
+        self._unit_height = self.proportion(
+            self._l_pitch + 1
+        ) - self.proportion(self._l_pitch)
 
     def proportion(self, pitch):
         return round(
             (
-                (pitch - self.l_pitch) / self.pitch_range * self.non_padding
+                (pitch - self._l_pitch) / self._pitch_range * self.non_padding
                 + self.l_padding
             )
             * self.height
@@ -397,7 +878,12 @@ class Channel(PitchRange):
 
     def y_position(self, pitch):
         """Returns the y position of a pitch in the frame, in pixels."""
-        return self.proportion(pitch) + self.offset
+        y_position = self._y_positions.get(pitch)
+        if y_position is None:
+            # Pitches that aren't in the table (e.g., fractional pitches from
+            # flutter) are computed exactly as the table was
+            return self.proportion(pitch) + self.offset
+        return y_position
 
     def y_position_by_proportion(self, x):
         """Returns the y position of a float between 0.0 and 1.0 in pixels.
@@ -406,10 +892,7 @@ class Channel(PitchRange):
         return round(x * self.height) + self.offset
 
     def pixel_height(self, height):
-        return round(
-            (self.proportion(self.l_pitch + 1) - self.proportion(self.l_pitch))
-            * height
-        )
+        return round(self._unit_height * height)
 
 
 class PitchTable(PitchRange, list):
@@ -422,7 +905,7 @@ class PitchTable(PitchRange, list):
 
     def __init__(
         self,
-        score: note_classes.Score,
+        score: midani_notes.ColumnarScore,
         settings: midani_settings.Settings,
         tempo_changes: midani_time.TempoChanges,
         *args,
@@ -446,6 +929,19 @@ class PitchTable(PitchRange, list):
             and (settings[voice_i].note_width == settings[voice_i].note_height)
             for voice_i in range(settings.num_voices)
         )
+        # The color loop of each voice, packed (see
+        # midani_colors.pack_color()), or None if it has none
+        self.color_loops = {
+            voice_i: (
+                None
+                if settings[voice_i].color_loop is None
+                else tuple(
+                    midani_colors.pack_color(color)
+                    for color in settings[voice_i].color_loop
+                )
+            )
+            for voice_i in settings.voice_order
+        }
         # self.equal_start_xy_size = [False for _ in range(settings.num_voices)]
         # self.equal_end_xy_size = [False for _ in range(settings.num_voices)]
         self.voice_ranges = []
@@ -458,9 +954,13 @@ class PitchTable(PitchRange, list):
         self.pitch_flutters = {}
         self.notes_by_onset = []
         self.notes_by_release = []
+        self.voice_lists = {}
+        # Notes added with add_note() whose ends aren't known yet
+        self.open_notes = set()
         for voice_i in settings.voice_order:
             voice_list = VoiceList()
             self.append(voice_list)
+            self.voice_lists[voice_i] = voice_list
             if voice_i not in settings.voices_to_render:
                 continue
             voice = score.voices[voice_i]
@@ -470,18 +970,21 @@ class PitchTable(PitchRange, list):
                 if voice_i in settings.p_displace_rev
                 else 0
             )
-            for note in voice:
-                attack_ctime = tempo_changes.ctime_from_btime(note.attack_time)
-                end_dur_ctime = tempo_changes.ctime_from_btime(
-                    note.attack_time + note.dur
-                )
-                first_visible = (
-                    attack_ctime + settings[voice_i].min_shadow_x_time
-                )
-                last_visible = (
-                    end_dur_ctime - settings[voice_i].max_shadow_x_time
-                )
-                pitch = note.pitch + pitch_displacement
+            # Convert all attacks and releases of the voice at once
+            attack_ctimes = tempo_changes.ctimes_from_ticks(voice.attack)
+            end_dur_ctimes = tempo_changes.ctimes_from_ticks(
+                voice.attack + voice.dur
+            )
+            pitches = voice.pitch.astype(int) + pitch_displacement
+            min_shadow_x_time = settings[voice_i].min_shadow_x_time
+            max_shadow_x_time = settings[voice_i].max_shadow_x_time
+            for pitch, attack_ctime, end_dur_ctime in zip(
+                pitches.tolist(),
+                attack_ctimes.tolist(),
+                end_dur_ctimes.tolist(),
+            ):
+                first_visible = attack_ctime + min_shadow_x_time
+                last_visible = end_dur_ctime - max_shadow_x_time
                 note_instance = Note(
                     pitch,
                     attack_ctime,
@@ -545,6 +1048,146 @@ class PitchTable(PitchRange, list):
                 for voice_i in voice_indices:
                     self.pitch_flutters[voice_i] = channel_flutters
 
+        # Scale factors depend only on the time until (or since) the attack,
+        # so we compile them into lookup tables here rather than calling the
+        # scale functions for every note on every frame.
+        self._scale_tables = {}
+        self.x_end_scales = {}
+        self.x_start_scales = {}
+        self.y_end_scales = {}
+        self.y_start_scales = {}
+        self.line_end_scales = {}
+        self.line_start_scales = {}
+        for voice_i in range(settings.num_voices):
+            voice_settings = settings[voice_i]
+            self.x_end_scales[voice_i] = self._scale_table(
+                voice_settings.frame_note_end,
+                voice_settings.note_end_width,
+                voice_settings.note_width,
+                voice_settings.end_scale_function,
+            )
+            self.x_start_scales[voice_i] = self._scale_table(
+                voice_settings.frame_note_start,
+                voice_settings.note_start_width,
+                voice_settings.note_width,
+                voice_settings.start_scale_function,
+            )
+            self.y_end_scales[voice_i] = self._scale_table(
+                voice_settings.frame_note_end,
+                voice_settings.note_end_height,
+                voice_settings.note_height,
+                voice_settings.end_scale_function,
+            )
+            self.y_start_scales[voice_i] = self._scale_table(
+                voice_settings.frame_note_start,
+                voice_settings.note_start_height,
+                voice_settings.note_height,
+                voice_settings.start_scale_function,
+            )
+            self.line_end_scales[voice_i] = self._scale_table(
+                voice_settings.frame_line_end,
+                voice_settings.line_end_size,
+                1,
+                voice_settings.end_scale_function,
+            )
+            self.line_start_scales[voice_i] = self._scale_table(
+                voice_settings.frame_line_start,
+                voice_settings.line_start_size,
+                1,
+                voice_settings.start_scale_function,
+            )
+
+    def add_note(self, voice_i, pitch, start, end=None):
+        """Adds a note to voice voice_i after the notes that are already in
+        it, and returns it (or None, if the voice isn't rendered).
+
+        The pitch ranges of the voice, its channel, and the table grow to
+        include the note if necessary, and flutter is added for any new
+        pitches, without rebuilding anything else. (Growing a channel's range
+        moves the notes that are already in it.)
+
+        If end is None, the note is open: it lasts until the time passed to
+        extend_open_notes(), until it is closed with close_note().
+        """
+        if voice_i not in self.settings.voices_to_render:
+            return None
+        pitch += self.settings.p_displace_rev.get(voice_i, 0)
+        voice_settings = self.settings[voice_i]
+        note = Note(
+            pitch,
+            start,
+            start if end is None else end,
+            voice_i,
+            start + voice_settings.min_shadow_x_time,
+            (start if end is None else end) - voice_settings.max_shadow_x_time,
+        )
+        if end is None:
+            self.open_notes.add(note)
+        voice_list = self.voice_lists[voice_i]
+        voice_list.append(note)
+        channel = self.channels[self.settings.chan_assmts[voice_i]]
+        channel.update_from_pitch(pitch)
+        self.update_from_pitch(pitch)
+        flutters = self.pitch_flutters.setdefault(voice_i, {})
+        if pitch not in flutters:
+            if self.settings.flutter_per_voice:
+                flutter_range = range(
+                    voice_list.l_pitch, voice_list.h_pitch + 1
+                )
+                flutter_settings = voice_settings
+            else:
+                # The dict is shared by the voices of the channel
+                flutter_range = range(channel.l_pitch, channel.h_pitch + 1)
+                flutter_settings = self.settings
+            for flutter_pitch in flutter_range:
+                if flutter_pitch not in flutters:
+                    flutters[flutter_pitch] = PitchFlutter(
+                        flutter_settings.max_flutter_size,
+                        flutter_settings.min_flutter_size,
+                        flutter_settings.max_flutter_period,
+                        flutter_settings.min_flutter_period,
+                    )
+        return note
+
+    def close_note(self, note, end):
+        """Sets the end of an open note (see add_note())."""
+        self.open_notes.discard(note)
+        note.set_end(end, end - self.settings[note.voice_i].max_shadow_x_time)
+
+    def extend_open_notes(self, now):
+        """Extends the open notes (see add_note()) to now."""
+        for note in self.open_notes:
+            if now > note.end:
+                note.set_end(
+                    now, now - self.settings[note.voice_i].max_shadow_x_time
+                )
+
+    def drop_past_notes(self, now):
+        """Removes the notes that won't be drawn in any frame at or after
+        now from the start of each voice (see VoiceList.drop_first()), so
+        that notes that were added with add_note() don't accumulate.
+
+        The last note before the notes that are kept is kept too, since
+        connection lines are drawn from it.
+        """
+        for voice_i, voice_list in self.voice_lists.items():
+            voice_settings = self.settings[voice_i]
+            # A note is drawn until now - end exceeds this
+            horizon = (
+                max(
+                    voice_settings.frame_note_start,
+                    voice_settings.frame_line_start,
+                )
+                + voice_settings.max_shadow_x_time
+            )
+            n_past = 0
+            for note in voice_list:
+                if note in self.open_notes or now - note.end <= horizon:
+                    break
+                n_past += 1
+            if n_past > 1:
+                voice_list.drop_first(n_past - 1)
+
     @staticmethod
     def _get_scale_factor(
         time, end_or_start, start_or_end_size, voice_size, scale_func
@@ -558,39 +1201,39 @@ class PitchTable(PitchRange, list):
             * voice_size,
         )
 
+    def _scale_table(
+        self, end_or_start, start_or_end_size, voice_size, scale_func
+    ):
+        """Returns a LookupTable of the scale factor over [0, end_or_start].
+
+        Voices often share the same settings, so tables are cached.
+        """
+        key = (end_or_start, start_or_end_size, voice_size, scale_func)
+        if key not in self._scale_tables:
+            table = LookupTable(
+                functools.partial(
+                    self._get_scale_factor,
+                    end_or_start=end_or_start,
+                    start_or_end_size=start_or_end_size,
+                    voice_size=voice_size,
+                    scale_func=scale_func,
+                ),
+                0,
+                end_or_start,
+                self.settings.lookup_table_max_error,
+            )
+            self._scale_tables[key] = table if table.tabulated else table.func
+        return self._scale_tables[key]
+
     def _scale_x_factor(self, t_until, voice_i):
         if t_until >= 0:
-            return self._get_scale_factor(
-                t_until,
-                self.settings[voice_i].frame_note_end,
-                self.settings[voice_i].note_end_width,
-                self.settings[voice_i].note_width,
-                self.settings[voice_i].end_scale_function,
-            )
-        return self._get_scale_factor(
-            -t_until,
-            self.settings[voice_i].frame_note_start,
-            self.settings[voice_i].note_start_width,
-            self.settings[voice_i].note_width,
-            self.settings[voice_i].start_scale_function,
-        )
+            return self.x_end_scales[voice_i](t_until)
+        return self.x_start_scales[voice_i](-t_until)
 
     def _scale_y_factor(self, t_until, voice_i):
         if t_until >= 0:
-            return self._get_scale_factor(
-                t_until,
-                self.settings[voice_i].frame_note_end,
-                self.settings[voice_i].note_end_height,
-                self.settings[voice_i].note_height,
-                self.settings[voice_i].end_scale_function,
-            )
-        return self._get_scale_factor(
-            -t_until,
-            self.settings[voice_i].frame_note_start,
-            self.settings[voice_i].note_start_height,
-            self.settings[voice_i].note_height,
-            self.settings[voice_i].start_scale_function,
-        )
+            return self.y_end_scales[voice_i](t_until)
+        return self.y_start_scales[voice_i](-t_until)
 
     def scale_factors(self, t_until, voice_i):
         scale_x_factor = self._scale_x_factor(t_until, voice_i)
@@ -603,20 +1246,8 @@ class PitchTable(PitchRange, list):
 
     def line_scale_factor(self, t_until, voice_i):
         if t_until >= 0:
-            return self._get_scale_factor(
-                t_until,
-                self.settings[voice_i].frame_line_end,
-                self.settings[voice_i].line_end_size,
-                1,
-                self.settings[voice_i].end_scale_function,
-            )
-        return self._get_scale_factor(
-            -t_until,
-            self.settings[voice_i].frame_line_start,
-            self.settings[voice_i].line_start_size,
-            1,
-            self.settings[voice_i].start_scale_function,
-        )
+            return self.line_end_scales[voice_i](t_until)
+        return self.line_start_scales[voice_i](-t_until)
 
     def highlight_factor(self, t_until_attack, voice_i):
         if self.settings[voice_i].highlight_strength <= 0:
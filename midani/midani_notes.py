@@ -0,0 +1,435 @@
+"""Provides ColumnarScore and ColumnarVoice, array-backed alternatives to
+note_classes.Score and note_classes.Voice.
+
+Each voice stores its notes as NumPy arrays (one per attribute), sorted by
+attack time, then duration, then pitch, which is the order in which
+note_classes.Voice yields its notes. Only the parts of the Score interface
+that midani uses are provided.
+
+The arrays are never modified in place (methods that change notes assign new
+arrays), so passages returned by get_passage() can be views onto the arrays
+of the original score, and can share its meta messages.
+"""
+
+import typing
+
+import mido
+import numpy as np
+
+import midani.from_my_other_projects.note_classes as note_classes
+
+
+class ColumnarNote(typing.NamedTuple):
+    """The notes yielded by iterating over a ColumnarVoice.
+
+    The field names are the same as the attributes of note_classes.Note.
+    """
+
+    pitch: int
+    attack_time: int
+    dur: int
+    velocity: int
+    choir: int
+    voice: int
+
+
+class ColumnarVoice:
+    """Stores the notes of a voice as NumPy arrays.
+
+    Attributes:
+        pitch: int16 array.
+        attack: int64 array. Attack times (in the units of the score, usually
+            midi ticks).
+        dur: array of durations. int64 unless non-integer durations have been
+            set with set_dur().
+        velocity: uint8 array.
+        channel: uint8 array.
+        voice_i: int. The index number of the voice in the score it was read
+            into.
+        tet: int.
+        range: Nonetype, or tuple of two ints.
+    """
+
+    def __init__(
+        self,
+        pitch=(),
+        attack=(),
+        dur=(),
+        velocity=(),
+        channel=(),
+        voice_i=None,
+        tet=12,
+        voice_range=None,
+        presorted=False,
+    ):
+        self.pitch = np.asarray(pitch, dtype=np.int16)
+        self.attack = np.asarray(attack, dtype=np.int64)
+        self.dur = np.asarray(dur)
+        if self.dur.dtype.kind != "f":
+            self.dur = self.dur.astype(np.int64, copy=False)
+        self.velocity = np.asarray(velocity, dtype=np.uint8)
+        self.channel = np.asarray(channel, dtype=np.uint8)
+        self.voice_i = voice_i
+        self.tet = tet
+        self.range = voice_range
+        # Running maximum of release times, computed when first needed by
+        # get_passage()
+        self._max_release = None
+        if not presorted:
+            self._sort()
+
+    def _sort(self):
+        # np.lexsort is stable, so notes that are equal in all three keys
+        # keep the order in which they were added, as in note_classes.Voice
+        order = np.lexsort((self.pitch, self.dur, self.attack))
+        self._take(order)
+
+    def _take(self, indices):
+        self.pitch = self.pitch[indices]
+        self.attack = self.attack[indices]
+        self.dur = self.dur[indices]
+        self.velocity = self.velocity[indices]
+        self.channel = self.channel[indices]
+        self._max_release = None
+
+    @classmethod
+    def from_voice(cls, voice: note_classes.Voice):
+        notes = list(voice)
+        return cls(
+            [note.pitch for note in notes],
+            [note.attack_time for note in notes],
+            [note.dur for note in notes],
+            [note.velocity for note in notes],
+            [note.choir for note in notes],
+            voice_i=voice.voice_i,
+            tet=voice.tet,
+            voice_range=voice.range,
+            presorted=True,
+        )
+
+    def _new(self, indices):
+        return ColumnarVoice(
+            self.pitch[indices],
+            self.attack[indices],
+            self.dur[indices],
+            self.velocity[indices],
+            self.channel[indices],
+            voice_i=self.voice_i,
+            tet=self.tet,
+            voice_range=self.range,
+            presorted=True,
+        )
+
+    def __len__(self):
+        return len(self.attack)
+
+    def __iter__(self):
+        voice_i = self.voice_i
+        for pitch, attack, dur, velocity, channel in zip(
+            self.pitch.tolist(),
+            self.attack.tolist(),
+            self.dur.tolist(),
+            self.velocity.tolist(),
+            self.channel.tolist(),
+        ):
+            yield ColumnarNote(pitch, attack, dur, velocity, channel, voice_i)
+
+    @property
+    def nbytes(self):
+        """The number of bytes in the note arrays."""
+        return sum(
+            array.nbytes
+            for array in (
+                self.pitch,
+                self.attack,
+                self.dur,
+                self.velocity,
+                self.channel,
+            )
+        )
+
+    def set_dur(self, dur):
+        """Sets the duration of all notes to dur and re-sorts the voice."""
+        self.dur = np.full_like(self.attack, dur, dtype=np.asarray(dur).dtype)
+        if self.dur.dtype.kind != "f":
+            self.dur = self.dur.astype(np.int64)
+        self._sort()
+
+    def rescale(self, factor):
+        """Multiplies all attack times and durations by factor."""
+        self.attack = self.attack * factor
+        self.dur = self.dur * factor
+        self._max_release = None
+
+    def get_passage(
+        self,
+        passage_start_time=None,
+        passage_end_time=None,
+        dont_overlap_start=True,
+        end_time_refers_to_attack=True,
+    ):
+        """Returns a single voice of a given passage.
+
+        Arguments are as for note_classes.Voice.get_passage().
+
+        The notes attacked in the passage are found by bisecting the attack
+        times. If dont_overlap_start is True and end_time_refers_to_attack is
+        True (the defaults), the arrays of the returned voice are views onto
+        the arrays of this voice. Otherwise, only the notes that might belong
+        to the passage are examined and copied.
+        """
+        start_i = (
+            0
+            if passage_start_time is None
+            else np.searchsorted(self.attack, passage_start_time, side="left")
+        )
+        end_i = (
+            len(self)
+            if passage_end_time is None
+            else np.searchsorted(self.attack, passage_end_time, side="left")
+        )
+        if passage_start_time is not None and not dont_overlap_start:
+            # Notes attacked before passage_start_time that are still
+            # sounding can only occur after the first note whose release (or
+            # that of an earlier note) is at or after passage_start_time
+            if self._max_release is None:
+                self._max_release = np.maximum.accumulate(
+                    self.attack + self.dur
+                )
+            start_i = min(
+                np.searchsorted(
+                    self._max_release, passage_start_time, side="left"
+                ),
+                start_i,
+            )
+        indices = slice(start_i, max(start_i, end_i))
+        if dont_overlap_start and end_time_refers_to_attack:
+            return self._new(indices)
+        attack = self.attack[indices]
+        release = attack + self.dur[indices]
+        mask = np.ones(len(attack), dtype=bool)
+        if passage_start_time is not None and not dont_overlap_start:
+            mask &= release >= passage_start_time
+        if passage_end_time is not None and not end_time_refers_to_attack:
+            mask &= release <= passage_end_time
+        return self._new(np.arange(start_i, start_i + len(attack))[mask])
+
+    def displace_passage(self, displacement):
+        """Moves all notes by displacement. Notes that would be moved before
+        0 are deleted."""
+        if displacement == 0:
+            return
+        self.attack = self.attack + displacement
+        self._take(self.attack >= 0)
+
+
+class ColumnarScore:
+    """A score made of ColumnarVoices.
+
+    Attributes:
+        voices: list of ColumnarVoice.
+        num_voices: int.
+        meta_messages: list of mido meta messages.
+        tet: int.
+        ticks_per_beat: int. As in note_classes.Score.
+        attacks_adjusted_by: number. As in note_classes.Score.
+    """
+
+    def __init__(self, tet=12, ticks_per_beat=1):
+        self.voices = []
+        self.num_voices = 0
+        self.meta_messages = []
+        self.tet = tet
+        self.ticks_per_beat = ticks_per_beat
+        self.attacks_adjusted_by = 0
+
+    @classmethod
+    def from_score(cls, score: note_classes.Score):
+        out = cls(tet=score.tet, ticks_per_beat=score.ticks_per_beat)
+        for voice in score.voices:
+            out.add_voice(ColumnarVoice.from_voice(voice))
+        out.meta_messages = list(score.meta_messages)
+        out.attacks_adjusted_by = score.attacks_adjusted_by
+        return out
+
+    def __len__(self):
+        """Returns number of notes across all voices."""
+        return sum(len(voice) for voice in self.voices)
+
+    def __iter__(self):
+        """Yields lists of the notes attacked at each attack time."""
+        if not len(self):
+            return
+        notes = [note for voice in self.voices for note in voice]
+        attacks = np.concatenate([voice.attack for voice in self.voices])
+        order = np.argsort(attacks, kind="stable")
+        sorted_attacks = attacks[order]
+        breaks = np.flatnonzero(np.diff(sorted_attacks)) + 1
+        for indices in np.split(order, breaks):
+            yield [notes[i] for i in indices.tolist()]
+
+    @property
+    def nbytes(self):
+        """The number of bytes in the note arrays."""
+        return sum(voice.nbytes for voice in self.voices)
+
+    def get_total_len(self):
+        """Returns the time from 0 to the release of the notes attacked last.
+
+        As in note_classes.Score.get_total_len(), only the notes attacked at
+        the last attack time of each voice are considered.
+        """
+        total_len = 0
+        for voice in self.voices:
+            if not len(voice):
+                continue
+            # Since notes are sorted by duration within each attack time, the
+            # last note has the longest duration among the last attacks
+            final_release = voice.attack[-1] + voice.dur[-1]
+            if final_release > total_len:
+                total_len = final_release.item()
+        return total_len
+
+    def add_voice(self, voice=None, voice_i=None, voice_range=None):
+        """Adds a voice."""
+        if voice is None:
+            if voice_i is None:
+                voice_i = self.num_voices
+            voice = ColumnarVoice(
+                voice_i=voice_i, tet=self.tet, voice_range=voice_range
+            )
+        elif voice_i is not None:
+            voice.voice_i = voice_i
+        self.voices.append(voice)
+        self.num_voices += 1
+        return voice
+
+    def remove_empty_voices(self):
+        """Removes any voices that contain no notes."""
+        self.voices = [voice for voice in self.voices if len(voice)]
+        self.num_voices = len(self.voices)
+
+    def add_meta_message(self, message):
+        self.meta_messages.append(message)
+
+    def displace_passage(self, displacement):
+        """Moves the whole score forward or backward in time.
+
+        As in note_classes.Score.displace_passage(), notes moved before 0 are
+        deleted and meta messages moved before 0 are placed at 0.
+        """
+        if displacement == 0:
+            return
+        for voice in self.voices:
+            voice.displace_passage(displacement)
+        # Meta messages may be shared with other scores, so we replace them
+        # rather than changing their times
+        self.meta_messages = [
+            msg.copy(time=max(msg.time + displacement, 0))
+            for msg in self.meta_messages
+        ]
+
+    def move_first_note_to_0(self, min_attack_to_adjust):
+        """Displaces the score so that the first note is at time 0, unless
+        the first note is attacked before min_attack_to_adjust.
+        """
+        first_attack = min(
+            (voice.attack[0].item() for voice in self.voices if len(voice)),
+            default=self.get_total_len(),
+        )
+        if first_attack < min_attack_to_adjust:
+            return
+        if first_attack > 0:
+            self.attacks_adjusted_by = -first_attack
+            self.displace_passage(-first_attack)
+
+    def set_dur(self, dur):
+        """Sets the duration of all notes to dur."""
+        for voice in self.voices:
+            voice.set_dur(dur)
+
+    def rescale_ticks(self, factor: int):
+        """Multiplies all times by factor (and ticks_per_beat accordingly)."""
+        if factor == 1:
+            return
+        for voice in self.voices:
+            voice.rescale(factor)
+        self.meta_messages = [
+            msg.copy(time=msg.time * factor) for msg in self.meta_messages
+        ]
+        self.ticks_per_beat *= factor
+
+    def get_passage(
+        self,
+        passage_start_time=None,
+        passage_end_time=None,
+        dont_overlap_start=True,
+        end_time_refers_to_attack=True,
+    ):
+        """Returns all voices of a given passage as a ColumnarScore.
+
+        Arguments are as for note_classes.Score.get_passage().
+
+        See ColumnarVoice.get_passage() regarding the voices of the returned
+        score. Its meta messages are the meta messages of this score (not
+        copies), except for the tempo message that is added at
+        passage_start_time if necessary.
+        """
+        passage = ColumnarScore(
+            tet=self.tet, ticks_per_beat=self.ticks_per_beat
+        )
+        for voice in self.voices:
+            passage.add_voice(
+                voice.get_passage(
+                    passage_start_time=passage_start_time,
+                    passage_end_time=passage_end_time,
+                    dont_overlap_start=dont_overlap_start,
+                    end_time_refers_to_attack=end_time_refers_to_attack,
+                )
+            )
+
+        first_tempo_msg_after_passage_start = None
+        last_tempo_msg_before_passage_start = None
+        for msg in self.meta_messages:
+            if passage_start_time is not None and msg.time < passage_start_time:
+                if msg.type == "set_tempo":
+                    last_tempo_msg_before_passage_start = msg
+                continue
+            if passage_end_time is not None and msg.time >= passage_end_time:
+                continue
+            if (
+                msg.type == "set_tempo"
+                and first_tempo_msg_after_passage_start is None
+            ):
+                first_tempo_msg_after_passage_start = msg
+            passage.add_meta_message(msg)
+        if passage_start_time is None:
+            return passage
+
+        if last_tempo_msg_before_passage_start is not None and (
+            first_tempo_msg_after_passage_start is None
+            or first_tempo_msg_after_passage_start.time > passage_start_time
+        ):
+            passage.add_meta_message(
+                last_tempo_msg_before_passage_start.copy(
+                    time=passage_start_time
+                )
+            )
+
+        return passage
+
+    def get_tempo_changes_from_meta_messages(self, coerce_=float):
+        """Get the tempo changes.
+
+        Keyword args:
+            coerce_: type to coerce the tempo change times to. (Tempos
+                themselves are floats.)
+
+        Returns:
+            A list of 2-tuples of form (tempo, tempo change time).
+        """
+        return [
+            (mido.tempo2bpm(msg.tempo), coerce_(msg.time))
+            for msg in self.meta_messages
+            if msg.type == "set_tempo"
+        ]
@@ -0,0 +1,151 @@
+"""Provides Pipeline class to plot frames in R and encode them while more
+frames are being written.
+
+Without a pipeline, the stages of making a video run one after another: all
+the R scripts are written, then Rscript is run on each of them, then all the
+pngs are encoded. With a pipeline, each R script is passed to Rscript (in a
+worker thread) as soon as RBoss has finished writing it, and the pngs it
+plots are encoded (in another thread) as soon as they and all the frames
+before them are plotted. The Rscript processes and the encoder thus run on
+other cores while the main thread writes the next scripts.
+
+At most settings.pipeline_max_chunks scripts are in flight at once; when that
+many have been written but not yet encoded, the main thread waits. So the
+temporary R scripts and pngs don't grow with the length of the video.
+"""
+import os
+import queue
+import subprocess
+import threading
+
+import cv2
+
+from . import midani_av
+
+
+class Pipeline:
+    """See the module docstring.
+
+    Args:
+        settings: Settings.
+        encode: bool. If False, the pngs are only plotted, not encoded.
+        clean_up: bool. If True, each R script is removed once Rscript has
+            run on it.
+    """
+
+    def __init__(self, settings, encode=True, clean_up=True):
+        self.settings = settings
+        self.encode = encode
+        self.clean_up = clean_up
+        os.makedirs(settings.output_dirname, exist_ok=True)
+        num_processes = settings.pipeline_r_processes or os.cpu_count() or 1
+        self._slots = threading.BoundedSemaphore(settings.pipeline_max_chunks)
+        self._scripts = queue.Queue()
+        self._plotted = queue.Queue()
+        self._success = True
+        self._error = None
+        self._r_threads = [
+            threading.Thread(target=self._run_scripts, daemon=True)
+            for _ in range(num_processes)
+        ]
+        self._encoder = threading.Thread(target=self._encode, daemon=True)
+        for thread in self._r_threads:
+            thread.start()
+        self._encoder.start()
+
+    def submit(self, script_fname, first_png, last_png):
+        """Queues script_fname, which plots pngs first_png to last_png
+        (inclusive), to be run with Rscript.
+
+        Blocks while settings.pipeline_max_chunks scripts are in flight.
+        """
+        self._slots.acquire()  # pylint: disable=consider-using-with
+        self._scripts.put((script_fname, first_png, last_png))
+
+    def _run_scripts(self):
+        while True:
+            item = self._scripts.get()
+            if item is None:
+                return
+            script_fname, first_png, last_png = item
+            plotted = False
+            try:
+                proc = subprocess.run(
+                    ["Rscript", script_fname],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    check=False,
+                )
+                if proc.returncode != 0:
+                    print("")
+                    print(f"Rscript returned error code {proc.returncode}")
+                    print(proc.stdout.decode())
+                    self._success = False
+                else:
+                    plotted = True
+                if self.clean_up:
+                    os.remove(script_fname)
+            except Exception as exc:  # pylint: disable=broad-except
+                # Re-raised in finish()
+                self._error = exc
+                self._success = False
+            finally:
+                # The encoder releases the slot even if nothing was plotted
+                self._plotted.put((first_png, last_png, plotted))
+
+    def _encode(self):
+        out = reader = None
+        if self.encode:
+            try:
+                out = midani_av.open_video_writer(self.settings)
+                reader = midani_av.PngReader(self.settings)
+            except Exception as exc:  # pylint: disable=broad-except
+                # Re-raised in finish(). The chunks are still drained below,
+                # so that submit() doesn't wait forever for a slot.
+                self._error = exc
+                self._success = False
+                if out is not None:
+                    out.release()
+                out = None
+        # Chunks that have been plotted, but not all of whose predecessors
+        # have been, by first png
+        pending = {}
+        next_png = 1
+        while True:
+            item = self._plotted.get()
+            if item is None:
+                break
+            first_png, last_png, plotted = item
+            pending[first_png] = (last_png, plotted)
+            while next_png in pending:
+                last_png, plotted = pending.pop(next_png)
+                try:
+                    if plotted and out is not None:
+                        if not reader.write(out, next_png, last_png):
+                            self._success = False
+                except Exception as exc:  # pylint: disable=broad-except
+                    # Re-raised in finish()
+                    self._error = exc
+                    self._success = False
+                finally:
+                    next_png = last_png + 1
+                    self._slots.release()
+        if out is not None:
+            reader.close()
+            out.release()
+            cv2.destroyAllWindows()  # pylint: disable=no-member
+
+    def finish(self) -> bool:
+        """Waits for all the submitted scripts to be plotted (and encoded).
+
+        Returns False if any of them failed.
+        """
+        for _ in self._r_threads:
+            self._scripts.put(None)
+        for thread in self._r_threads:
+            thread.join()
+        self._plotted.put(None)
+        self._encoder.join()
+        if self._error is not None:
+            raise self._error
+        return self._success
@@ -1,17 +1,29 @@
 """Plots frames according to settings.
 """
 
+import copy
+import itertools
 import math
+import multiprocessing
 import operator
+import os
 import typing as t
 import warnings
 
+import cv2
+import numpy as np
+
 from . import midani_annotations
+from . import midani_av
 from . import midani_colors
+from . import midani_frame_store
 from . import midani_misc_classes
+from . import midani_pipeline
+from . import midani_ring
 
 from . import midani_r
 from . import midani_score
+from . import midani_strip
 from . import midani_time
 from . import midani_settings
 
@@ -64,11 +76,37 @@ def _line_or_its_shadow_in_frame(now, note, note_i, settings, voice, voice_i):
 
 
 def get_voice_and_line_tuples(
-    now, settings, table: midani_misc_classes.PitchTable
+    now,
+    settings,
+    table: midani_misc_classes.PitchTable,
+    rect_tuples=None,
+    line_tuples=None,
+    window=None,
+    buckets: t.Optional[midani_misc_classes.PrimitiveBuckets] = None,
 ):
-    rect_tuples = []
-    line_tuples = []
-    for voice_i, voice in zip(settings.voice_order, table):
+    """Returns lists (one per voice, in voice order) of the RectTuples and
+    LineTuples to draw at time now.
+
+    If the lists returned for the previous frame are passed as rect_tuples and
+    line_tuples, they are refilled rather than constructing new ones (see
+    midani_misc_classes.RecordList).
+
+    If window and buckets are passed, each note is drawn as it is visited: its
+    rect, the connection line from the previous note, and their shadows are
+    added to buckets, which should then be flushed to the plot boss.
+    """
+    if rect_tuples is None:
+        rect_tuples = [
+            midani_misc_classes.RecordList(midani_misc_classes.RectTuple)
+            for _ in settings.voice_order
+        ]
+        line_tuples = [
+            midani_misc_classes.RecordList(midani_misc_classes.LineTuple)
+            for _ in settings.voice_order
+        ]
+    for voice_i, voice, voice_rects, voice_lines in zip(
+        settings.voice_order, table, rect_tuples, line_tuples
+    ):
         if settings[voice_i].bounce_type == "scalar":
             bounce_term = max(
                 1,
@@ -76,10 +114,24 @@ def get_voice_and_line_tuples(
             )
         else:
             bounce_term = 0
-        voice_color = settings[voice_i].color
-        color_loop = settings[voice_i].color_loop
-        rect_tuples.append([])
-        line_tuples.append([])
+        # Colors are packed (see midani_colors.pack_color())
+        voice_color = midani_colors.pack_color(settings[voice_i].color)
+        color_loop = table.color_loops[voice_i]
+        voice_rects.clear()
+        voice_lines.clear()
+        emit_rects = emit_lines = False
+        prev_line = None
+        if buckets is not None and voice_i in settings.voices_to_render:
+            emit_rects = settings[voice_i].rectangles
+            emit_lines = settings[voice_i].connection_lines
+            channel = table.channels[settings.chan_assmts[voice_i]]
+            shadow_color = midani_colors.pack_color(
+                midani_colors.cached_blend_colors(
+                    window.bg_color,
+                    settings[voice_i].shadow_color,
+                    settings[voice_i].shadow_strength,
+                )
+            )
         for note_i, note in enumerate(voice):
             # TODO calculate start and end times for each note *once*
             rect_in_frame = _rect_or_its_shadow_in_frame(
@@ -99,7 +151,7 @@ def get_voice_and_line_tuples(
             if settings.scale_notes_from_attack:
                 t_until_for_scale = t_until_attack
             else:
-                t_until_for_scale = note.t_mid - now
+                t_until_for_scale = note.mid - now
             scale_x_factor, scale_y_factor = table.scale_factors(
                 t_until_for_scale, voice_i
             )
@@ -143,32 +195,50 @@ def get_voice_and_line_tuples(
                 else:
                     flutter += bounce
             if color_loop is not None:
-                color = color_loop[note_i % len(color_loop)]
+                color = color_loop[
+                    (voice.first_note_i + note_i) % len(color_loop)
+                ]
             else:
                 color = voice_color
-            # LONGTERM why store these tuples in a list instead of plotting
-            #   them directly from this function?
             if rect_in_frame:
-                rect_tuples[-1].append(
-                    midani_misc_classes.RectTuple(
-                        note,
-                        scale_x_factor,
-                        scale_y_factor,
-                        flutter,
-                        color,
-                        highlight_factor,
-                    )
+                rect = voice_rects.add(
+                    note,
+                    scale_x_factor,
+                    scale_y_factor,
+                    flutter,
+                    color,
+                    highlight_factor,
                 )
-            if line_in_frame:
-                line_tuples[-1].append(
-                    midani_misc_classes.LineTuple(
-                        note,
-                        line_scale_factor,
-                        flutter,
-                        voice_color,
-                        highlight_factor,
+                if emit_rects:
+                    _emit_rect(
+                        rect,
+                        voice_i,
+                        channel,
+                        shadow_color,
+                        window,
+                        settings,
+                        buckets,
                     )
+            if line_in_frame:
+                line = voice_lines.add(
+                    note,
+                    line_scale_factor,
+                    flutter,
+                    voice_color,
+                    highlight_factor,
                 )
+                if emit_lines and prev_line is not None:
+                    _emit_connection_line(
+                        prev_line,
+                        line,
+                        voice_i,
+                        channel,
+                        shadow_color,
+                        window,
+                        settings,
+                        buckets,
+                    )
+                prev_line = line
 
     return rect_tuples, line_tuples
 
@@ -179,116 +249,84 @@ def _get_shadow_gradient(
     shadow_n_strength = shadow_i / (
         settings[voice_i].num_shadows + settings[voice_i].shadow_gradient_offset
     )
-    shadow_n_color = midani_colors.blend_colors(
+    shadow_n_color = midani_colors.blend_packed(
         shadow_color,
         main_color,
         shadow_n_strength,
     )
     if hl_blend := hl_factor * settings[voice_i].shadow_hl_strength:
-        shadow_n_color = midani_colors.blend_colors(
+        shadow_n_color = midani_colors.blend_packed(
             shadow_n_color,
-            settings[voice_i].highlight_color,
+            midani_colors.pack_color(settings[voice_i].highlight_color),
             hl_blend,
         )
     return shadow_n_color
 
 
-def draw_note_shadows(
-    shadow_i, shadow_position, rect_tuples, window, settings, table, plot_boss
-):
-    shadow_n = settings.num_shadows - shadow_i
-    for voice_i, voice in zip(settings.voice_order, rect_tuples):
-        if (
-            voice_i not in settings.voices_to_render
-            or not voice
-            or not settings[voice_i].rectangles
-        ):
-            continue
-        channel_i = settings.chan_assmts[voice_i]
-        channel = table.channels[channel_i]
-        shadow_color = midani_colors.blend_colors(
-            window.bg_color,
-            settings[voice_i].shadow_color,
-            settings[voice_i].shadow_strength,
+def _emit_rect(rect, voice_i, channel, shadow_color, window, settings, buckets):
+    """Emits the rectangle of a note and its shadows into buckets."""
+    for shadow_i, shadow_position in enumerate(buckets.shadow_positions):
+        shadow_n = settings.num_shadows - shadow_i
+        width = (
+            rect.note.dur
+            * rect.scale_x_factor
+            * settings[voice_i].shadow_scale_x ** shadow_n
         )
-        shadow_n_color = shadow_color
-
-        for rect in voice:
-            half_width = (
-                rect.note.dur
-                * rect.scale_x_factor
-                * settings[voice_i].shadow_scale_x ** shadow_n
-                / 2
-            )
-            # half_height = (
-            #     channel.note_height
-            #     * rect.scale_y_factor
-            #     * settings[voice_i].shadow_scale ** shadow_n
-            #     / 2
-            # )
-            height = channel.pixel_height(
-                rect.scale_y_factor
-                * settings[voice_i].shadow_scale_y ** shadow_n
+        height = channel.pixel_height(
+            rect.scale_y_factor * settings[voice_i].shadow_scale_y ** shadow_n
+        )
+        lower_half = height // 2
+        upper_half = height - lower_half
+        shadow_y = shadow_position.shadow_y
+        y_position = channel.y_position(rect.pitch)
+        bottom = y_position - lower_half + shadow_y
+        top = y_position + upper_half + shadow_y
+        if bottom >= top:
+            continue
+        shadow_x = shadow_position.shadow_x
+        if settings[voice_i].shadow_gradients:
+            shadow_n_color = _get_shadow_gradient(
+                shadow_i,
+                shadow_color,
+                rect.color,
+                rect.highlight_factor,
+                settings,
+                voice_i,
             )
-            lower_half = height // 2
-            upper_half = height - lower_half
-            shadow_y = shadow_position.shadow_y
-            # bottom = channel.y_position(rect.pitch) - half_height + shadow_y
-            # top = channel.y_position(rect.pitch) + half_height + shadow_y
-            bottom = channel.y_position(rect.pitch) - lower_half + shadow_y
-            top = channel.y_position(rect.pitch) + upper_half + shadow_y
-            if bottom >= top:
-                continue
-            shadow_x = shadow_position.shadow_x
-            if settings[voice_i].shadow_gradients:
-                shadow_n_color = _get_shadow_gradient(
-                    shadow_i,
-                    shadow_color,
-                    rect.color,
-                    rect.highlight_factor,
-                    settings,
-                    voice_i,
-                )
-            plot_boss.plot_rect(
-                max(
-                    window.start,
-                    rect.note.mid + shadow_x - half_width,
-                ),
-                min(
-                    window.end,
-                    rect.note.mid + shadow_x + half_width,
-                ),
+        else:
+            shadow_n_color = shadow_color
+        buckets.note_shadows[shadow_i].append(
+            (
+                *window.x_extent(rect.note.mid + shadow_x, width),
                 bottom,
                 top,
                 shadow_n_color,
-                zorder=5,
             )
-
-
-def draw_shadows(line_tuples, rect_tuples, window, settings, table, plot_boss):
-    if settings.shadows <= 0:
-        return
-    for shadow_i, shadow_position in enumerate(
-        reversed(settings.shadow_positions)
-    ):
-        draw_line_shadows(
-            shadow_i,
-            shadow_position,
-            line_tuples,
-            window,
-            settings,
-            table,
-            plot_boss,
         )
-        draw_note_shadows(
-            shadow_i,
-            shadow_position,
-            rect_tuples,
-            window,
-            settings,
-            table,
-            plot_boss,
+    hl_strength_factor = (
+        rect.highlight_factor * settings[voice_i].highlight_strength
+    )
+    if hl_strength_factor > 0:
+        color = midani_colors.blend_packed(
+            rect.color,
+            midani_colors.pack_color(settings[voice_i].highlight_color),
+            hl_strength_factor,
         )
+    else:
+        color = rect.color
+    height = channel.pixel_height(rect.scale_y_factor)
+    lower_half = height // 2
+    upper_half = height - lower_half
+    y_position = channel.y_position(rect.pitch)
+    width = rect.note.dur * rect.scale_x_factor
+    buckets.notes.append(
+        (
+            *window.x_extent(rect.note.mid, width),
+            y_position - lower_half,
+            y_position + upper_half,
+            color,
+        )
+    )
 
 
 def _connection_line_conditions_apply(now, src, dst, settings, voice_i):
@@ -327,165 +365,75 @@ def _connection_line_conditions_apply(now, src, dst, settings, voice_i):
     return True
 
 
-def draw_line_shadows(
-    shadow_i, shadow_position, line_tuples, window, settings, table, plot_boss
+def _emit_connection_line(
+    src, dst, voice_i, channel, shadow_color, window, settings, buckets
 ):
-    for voice_i, voice in zip(settings.voice_order, line_tuples):
-        if (
-            voice_i not in settings.voices_to_render
-            or not voice
-            or not settings[voice_i].connection_lines
-        ):
-            continue
-        line_start_offset = settings[voice_i].connection_line_start_offset
-        line_end_offset = settings[voice_i].connection_line_end_offset
-        channel_i = settings.chan_assmts[voice_i]
-        channel = table.channels[channel_i]
-        shadow_color = midani_colors.blend_colors(
-            window.bg_color,
-            settings[voice_i].shadow_color,
-            settings[voice_i].shadow_strength,
-        )
-        for src, dst in zip(voice, voice[1:]):
-            if not _connection_line_conditions_apply(
-                window.now, src, dst, settings, voice_i
-            ):
-                continue
-            if settings[voice_i].shadow_gradients:
-                src_color = midani_colors.blend_colors(
-                    src.color,
-                    settings[voice_i].con_line_offset_color,
-                    settings[voice_i].con_line_offset_prop,
-                )
-                shadow_n_color = _get_shadow_gradient(
-                    shadow_i,
-                    shadow_color,
-                    src_color,
-                    0,  # no highlighting of connection lines
-                    settings,
-                    voice_i,
-                )
-            else:
-                shadow_n_color = shadow_color
-            x1 = (
-                src.note.mid
-                if line_end_offset is None
-                else max(src.note.end - line_end_offset, src.note.mid)
-            )
-            x2 = (
-                dst.note.mid
-                if line_start_offset is None
-                else min(dst.note.start + line_start_offset, dst.note.mid)
-            )
-            plot_boss.plot_line(
-                x1=x1 + shadow_position.cline_shadow_x,
-                x2=x2 + shadow_position.cline_shadow_x,
-                y1=channel.y_position(src.pitch)
-                + shadow_position.cline_shadow_y,
-                y2=channel.y_position(dst.pitch)
-                + shadow_position.cline_shadow_y,
-                width=settings[voice_i].con_line_width * src.scale_factor,
-                color=shadow_n_color,
-                zorder=1,
-            )
-
-
-def draw_connection_lines(line_tuples, window, settings, table, plot_boss):
-    for voice_i, voice in zip(settings.voice_order, line_tuples):
-        if (
-            voice_i not in settings.voices_to_render
-            or not voice
-            or not settings[voice_i].connection_lines
-        ):
-            continue
-        channel_i = settings.chan_assmts[voice_i]
-        channel = table.channels[channel_i]
-        line_start_offset = settings[voice_i].connection_line_start_offset
-        line_end_offset = settings[voice_i].connection_line_end_offset
-        for src, dst in zip(voice, voice[1:]):
-            if not _connection_line_conditions_apply(
-                window.now, src, dst, settings, voice_i
-            ):
-                continue
-            color = midani_colors.blend_colors(
-                src.color,
-                settings[voice_i].con_line_offset_color,
-                settings[voice_i].con_line_offset_prop,
-            )
-            x1 = (
-                src.note.mid
-                if line_end_offset is None
-                else max(src.note.end - line_end_offset, src.note.mid)
-            )
-            x2 = (
-                dst.note.mid
-                if line_start_offset is None
-                else min(dst.note.start + line_start_offset, dst.note.mid)
-            )
-            plot_boss.plot_line(
-                x1=x1,
-                x2=x2,
-                y1=channel.y_position(src.pitch),
-                y2=channel.y_position(dst.pitch),
-                color=color,
-                width=settings[voice_i].con_line_width * src.scale_factor,
-                zorder=10,
-            )
-
-
-def draw_notes(rect_tuples, window, settings, table, plot_boss):
-    for voice_i, voice in zip(settings.voice_order, rect_tuples):
-        if (
-            voice_i not in settings.voices_to_render
-            or not voice
-            or not settings[voice_i].rectangles
-        ):
-            continue
-        channel_i = settings.chan_assmts[voice_i]
-        channel = table.channels[channel_i]
-        for rect in voice:
-            hl_strength_factor = (
-                rect.highlight_factor * settings[voice_i].highlight_strength
+    """Emits the connection line from src to dst and its shadows into
+    buckets.
+    """
+    if not _connection_line_conditions_apply(
+        window.now, src, dst, settings, voice_i
+    ):
+        return
+    line_start_offset = settings[voice_i].connection_line_start_offset
+    line_end_offset = settings[voice_i].connection_line_end_offset
+    color = midani_colors.blend_packed(
+        src.color,
+        midani_colors.pack_color(settings[voice_i].con_line_offset_color),
+        settings[voice_i].con_line_offset_prop,
+    )
+    x1 = (
+        src.note.mid
+        if line_end_offset is None
+        else max(src.note.end - line_end_offset, src.note.mid)
+    )
+    x2 = (
+        dst.note.mid
+        if line_start_offset is None
+        else min(dst.note.start + line_start_offset, dst.note.mid)
+    )
+    y1 = channel.y_position(src.pitch)
+    y2 = channel.y_position(dst.pitch)
+    width = settings[voice_i].con_line_width * src.scale_factor
+    for shadow_i, shadow_position in enumerate(buckets.shadow_positions):
+        if settings[voice_i].shadow_gradients:
+            shadow_n_color = _get_shadow_gradient(
+                shadow_i,
+                shadow_color,
+                color,
+                0,  # no highlighting of connection lines
+                settings,
+                voice_i,
             )
-            if hl_strength_factor > 0:
-                color = midani_colors.blend_colors(
-                    rect.color,
-                    settings[voice_i].highlight_color,
-                    hl_strength_factor,
-                )
-            else:
-                color = rect.color
-            half_width = 0.5 * rect.note.dur * rect.scale_x_factor
-            # The next lines are part of an abortive attempt to express
-            # x coordinates in pixels, which I foolishly started before
-            # committing other changes...
-            # width = window.x_width(rect.note.dur * rect.scale_x_factor)
-            # left_width = width // 2
-            # right_width = width - left_width
-            # x_mid = window.x_position(rect.note.mid)
-            height = channel.pixel_height(rect.scale_y_factor)
-            lower_half = height // 2
-            upper_half = height - lower_half
-            plot_boss.plot_rect(
-                x1=max(window.start, rect.note.mid - half_width),
-                x2=min(window.end, rect.note.mid + half_width),
-                # The next lines are part of an abortive attempt to express
-                # x coordinates in pixels, which I foolishly started before
-                # committing other changes...
-                # x1=max(window.pixel_start, x_mid - left_width),
-                # x2=min(window.pixel_end, x_mid + right_width),
-                y1=channel.y_position(rect.pitch) - lower_half,
-                y2=channel.y_position(rect.pitch) + upper_half,
-                color=color,
-                zorder=15,
+        else:
+            shadow_n_color = shadow_color
+        buckets.line_shadows[shadow_i].append(
+            (
+                window.x_position(x1 + shadow_position.cline_shadow_x),
+                window.x_position(x2 + shadow_position.cline_shadow_x),
+                y1 + shadow_position.cline_shadow_y,
+                y2 + shadow_position.cline_shadow_y,
+                shadow_n_color,
+                width,
             )
+        )
+    buckets.lines.append(
+        (
+            window.x_position(x1),
+            window.x_position(x2),
+            y1,
+            y2,
+            color,
+            width,
+        )
+    )
 
 
 def draw_lyrics(window, lyricist, settings, plot_boss):
     lyric = lyricist(window.now)
     if lyric is None:
         return
-    x = (window.end - window.start) * settings.lyrics_x + window.start
+    x = (window.x_end - window.x_start) * settings.lyrics_x + window.x_start
     y = settings.lyrics_y
     plot_boss.text(
         text=lyric,
@@ -504,7 +452,7 @@ def draw_annotations(window, settings, plot_boss):
             for line in midani_annotations.ANNOT[annot](window).split("\n"):
                 plot_boss.text(
                     text=line,
-                    x=window.now,
+                    x=window.x_position(window.now),
                     y=window.y_position(y),
                     color=settings.annot_color,
                     size=settings.annot_size,
@@ -603,6 +551,8 @@ def draw_brackets(table, window, settings, plot_boss):
             for x1, x2 in yield_bracket_coords(
                 bracket, voice, voice_i, bracket_settings, window
             ):
+                x1 = window.x_position(x1)
+                x2 = window.x_position(x2)
                 if bracket_settings.above:
                     op = operator.add
                     extreme = max
@@ -702,43 +652,95 @@ def preprocess_frame_list(settings, frame_list):
     return out
 
 
-def draw_piano_roll_background(table, window, settings, plot_boss):
+def _draw_piano_roll_rect(run, window, plot_boss):
+    y1, y2, color = run
+    plot_boss.plot_rect(
+        window.x_start, window.x_end, y1, y2, color=color, zorder=0
+    )
+
+
+def draw_piano_roll_background(table, window, settings, plot_boss, counts=None):
+    """Draws the piano roll background of each channel that has one.
+
+    If settings.cull_primitives is True, the rects of adjacent pitches of the
+    same color are drawn as a single rect, and the number of rects saved is
+    added to counts["merged"].
+    """
     colors = settings.piano_roll_colors
     color_map = settings.piano_roll_color_map
     consecutive_white_keys = settings.consecutive_white_keys
     for chan_i, channel in table.channels.items():
         if settings.channel_settings[chan_i]["piano_roll_bg"]:
-            z = {"rect": 1, "line": 2}
+            # (y1, y2, color) of the rect that is being extended
+            run = None
             for pitch in range(channel.l_pitch, channel.h_pitch + 1):
                 pitch_height = channel.y_position(pitch)
                 half_height = channel.pixel_height(1) / 2
                 if pitch % settings.tet in color_map:
                     color = colors[color_map[pitch % settings.tet]]
-                    plot_boss.plot_rect(
-                        window.start,
-                        window.end,
-                        pitch_height - half_height,
-                        pitch_height + half_height,
-                        color=color,
-                        zorder=0,
-                    )
-
-                elif (
+                    y1 = pitch_height - half_height
+                    y2 = pitch_height + half_height
+                    if run is not None:
+                        if (
+                            settings.cull_primitives
+                            and run[1] == y1
+                            and run[2] == color
+                        ):
+                            run = (run[0], y2, color)
+                            if counts is not None:
+                                counts["merged"] += 1
+                            continue
+                        _draw_piano_roll_rect(run, window, plot_boss)
+                    run = (y1, y2, color)
+                    continue
+                if run is not None:
+                    _draw_piano_roll_rect(run, window, plot_boss)
+                    run = None
+                if (
                     pitch % settings.tet in consecutive_white_keys
                     and pitch != channel.l_pitch
                 ):
                     plot_boss.plot_line(
-                        window.start,
-                        window.end,
+                        window.x_start,
+                        window.x_end,
                         pitch_height - half_height,
                         pitch_height - half_height,
                         color=settings.between_consecutive_white_keys_color,
                         width=1,  # TODO ?
                         zorder=0,
                     )
+            if run is not None:
+                _draw_piano_roll_rect(run, window, plot_boss)
+
 
+def _merge_metric_columns(columns, counts):
+    """Merges adjacent columns of the same color.
 
-def draw_metric_columns(window, settings, plot_boss):
+    columns is a list of (onset, release, color) tuples. If any of them
+    overlap, they are returned unchanged, since the order in which they are
+    drawn matters.
+    """
+    columns = sorted(columns, key=lambda column: column[0])
+    merged = []
+    for onset, release, color in columns:
+        if merged and merged[-1][1] > onset:
+            return None
+        if merged and merged[-1][1] == onset and merged[-1][2] == color:
+            merged[-1] = (merged[-1][0], release, color)
+            if counts is not None:
+                counts["merged"] += 1
+        else:
+            merged.append((onset, release, color))
+    return merged
+
+
+def draw_metric_columns(window, settings, plot_boss, counts=None):
+    """Draws the metric columns.
+
+    If settings.cull_primitives is True, columns outside the frame aren't
+    drawn, and adjacent columns of the same color are drawn as a single rect.
+    The numbers of rects saved are added to counts.
+    """
     first_column = math.floor(
         (window.start - settings.metric_column_offset)
         / settings.metric_column_cycle_len
@@ -747,35 +749,185 @@ def draw_metric_columns(window, settings, plot_boss):
         (window.end - settings.metric_column_offset)
         / settings.metric_column_cycle_len
     )
+    columns = []
     for (onset, release), color in settings.metric_columns.items():
         for column_i in range(first_column, last_column + 1):
             column_offset = (
                 column_i * settings.metric_column_cycle_len
                 + settings.metric_column_offset
             )
-            plot_boss.plot_rect(
-                onset + column_offset,
-                release + column_offset,
-                window.bottom,
-                window.top,
-                color=color,
-                zorder=1,
+            columns.append(
+                (onset + column_offset, release + column_offset, color)
             )
+    if settings.cull_primitives:
+        visible = [
+            column
+            for column in columns
+            if column[1] > window.start and column[0] < window.end
+        ]
+        if counts is not None:
+            counts["offscreen"] += len(columns) - len(visible)
+        columns = visible
+        merged = _merge_metric_columns(columns, counts)
+        if merged is not None:
+            columns = merged
+    for onset, release, color in columns:
+        plot_boss.plot_rect(
+            window.x_position(onset),
+            window.x_position(release),
+            window.bottom,
+            window.top,
+            color=color,
+            zorder=1,
+        )
+
+
+def _frame_times(settings, window, frame_list):
+    """Yields the time of each frame to plot.
+
+    Unless frame_list is passed, the time of frame i (counting from 0) is
+    computed from i, rather than by adding up frame_increment i times, so that
+    it is exactly the same whichever frames are plotted. Only the frames in
+    settings.frame_range (if not None) are plotted.
+    """
+    if frame_list is not None:
+        for now in preprocess_frame_list(settings, frame_list):
+            if not window.in_range(now):
+                return
+            yield now
+        return
+    first_now = window.get_first_now()
+    start, end = settings.frame_range or (0, None)
+    for i in itertools.count(start):
+        if end is not None and i >= end:
+            return
+        now = first_now + i * settings.frame_increment
+        if not window.in_range(now):
+            return
+        yield now
+
+
+def _draw_background(table, window, settings, plot_boss, counts):
+    if any(
+        channel_settings["piano_roll_bg"]
+        for channel_settings in settings.channel_settings.values()
+    ):
+        draw_piano_roll_background(table, window, settings, plot_boss, counts)
+    if settings.metric_columns:
+        draw_metric_columns(window, settings, plot_boss, counts)
+
+
+def _draw_now_line(now, window, settings, plot_boss):
+    if settings.now_line:
+        plot_boss.now_line(
+            window.x_position(now),
+            window,
+            settings.now_line_color,
+            settings.now_line_width,
+            settings.now_line_zorder,
+        )
+
+
+def _draw_overlays(table, window, lyricist, settings, plot_boss):
+    draw_lyrics(window, lyricist, settings, plot_boss)
+    draw_annotations(window, settings, plot_boss)
+    draw_brackets(table, window, settings, plot_boss)
+
+
+def _plot_strip(settings, table, window, lyricist, plot_boss, frame_times):
+    """Plots the frames as crops of a strip (see midani_strip).
+
+    The now line (which is in front of the notes, see
+    midani_strip.use_strip()), lyrics, annotations and brackets of each frame
+    are plotted first, on a transparent background, so that their pngs have
+    the numbers of the frames; then the tiles of the strip. Once the plot
+    boss has run, the frames are composited over the overlays.
+    """
+    overlay_window = midani_strip.OverlayWindow(window)
+    frame_x_starts = []
+    for now in frame_times:
+        window.update(now)
+        frame_x_starts.append(window.x_start)
+        with plot_boss.make_png(overlay_window):
+            _draw_now_line(now, window, settings, plot_boss)
+            _draw_overlays(table, window, lyricist, settings, plot_boss)
+    n_frames = plot_boss.plot_count
+    strip = midani_strip.Strip(settings, frame_x_starts)
+    strip.set_tile_fnumbers(n_frames + 1)
+    tile_window = midani_misc_classes.Window(settings)
+    rect_tuples = line_tuples = None
+    buckets = midani_misc_classes.PrimitiveBuckets(settings)
+    for tile_i in strip.tiles:
+        now = tile_window.time_at_x_start(strip.tile_x_start(tile_i))
+        tile_window.update(now)
+        with plot_boss.make_png(tile_window):
+            _draw_background(
+                table, tile_window, settings, plot_boss, buckets.counts
+            )
+            rect_tuples, line_tuples = get_voice_and_line_tuples(
+                now,
+                settings,
+                table,
+                rect_tuples,
+                line_tuples,
+                tile_window,
+                buckets,
+            )
+            buckets.flush(plot_boss, tile_window)
+    if not plot_boss.run():
+        return False, n_frames
+    if settings.frame_format == "raw":
+        with midani_frame_store.FrameStore.create(
+            settings.frame_store_fname,
+            n_frames,
+            settings.out_height,
+            settings.out_width,
+        ) as store:
+            success = strip.composite(store)
+    else:
+        success = strip.composite()
+    return success, n_frames
 
 
 def plot(
     settings: midani_settings.Settings,
     mpl: bool,
     frame_list: t.Sequence[float] = None,
+    encode_video: bool = False,
 ):
-    score = midani_score.read_score(settings)
-    if not len(score):
-        warnings.warn("Midi file is empty, skipping plotting...")
+    """Plots the frames, and, if encode_video is True, encodes them into
+    settings.video_fname (see midani_av.process_video()).
+
+    Returns a tuple (success, number of frames).
+    """
+    table = _read_table(settings)
+    if table is None:
         return False, 0
-    tempo_changes = midani_time.TempoChanges(score)
-    settings.update_from_score(score, tempo_changes)
-    score = midani_score.crop_score(score, settings, tempo_changes)
-    table = midani_misc_classes.PitchTable(score, settings, tempo_changes)
+    strip = midani_strip.use_strip(settings)
+    frame_format = saved_frame_format(settings, mpl)
+    if frame_format != settings.frame_format:
+        warnings.warn(
+            "Frames plotted with R are saved as pngs, ignoring "
+            "frame_format='raw'"
+        )
+    # The settings that only apply to this render are changed on a copy, so
+    # that the caller can reuse theirs
+    settings = copy.copy(settings)
+    settings.frame_format = frame_format
+    if strip:
+        # Frames can only be cropped from the strip if they are shifted by
+        # whole pixels
+        settings.pixel_geometry = True
+    pipeline = None
+    # If not None, frames are rendered with matplotlib straight into memory
+    # ("ring", see _render_video()) or into a frame store ("store", see
+    # _render_to_store()), rather than saved as pngs
+    render_to = None
+    if mpl and not strip:
+        if encode_video and settings.clean_up_png_files and _can_fork():
+            render_to = "ring"
+        elif settings.frame_format == "raw":
+            render_to = "store"
     if mpl:
         # we move the import statement here because we don't want to require
         # matplotlib unless it is actually being used.
@@ -783,55 +935,349 @@ def plot(
 
         plot_boss = plt_boss.MPLBoss(settings)
     else:
-        plot_boss = midani_r.RBoss(settings)
+        if settings.pipeline and not strip:
+            pipeline = midani_pipeline.Pipeline(
+                settings,
+                encode=encode_video,
+                clean_up=settings.clean_up_r_files,
+            )
+        plot_boss = midani_r.RBoss(settings, pipeline)
     window = midani_misc_classes.Window(settings)
     lyricist = midani_annotations.Lyricist(settings)
-    if frame_list is not None:
-        frame_iter = iter(preprocess_frame_list(settings, frame_list))
-        now = next(frame_iter)
+    frame_times = _frame_times(settings, window, frame_list)
+    if strip:
+        success, n_frames = _plot_strip(
+            settings, table, window, lyricist, plot_boss, frame_times
+        )
+    elif render_to == "ring":
+        return _render_video(settings, table, window, lyricist, frame_times)
+    elif render_to == "store":
+        success, n_frames = _render_to_store(
+            settings, table, window, lyricist, frame_times
+        )
     else:
-        now = window.get_first_now()
-    any_piano_roll_bgs = any(
-        channel_settings["piano_roll_bg"]
-        for channel_settings in settings.channel_settings.values()
+        success, n_frames = _plot_frames(
+            settings, table, window, lyricist, plot_boss, frame_times
+        )
+    if success and encode_video and pipeline is None:
+        midani_av.process_video(settings, n_frames)
+    return success, n_frames
+
+
+def saved_frame_format(settings: midani_settings.Settings, mpl: bool) -> str:
+    """Returns the format in which plot() saves the frames: "raw" or "png".
+    This is settings.frame_format, except that frames plotted with R are
+    always saved as pngs (unless they are cropped from a strip).
+    """
+    if (
+        settings.frame_format == "raw"
+        and not mpl
+        and not midani_strip.use_strip(settings)
+    ):
+        return "png"
+    return settings.frame_format
+
+
+def _can_fork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def _rgba_to_bgr(rgba, dst):
+    """Converts a frame rendered by matplotlib into dst, a BGR frame."""
+    if rgba.shape[:2] != dst.shape[:2]:
+        rgba = cv2.resize(  # pylint: disable=no-member
+            rgba, (dst.shape[1], dst.shape[0])
+        )
+    cv2.cvtColor(  # pylint: disable=no-member
+        rgba, cv2.COLOR_RGBA2BGR, dst=dst  # pylint: disable=no-member
     )
-    while window.in_range(now):
+
+
+def _render_worker(
+    settings,
+    table,
+    window,
+    lyricist,
+    frame_times,
+    put_frame,
+    worker_i,
+    n_workers,
+):
+    """Renders every n_workers-th frame, starting with frame worker_i,
+    calling put_frame(i, rgba) with each (see plt_boss.MPLBoss).
+
+    Usually runs in a forked process.
+    """
+    from . import plt_boss  # pylint: disable=import-outside-toplevel
+
+    frame_indices = iter(range(worker_i, len(frame_times), n_workers))
+    _plot_frames(
+        settings,
+        table,
+        window,
+        lyricist,
+        plt_boss.MPLBoss(
+            settings,
+            frame_sink=lambda rgba: put_frame(next(frame_indices), rgba),
+        ),
+        frame_times[worker_i::n_workers],
+    )
+
+
+def _start_render_workers(
+    settings, table, window, lyricist, frame_times, put_frame, context
+):
+    """Forks settings.render_processes processes that run _render_worker(),
+    and returns them.
+    """
+    n_workers = max(
+        1,
+        min(
+            settings.render_processes or os.cpu_count() or 1,
+            len(frame_times),
+        ),
+    )
+    workers = [
+        context.Process(
+            target=_render_worker,
+            args=(
+                settings,
+                table,
+                window,
+                lyricist,
+                frame_times,
+                put_frame,
+                worker_i,
+                n_workers,
+            ),
+            daemon=True,
+        )
+        for worker_i in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def _stop_render_workers(workers):
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+        worker.join()
+
+
+def _check_render_workers(workers, frame_i):
+    """Raises RuntimeError if a worker started by _start_render_workers() has
+    failed, or if the worker that renders frame frame_i (which hasn't been
+    rendered yet) has exited.
+    """
+    for worker in workers:
+        if worker.exitcode:
+            raise RuntimeError(
+                f"render process exited with code {worker.exitcode}"
+            )
+    worker = workers[frame_i % len(workers)]
+    if worker.exitcode is not None:
+        raise RuntimeError(
+            f"render process exited with code {worker.exitcode} without "
+            f"rendering frame {frame_i}"
+        )
+
+
+def _render_video(settings, table, window, lyricist, frame_times):
+    """Renders the frames with matplotlib in forked processes (see
+    settings.render_processes), which pass them through a
+    midani_ring.FrameRing to this process, which encodes them into
+    settings.video_fname.
+
+    Returns a tuple (success, number of frames).
+    """
+    frame_times = list(frame_times)
+    n_frames = len(frame_times)
+    context = multiprocessing.get_context("fork")
+    ring = midani_ring.FrameRing(
+        settings.frame_ring_slots
+        or 2 * (settings.render_processes or os.cpu_count() or 1),
+        settings.out_height,
+        settings.out_width,
+        context,
+    )
+
+    def _to_ring(i, rgba):
+        with ring.slot(i) as slot:
+            _rgba_to_bgr(rgba, slot)
+
+    workers = []
+    out = midani_av.open_video_writer(settings)
+    try:
+        workers = _start_render_workers(
+            settings, table, window, lyricist, frame_times, _to_ring, context
+        )
+        print(f"Building {settings.video_fname}...")
+        for i, frame in enumerate(
+            ring.frames(
+                n_frames,
+                check=lambda i: _check_render_workers(workers, i),
+            )
+        ):
+            print(f"Writing frame {i} \r", end="")
+            out.write(frame)
+        print("\nDone.")
+        for worker in workers:
+            worker.join()
+    finally:
+        out.release()
+        _stop_render_workers(workers)
+        ring.close()
+    return all(worker.exitcode == 0 for worker in workers), n_frames
+
+
+def _render_to_store(settings, table, window, lyricist, frame_times):
+    """Renders the frames with matplotlib into a
+    midani_frame_store.FrameStore at settings.frame_store_fname, in forked
+    processes (see settings.render_processes) if possible.
+
+    Returns a tuple (success, number of frames).
+    """
+    frame_times = list(frame_times)
+    n_frames = len(frame_times)
+    print(f"Writing {n_frames} frames to {settings.frame_store_fname}")
+    with midani_frame_store.FrameStore.create(
+        settings.frame_store_fname,
+        n_frames,
+        settings.out_height,
+        settings.out_width,
+    ) as store:
+
+        def _to_store(i, rgba):
+            _rgba_to_bgr(rgba, store[i])
+
+        if not _can_fork():
+            _render_worker(
+                settings, table, window, lyricist, frame_times, _to_store, 0, 1
+            )
+            return True, n_frames
+        # The store is mapped shared, so frames written by the forked
+        # processes are written to the file
+        workers = _start_render_workers(
+            settings,
+            table,
+            window,
+            lyricist,
+            frame_times,
+            _to_store,
+            multiprocessing.get_context("fork"),
+        )
+        for worker in workers:
+            worker.join()
+    return all(worker.exitcode == 0 for worker in workers), n_frames
+
+
+def _read_table(settings):
+    """Reads the score, updates settings from it, and returns its
+    PitchTable, or None if it is empty.
+    """
+    score = midani_score.read_score(settings)
+    if not score.num_voices:
+        warnings.warn("Midi file is empty, skipping plotting...")
+        return None
+    tempo_changes = midani_time.TempoChanges(score)
+    settings.update_from_score(score, tempo_changes)
+    score = midani_score.crop_score(score, settings, tempo_changes)
+    return midani_misc_classes.PitchTable(score, settings, tempo_changes)
+
+
+def _plot_each_frame(
+    settings, table, window, lyricist, plot_boss, frame_times, buckets=None
+):
+    """Plots each frame, yielding its time once it has been plotted.
+
+    If buckets (a midani_misc_classes.PrimitiveBuckets) is passed, it is
+    used to draw the notes, so that the caller can change it between frames.
+    """
+    # Refilled on each frame
+    rect_tuples = line_tuples = None
+    if buckets is None:
+        buckets = midani_misc_classes.PrimitiveBuckets(settings)
+    # The R backend ignores zorder, so the now line is drawn after the notes
+    # if it is in front of them
+    now_line_in_front = midani_strip.now_line_in_front(settings)
+    for now in frame_times:
         window.update(now)
         # Originally, I got the current tempo here, because "bounce"
         # was set in beats. But now, "bounce" is in seconds, so we have no
         # need for tempi.
         with plot_boss.make_png(window):
-            if any_piano_roll_bgs:
-                draw_piano_roll_background(table, window, settings, plot_boss)
-            if settings.metric_columns:
-                draw_metric_columns(window, settings, plot_boss)
-            if settings.now_line:
-                plot_boss.now_line(
-                    now,
-                    window,
-                    settings.now_line_color,
-                    settings.now_line_width,
-                    settings.now_line_zorder,
-                )
+            _draw_background(table, window, settings, plot_boss, buckets.counts)
+            if not now_line_in_front:
+                _draw_now_line(now, window, settings, plot_boss)
             rect_tuples, line_tuples = get_voice_and_line_tuples(
-                now, settings, table
-            )
-            draw_shadows(
-                line_tuples, rect_tuples, window, settings, table, plot_boss
-            )
-            draw_connection_lines(
-                line_tuples, window, settings, table, plot_boss
+                now, settings, table, rect_tuples, line_tuples, window, buckets
             )
-            draw_notes(rect_tuples, window, settings, table, plot_boss)
-            draw_lyrics(window, lyricist, settings, plot_boss)
-            draw_annotations(window, settings, plot_boss)
-            draw_brackets(table, window, settings, plot_boss)
-            if frame_list is not None:
-                try:
-                    now = next(frame_iter)
-                except StopIteration:
-                    break
-            else:
-                now += settings.frame_increment
+            buckets.flush(plot_boss, window)
+            if now_line_in_front:
+                _draw_now_line(now, window, settings, plot_boss)
+            _draw_overlays(table, window, lyricist, settings, plot_boss)
+        yield now
+
+
+def _plot_frames(settings, table, window, lyricist, plot_boss, frame_times):
+    for _ in _plot_each_frame(
+        settings, table, window, lyricist, plot_boss, frame_times
+    ):
+        pass
     success = plot_boss.run()
     return success, plot_boss.plot_count
+
+
+def iter_frames(
+    settings: midani_settings.Settings,
+    frame_list: t.Sequence[float] = None,
+) -> t.Iterator[t.Tuple[int, float, np.ndarray]]:
+    """Renders the frames with matplotlib, and yields them one at a time, as
+    they are rendered, without writing anything to disk.
+
+    Yields tuples (frame index, time, frame), where frame is a new uint8 array
+    of shape (settings.out_height, settings.out_width, 3) in BGR order (as
+    used by OpenCV). The frame index counts from 0 at the first frame of the
+    video, so if settings.frame_range is passed, the first index is its start;
+    if frame_list is passed, it is the index in frame_list.
+
+    Frames are rendered only as they are requested, and none are kept, so
+    memory use doesn't depend on the length of the video. Frames are never
+    cropped from tiles (see settings.strip_render), since the tiles would
+    have to be rendered before the first frame.
+    """
+    # we move the import statement here because we don't want to require
+    # matplotlib unless it is actually being used.
+    from . import plt_boss  # pylint: disable=import-outside-toplevel
+
+    table = _read_table(settings)
+    if table is None:
+        return
+    window = midani_misc_classes.Window(settings)
+    lyricist = midani_annotations.Lyricist(settings)
+    frame = None
+
+    def _to_frame(rgba):
+        nonlocal frame
+        frame = np.empty(
+            (settings.out_height, settings.out_width, 3), dtype=np.uint8
+        )
+        _rgba_to_bgr(rgba, frame)
+
+    first_i = 0
+    if frame_list is None and settings.frame_range is not None:
+        first_i = settings.frame_range[0]
+    for frame_i, now in enumerate(
+        _plot_each_frame(
+            settings,
+            table,
+            window,
+            lyricist,
+            plt_boss.MPLBoss(settings, frame_sink=_to_frame),
+            _frame_times(settings, window, frame_list),
+        ),
+        start=first_i,
+    ):
+        yield frame_i, now, frame
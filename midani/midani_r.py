@@ -8,6 +8,8 @@ import subprocess
 
 import typing as t
 
+from . import midani_colors
+
 MAX_LINE_COUNT = 2000
 MAX_PLOT_COUNT = 50
 PLOT_PRINT_COUNT = 25
@@ -15,9 +17,14 @@ R_PRINT_COUNT = 1
 
 
 class RBoss:
-    """Class for writing R scripts and then calling Rscript to read them."""
+    """Class for writing R scripts and then calling Rscript to read them.
+
+    If a midani_pipeline.Pipeline is passed, each script is submitted to it as
+    soon as it is written, rather than all of them being run by run().
+    """
 
-    def __init__(self, settings):
+    def __init__(self, settings, pipeline=None):
+        self.pipeline = pipeline
         self.outfnumber = 0
         self.outf_dirname = settings._temp_r_dirname
         if not os.path.exists(self.outf_dirname):
@@ -26,6 +33,8 @@ class RBoss:
         self.outfname_fmt_str = settings.temp_r_script_base
         self.outfnames = []
         self.plot_count = 0
+        # The number of the first png plotted by the current script
+        self._outf_first_png = 1
         self._increment_outf()
         self.png_dirname = settings.output_dirname
         self.png_fname_base = settings.png_fname_base
@@ -34,7 +43,8 @@ class RBoss:
         self._init_png_str = (
             f'png(file = "{self.png_fname_base}'
             f'{{png_fnumber:0{settings.png_fnum_digits}d}}.png", '
-            f"width = {self.out_width}, height = {self.out_height})\n"
+            f"width = {self.out_width}, height = {self.out_height}, "
+            'bg = "{png_bg}")\n'
             # The next line is copied from the original version of the script,
             # I no longer remember what it does
             'par(mai = c(0,0,0,0), xaxs = "i", yaxs = "i")\n'
@@ -44,10 +54,11 @@ class RBoss:
             'type = "n", xlab = "", ylab = "")\n'
         )
 
-    @staticmethod
-    def hex_color(color):
-        # Will raise a ValueError if color has floats (rather than ints)
-        return f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}{color[3]:02x}"
+    # Accepts tuples or packed colors, and formats each color only once
+    hex_color = staticmethod(midani_colors.hex_color)
+
+    # Rects are drawn without a border (see plot_rect())
+    rect_edge_width = 0
 
     def _close_outf(self):
         try:
@@ -56,8 +67,19 @@ class RBoss:
         except AttributeError:
             pass
 
+    def _submit_outf(self):
+        if (
+            self.pipeline is not None
+            and self.plot_count >= self._outf_first_png
+        ):
+            self.pipeline.submit(
+                self.outfname, self._outf_first_png, self.plot_count
+            )
+
     def _increment_outf(self):
         self._close_outf()
+        self._submit_outf()
+        self._outf_first_png = self.plot_count + 1
         self.outfname = self.outfname_fmt_str.format(self.outfnumber)
         self.outfnames.append(self.outfname)
         self.outfnumber += 1
@@ -83,14 +105,13 @@ class RBoss:
         self.outf.write(
             self._init_png_str.format(
                 png_fnumber=self.plot_count + 1,
+                # The png device's own background is opaque white, which
+                # would show through a transparent par(bg) (e.g., that of
+                # the overlays of midani_strip)
+                png_bg="transparent" if window.bg_color[3] == 0 else "white",
                 bg_color=self.hex_color(window.bg_color),
-                window_start=window.start,
-                window_end=window.end,
-                # The next lines are part of an abortive attempt to express
-                # x coordinates in pixels, which I foolishly started before
-                # committing other changes...
-                # window_start=window.pixel_start,
-                # window_end=window.pixel_end,
+                window_start=window.x_start,
+                window_end=window.x_end,
                 window_bottom=window.bottom,
                 window_top=window.top,
             )
@@ -229,6 +250,19 @@ class RBoss:
             )
 
     def run(self) -> bool:
+        if self.pipeline is not None:
+            self._close_outf()
+            self._submit_outf()
+            print(f"\nWaiting for R to plot the last of {self.plot_count} pngs")
+            success = self.pipeline.finish()
+        else:
+            success = self._run_scripts()
+        if self.clean_up:
+            print("Removing temporary R files")
+            shutil.rmtree(self.outf_dirname)
+        return success
+
+    def _run_scripts(self) -> bool:
         success = True
         print(f"Plotting {self.plot_count} frames in R")
         if not os.path.exists(self.png_dirname):
@@ -252,7 +286,4 @@ class RBoss:
                 print(proc.stdout.decode())
                 success = False
         print("")
-        if self.clean_up:
-            print("Removing temporary R files")
-            shutil.rmtree(self.outf_dirname)
         return success
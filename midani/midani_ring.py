@@ -0,0 +1,95 @@
+"""Provides FrameRing, a ring of frame buffers in shared memory, through which
+frames rendered in worker processes are passed to the process that encodes
+them.
+
+Frame i (counting from 0) is written to slot i % n_slots. A worker writing
+frame i waits until frame i - n_slots has been consumed, and the consumer
+reading frame i waits until it has been written, so frames are consumed in
+order, and no more than n_slots frames are held in memory however long the
+video is. Workers write straight into the slots, and the consumer reads
+straight from them, so frames are never pickled or copied between processes.
+"""
+import contextlib
+import multiprocessing
+import multiprocessing.shared_memory
+
+import numpy as np
+
+# How often (in seconds) the consumer checks whether the workers are still
+# alive while waiting for a frame
+POLL_INTERVAL = 1.0
+
+
+class FrameRing:
+    """See the module docstring.
+
+    The ring must be created before the worker processes are forked, and
+    closed by the process that created it once they have exited.
+
+    Args:
+        n_slots: int.
+        height: int. Height of frames in pixels.
+        width: int. Width of frames in pixels.
+        context: a multiprocessing context. Default: the default context.
+    """
+
+    def __init__(self, n_slots, height, width, context=None):
+        if context is None:
+            context = multiprocessing.get_context()
+        self.n_slots = n_slots
+        self.shape = (height, width, 3)
+        self._slot_size = height * width * 3
+        self._shm = multiprocessing.shared_memory.SharedMemory(
+            create=True, size=n_slots * self._slot_size
+        )
+        self._slots = np.ndarray(
+            (n_slots,) + self.shape, dtype=np.uint8, buffer=self._shm.buf
+        )
+        self._cond = context.Condition()
+        # The index of the frame that each slot holds, or -1
+        self._filled = context.RawArray("q", [-1] * n_slots)
+        # The number of frames that have been consumed
+        self._consumed = context.RawValue("q", 0)
+
+    @contextlib.contextmanager
+    def slot(self, i):
+        """Context manager that waits until frame i can be written, and yields
+        the slot to write it into (a uint8 array of shape (height, width, 3)
+        in BGR order). The frame is made available to the consumer on exit.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: i < self._consumed.value + self.n_slots)
+        yield self._slots[i % self.n_slots]
+        with self._cond:
+            self._filled[i % self.n_slots] = i
+            self._cond.notify_all()
+
+    def frames(self, n, check=None):
+        """Yields frames 0 to n - 1 in order, as they are written. Each frame
+        is a view onto its slot, which may be overwritten as soon as the next
+        frame is requested.
+
+        If check is passed, it is called with i whenever frame i hasn't been
+        written for POLL_INTERVAL seconds. It should raise an exception if
+        the frame will never be written (e.g., because the worker that
+        should write it has exited). Frame i can't be written while check is
+        running.
+        """
+        for i in range(n):
+            with self._cond:
+                while not self._cond.wait_for(
+                    lambda i=i: self._filled[i % self.n_slots] == i,
+                    timeout=POLL_INTERVAL,
+                ):
+                    if check is not None:
+                        check(i)
+            yield self._slots[i % self.n_slots]
+            with self._cond:
+                self._consumed.value = i + 1
+                self._cond.notify_all()
+
+    def close(self):
+        """Frees the shared memory."""
+        del self._slots
+        self._shm.close()
+        self._shm.unlink()
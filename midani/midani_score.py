@@ -1,39 +1,237 @@
 """Provides functions to read midi file into score object.
 """
+import concurrent.futures
+import functools
+import math
+import os
+
 import midani.from_my_other_projects.midi_funcs as midi_funcs
-import midani.from_my_other_projects.note_classes as note_classes
+from . import midani_cache
+from . import midani_notes
+from . import midani_seek
 from . import midani_settings
+from . import midani_smf
+from . import midani_time
+
+# If the midi files are smaller than this in total, reading them in worker
+# processes takes longer than reading them in this process
+PARALLEL_MIN_BYTES = 2**19
+
+
+def _read_kwargs(settings):
+    return dict(
+        tet=settings.tet,
+        first_note_at_0=settings.midi_reset_start_to_0,
+        split_tracks_to_voices=settings.midi_tracks_to_voices,
+        split_channels_to_voices=settings.midi_channels_to_voices,
+    )
+
+
+def _lcm(ticks_per_beats):
+    out = 1
+    for ticks_per_beat in ticks_per_beats:
+        out = out * ticks_per_beat // math.gcd(out, ticks_per_beat)
+    return out
+
+
+def _merge(scores):
+    """Adds the voices of all the scores to the first one, rescaling them all
+    to the least common multiple of their ticks_per_beat.
+    """
+    score = scores[0]
+    ticks_per_beat = _lcm(score.ticks_per_beat for score in scores)
+    for i, new_score in enumerate(scores):
+        new_score.rescale_ticks(ticks_per_beat // new_score.ticks_per_beat)
+        if i:
+            for voice in new_score.voices:
+                score.add_voice(voice, voice_i=score.num_voices)
+    return score
+
+
+def _read_file(midi_fname, read_kwargs, fast_reader, executor=None):
+    """Reads one midi file in full.
+
+    This is a module-level function so that it can be run in a worker
+    process.
+    """
+    if fast_reader:
+        try:
+            return midani_smf.read_smf(
+                midi_fname, columnar=True, executor=executor, **read_kwargs
+            )
+        except midani_smf.SMFError:
+            pass
+    return midani_notes.ColumnarScore.from_score(
+        midi_funcs.read_midi_to_internal_data(
+            midi_fname, ticks=True, **read_kwargs
+        )
+    )
+
+
+def _read_files(settings):
+    """Reads the midi files in full, in parallel if they are large enough.
+
+    Several files are read in parallel with each other, and the tracks of a
+    single file are read in parallel with each other (see
+    settings.midi_reader_processes).
+
+    Returns:
+        A list of ColumnarScores, one per file, in the order of
+        settings.midi_fname.
+    """
+    read = functools.partial(
+        _read_file,
+        read_kwargs=_read_kwargs(settings),
+        fast_reader=settings.midi_fast_reader,
+    )
+    num_processes = settings.midi_reader_processes or os.cpu_count() or 1
+    total_size = sum(
+        os.path.getsize(midi_fname) for midi_fname in settings.midi_fname
+    )
+    if (
+        num_processes < 2
+        or not settings.midi_fast_reader
+        or total_size < PARALLEL_MIN_BYTES
+    ):
+        return [read(midi_fname) for midi_fname in settings.midi_fname]
+    with concurrent.futures.ProcessPoolExecutor(num_processes) as executor:
+        if len(settings.midi_fname) == 1:
+            return [read(settings.midi_fname[0], executor=executor)]
+        return list(executor.map(read, settings.midi_fname))
 
 
-def read_score(settings: midani_settings.Settings) -> note_classes.Score:
-    def _read(midi_fname):
-        return midi_funcs.read_midi_to_internal_data(
+def _read_window(settings):
+    """Reads only the part of the midi file(s) that is to be rendered, using
+    midani_seek.
+
+    Raises:
+        midani_smf.SMFError if a file can't be read.
+    """
+    kwargs = _read_kwargs(settings)
+    indexes = [
+        midani_seek.get_index(
             midi_fname,
-            tet=settings.tet,
-            first_note_at_0=settings.midi_reset_start_to_0,
-            split_tracks_to_voices=settings.midi_tracks_to_voices,
-            split_channels_to_voices=settings.midi_channels_to_voices,
+            settings.midi_cache_dir,
+            save=settings.midi_cache,
+            max_bytes=settings.midi_cache_max_bytes,
+        )
+        for midi_fname in settings.midi_fname
+    ]
+    ticks_per_beat = _lcm(index.ticks_per_beat for index in indexes)
+    if settings.midi_constant_note_length is not None:
+        constant_dur = settings.midi_constant_note_length * ticks_per_beat
+    else:
+        constant_dur = None
+
+    def _get_total_len():
+        # As ColumnarScore.get_total_len() of the score that is read in full
+        total_len = 0
+        for index in indexes:
+            factor = ticks_per_beat // index.ticks_per_beat
+            for attack, dur in index.final_notes(
+                first_note_at_0=settings.midi_reset_start_to_0,
+                split_tracks_to_voices=settings.midi_tracks_to_voices,
+                split_channels_to_voices=settings.midi_channels_to_voices,
+            ):
+                if constant_dur is None:
+                    release = (attack + dur) * factor
+                else:
+                    release = attack * factor + constant_dur
+                total_len = max(total_len, release)
+        return total_len
+
+    # The tempo map is the same as that of the score that is read in full
+    meta_score = indexes[0].meta_score(
+        tet=settings.tet, first_note_at_0=settings.midi_reset_start_to_0
+    )
+    meta_score.rescale_ticks(ticks_per_beat // meta_score.ticks_per_beat)
+    tempo_changes = midani_time.TempoChanges(meta_score)
+    start_time, end_time = settings.get_start_and_end_times(
+        tempo_changes, _get_total_len
+    )
+    start_tick = tempo_changes.tick_from_ctime(start_time)
+    end_tick = tempo_changes.tick_from_ctime(end_time)
+
+    scores = []
+    for index in indexes:
+        factor = ticks_per_beat // index.ticks_per_beat
+        scores.append(
+            index.read_window(
+                math.floor(start_tick / factor),
+                math.ceil(end_tick / factor) + 1,
+                **kwargs,
+            )
         )
+    return _merge(scores)
+
 
-    score = _read(settings.midi_fname[0])
-    for midi_fname in settings.midi_fname[1:]:
-        new_score = _read(midi_fname)
-        for voice in new_score.voices:
-            score.add_voice(voice, voice_i=score.num_voices)
+def _set_dur(score, settings):
     if settings.midi_constant_note_length is not None:
-        for onset in score:
-            for note in onset:
-                note.dur = settings.midi_constant_note_length
+        score.set_dur(settings.midi_constant_note_length * score.ticks_per_beat)
+    return score
+
+
+def read_score(
+    settings: midani_settings.Settings,
+) -> midani_notes.ColumnarScore:
+    """Reads the midi file(s) in settings.midi_fname into a ColumnarScore.
+
+    Times in the returned score are integer midi ticks (see
+    ColumnarScore.ticks_per_beat). If several files with different
+    ticks_per_beat are read, they are all rescaled to the least common
+    multiple.
+
+    If only part of the score is to be rendered, and settings.midi_seek_index
+    is True, the returned score may only contain the notes in and near that
+    part. It should be cropped with crop_score().
+
+    If settings.midi_cache is True, complete scores are cached with
+    midani_cache, and read from the cache when possible.
+    """
+
+    if settings.midi_cache:
+        cache = midani_cache.ScoreCache(
+            settings.midi_cache_dir, settings.midi_cache_max_bytes
+        )
+        key = midani_cache.cache_key(
+            settings.midi_fname,
+            tet=settings.tet,
+            midi_tracks_to_voices=settings.midi_tracks_to_voices,
+            midi_channels_to_voices=settings.midi_channels_to_voices,
+            midi_reset_start_to_0=settings.midi_reset_start_to_0,
+            midi_constant_note_length=settings.midi_constant_note_length,
+            midi_fast_reader=settings.midi_fast_reader,
+        )
+        score = cache.load(key)
+        if score is not None:
+            return score
+    if (
+        settings.midi_seek_index
+        and settings.midi_fast_reader
+        and settings.has_time_window()
+    ):
+        # Windows are not cached, since they are quick to read
+        try:
+            score = _read_window(settings)
+        except midani_smf.SMFError:
+            pass
+        else:
+            return _set_dur(score, settings)
+    score = _set_dur(_merge(_read_files(settings)), settings)
+    if settings.midi_cache:
+        cache.store(key, score)
     return score
 
 
 def crop_score(
-    score: note_classes.Score, settings: midani_settings.Settings, tempo_changes
+    score: midani_notes.ColumnarScore,
+    settings: midani_settings.Settings,
+    tempo_changes,
 ):
-    start_beat = tempo_changes.btime_from_ctime(settings.start_time)
-    end_beat = tempo_changes.btime_from_ctime(settings.end_time)
+    start_tick = tempo_changes.tick_from_ctime(settings.start_time)
+    end_tick = tempo_changes.tick_from_ctime(settings.end_time)
     return score.get_passage(
-        passage_start_time=start_beat,
-        passage_end_time=end_beat,
+        passage_start_time=start_tick,
+        passage_end_time=end_tick,
         end_time_refers_to_attack=True,
     )
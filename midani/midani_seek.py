@@ -0,0 +1,540 @@
+"""Provides a seek index for reading a time window of a midi file.
+
+The index of a file is built the first time it is needed, by reading the
+whole file once, and is usually saved in the cache directory (see
+midani_cache.default_cache_dir()), keyed by the path, size and modification
+time of the midi file (if it isn't saved, it is only kept in memory). Saved
+indexes are evicted along with the cached scores (see midani_cache), so the
+indexes of files that have since changed don't accumulate. It contains:
+    - the meta messages of the first track (so the tempo map is known without
+      reading the file).
+    - for each track, checkpoints at regular intervals. Each checkpoint has
+      the byte offset, tick, and running status at which reading of the
+      track can be resumed, together with the pitch bends and sounding notes
+      at that point.
+    - what is needed to work out, without reading the file, which voices are
+      empty and what the total length of the score is.
+
+SeekIndex.read_window() can then read a window of the file by seeking each
+track to the last checkpoint before the window and only reading on from
+there.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import typing
+
+from . import midani_cache
+from . import midani_notes
+from . import midani_smf
+
+# This module shares the internals of midani_smf
+# pylint: disable=protected-access
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".midani-index"
+# The subdirectory of the cache directory in which indexes are saved
+INDEX_SUBDIR = midani_cache.SEEK_SUBDIR
+
+# Number of note and pitchwheel events between checkpoints
+CHECKPOINT_INTERVAL = 4096
+
+# Notes attacked in a window may be released after it. After the window, we go
+# on reading in steps of this many beats until they have all been released.
+RELEASE_STEP_BEATS = 8
+
+# Indexes that have been loaded or built in this process
+_INDEXES = {}
+
+
+class SeekIndex:
+    """Seek index of a midi file. See the module docstring.
+
+    Use get_index() rather than constructing directly.
+
+    Attributes:
+        midi_fname: str.
+        size: int. Size of the midi file in bytes, when the index was built.
+        mtime_ns: int. Modification time of the midi file, when the index was
+            built.
+        ticks_per_beat: int.
+        num_tracks: int. As given in the header of the midi file.
+        meta_events: list of (tick, meta type, data) tuples, where data is
+            bytes.
+        tracks: list of dicts, one per track, with keys:
+            - "span": [start, end] byte offsets of the track chunk.
+            - "first_attack": int or None if the track has no notes.
+            - "final_notes": list of [channel, last attack, longest
+              duration of the notes at the last attack], one for each
+              channel that has notes.
+            - "checkpoints": list of [position, tick, running status, next
+              tick, pitch bends, sounding notes]. Reading of the track can be
+              resumed at position, tick and running status, and no event
+              after that point is before next tick. Sounding notes is a list
+              of [note key, attack tick, velocity, pitch bend, released] (see
+              midani_smf._pair_notes()).
+    """
+
+    def __init__(self, midi_fname, size, mtime_ns, ticks_per_beat, num_tracks):
+        self.midi_fname = midi_fname
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.ticks_per_beat = ticks_per_beat
+        self.num_tracks = num_tracks
+        self.meta_events = []
+        self.tracks = []
+
+    @classmethod
+    def build(cls, midi_fname):
+        """Builds the index by reading the whole file.
+
+        Raises:
+            midani_smf.SMFError if the file can't be read.
+        """
+        stat = os.stat(midi_fname)
+        with open(midi_fname, "rb") as inf:
+            data = inf.read()
+        try:
+            _, num_tracks, ticks_per_beat, track_spans = (
+                midani_smf._read_chunks(data)
+            )
+            out = cls(
+                midi_fname,
+                stat.st_size,
+                stat.st_mtime_ns,
+                ticks_per_beat,
+                num_tracks,
+            )
+            for track_i, (start, end) in enumerate(track_spans):
+                out._index_track(data, track_i, start, end)
+        except IndexError as exc:
+            raise midani_smf.SMFError("unexpected end of data") from exc
+        return out
+
+    def _index_track(self, data, track_i, start, end):
+        checkpoints = []
+        events, meta_events, _, _, _ = midani_smf._read_track(
+            data,
+            start,
+            end,
+            keep_meta=track_i == 0,
+            checkpoints=checkpoints,
+            checkpoint_interval=CHECKPOINT_INTERVAL,
+        )
+        if track_i == 0:
+            self.meta_events = meta_events
+        note_ons = {}
+        pitch_bends = [0] * midani_smf.NUM_CHANNELS
+        released = set()
+        notes = []
+        track_checkpoints = []
+        prev_num_events = 0
+        for pos, tick, running_status, num_events, next_tick in checkpoints:
+            notes.extend(
+                midani_smf._pair_notes(
+                    events[prev_num_events:num_events],
+                    note_ons=note_ons,
+                    pitch_bends=pitch_bends,
+                    released=released,
+                )
+            )
+            prev_num_events = num_events
+            track_checkpoints.append(
+                [
+                    pos,
+                    tick,
+                    running_status,
+                    next_tick,
+                    list(pitch_bends),
+                    [
+                        [key, *note_on, key in released]
+                        for key, note_on in note_ons.items()
+                    ],
+                ]
+            )
+        notes.extend(
+            midani_smf._pair_notes(
+                events[prev_num_events:],
+                note_ons=note_ons,
+                pitch_bends=pitch_bends,
+            )
+        )
+        final_notes = {}
+        for _, attack, dur, _, channel in notes:
+            if (
+                channel not in final_notes
+                or (attack, dur) > final_notes[channel]
+            ):
+                final_notes[channel] = (attack, dur)
+        self.tracks.append(
+            {
+                "span": [start, end],
+                "first_attack": min((note[1] for note in notes), default=None),
+                "final_notes": [
+                    [channel, attack, dur]
+                    for channel, (attack, dur) in sorted(final_notes.items())
+                ],
+                "checkpoints": track_checkpoints,
+            }
+        )
+
+    def is_valid(self):
+        """Returns True if the midi file hasn't changed since the index was
+        built.
+        """
+        try:
+            stat = os.stat(self.midi_fname)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (self.size, self.mtime_ns)
+
+    def to_json(self):
+        return json.dumps(
+            {
+                "version": INDEX_VERSION,
+                "size": self.size,
+                "mtime_ns": self.mtime_ns,
+                "ticks_per_beat": self.ticks_per_beat,
+                "num_tracks": self.num_tracks,
+                "meta_events": [
+                    [tick, meta_type, meta_data.hex()]
+                    for tick, meta_type, meta_data in self.meta_events
+                ],
+                "tracks": self.tracks,
+            },
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_json(cls, midi_fname, json_str):
+        """Raises ValueError (or KeyError) if json_str isn't a valid index."""
+        contents = json.loads(json_str)
+        if contents["version"] != INDEX_VERSION:
+            raise ValueError(f"index version {contents['version']}")
+        out = cls(
+            midi_fname,
+            contents["size"],
+            contents["mtime_ns"],
+            contents["ticks_per_beat"],
+            contents["num_tracks"],
+        )
+        out.meta_events = [
+            (tick, meta_type, bytes.fromhex(meta_data))
+            for tick, meta_type, meta_data in contents["meta_events"]
+        ]
+        out.tracks = contents["tracks"]
+        return out
+
+    def _num_voices(self, split_tracks_to_voices, split_channels_to_voices):
+        num_voices = self.num_tracks - 1 if split_tracks_to_voices else 1
+        if split_channels_to_voices:
+            num_voices *= midani_smf.NUM_CHANNELS
+        return num_voices
+
+    def _final_notes(self, split_tracks_to_voices, split_channels_to_voices):
+        """Returns a dict mapping the index of each voice that has notes to
+        (last attack, longest duration of the notes at the last attack).
+        """
+        num_voices = self._num_voices(
+            split_tracks_to_voices, split_channels_to_voices
+        )
+        out = {}
+        for track_i, track in enumerate(self.tracks):
+            for channel, attack, dur in track["final_notes"]:
+                voice_i = (
+                    midani_smf._voice_slot(
+                        track_i,
+                        channel,
+                        split_tracks_to_voices,
+                        split_channels_to_voices,
+                    )
+                    % num_voices
+                )
+                if voice_i not in out or (attack, dur) > out[voice_i]:
+                    out[voice_i] = (attack, dur)
+        return out
+
+    def first_note_displacement(self, first_note_at_0, min_attack_to_adjust):
+        """Returns the number of ticks by which read_smf() would move the
+        score back with these arguments.
+        """
+        if not first_note_at_0:
+            return 0
+        first_attack = min(
+            (
+                track["first_attack"]
+                for track in self.tracks
+                if track["first_attack"] is not None
+            ),
+            default=0,
+        )
+        if first_attack < min_attack_to_adjust * self.ticks_per_beat:
+            return 0
+        return first_attack
+
+    def final_notes(
+        self,
+        first_note_at_0=False,
+        min_attack_to_adjust=4,
+        split_tracks_to_voices=True,
+        split_channels_to_voices=False,
+    ) -> typing.List[typing.Tuple[int, int]]:
+        """Returns the (last attack, longest duration of the notes at the last
+        attack) of each non-empty voice of the score that read_smf() would
+        return with these arguments.
+
+        This is what ColumnarScore.get_total_len() looks at.
+        """
+        displacement = self.first_note_displacement(
+            first_note_at_0, min_attack_to_adjust
+        )
+        return [
+            (attack - displacement, dur)
+            for attack, dur in self._final_notes(
+                split_tracks_to_voices, split_channels_to_voices
+            ).values()
+        ]
+
+    def meta_score(
+        self, tet=12, first_note_at_0=False, min_attack_to_adjust=4
+    ) -> midani_notes.ColumnarScore:
+        """Returns a ColumnarScore with the meta messages (but no notes) of
+        the score that read_smf() would return with these arguments.
+        """
+        score = midani_notes.ColumnarScore(
+            tet=tet, ticks_per_beat=self.ticks_per_beat
+        )
+        score.meta_messages = midani_smf._meta_messages(
+            self.meta_events, True, self.ticks_per_beat
+        )
+        displacement = self.first_note_displacement(
+            first_note_at_0, min_attack_to_adjust
+        )
+        if displacement:
+            score.displace_passage(-displacement)
+            score.attacks_adjusted_by = -displacement
+        return score
+
+    def read_window(
+        self,
+        start_tick,
+        end_tick,
+        tet=12,
+        track_num_offset=0,
+        first_note_at_0=False,
+        min_attack_to_adjust=4,
+        split_tracks_to_voices=True,
+        split_channels_to_voices=False,
+    ) -> midani_notes.ColumnarScore:
+        """Reads the notes of the midi file that sound between start_tick and
+        end_tick.
+
+        The keyword arguments are as for
+        midani_smf.read_smf(columnar=True), and start_tick and end_tick are
+        in the times of the score that it would return.
+
+        The returned score has the same voices and meta messages as that
+        score, and contains all its notes that are attacked before end_tick
+        and released after start_tick. It also contains some other notes
+        that are attacked near the window, so it should be cropped with
+        get_passage().
+
+        Raises:
+            midani_smf.SMFError if the file can't be read.
+        """
+        displacement = self.first_note_displacement(
+            first_note_at_0, min_attack_to_adjust
+        )
+        start_tick += displacement
+        end_tick += displacement
+        inverse_pb_tup_dict = midani_smf._inverse_pb_tup_dict(tet)
+        num_voices = self._num_voices(
+            split_tracks_to_voices, split_channels_to_voices
+        )
+        voice_notes = [[] for _ in range(num_voices)]
+        with open(self.midi_fname, "rb") as inf, mmap.mmap(
+            inf.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            for track_i, track in enumerate(self.tracks):
+                try:
+                    notes = self._read_track_window(
+                        data, track, start_tick, end_tick, inverse_pb_tup_dict
+                    )
+                except IndexError as exc:
+                    raise midani_smf.SMFError("unexpected end of data") from exc
+                for note in notes:
+                    voice_notes[
+                        midani_smf._voice_slot(
+                            track_i,
+                            note[4],
+                            split_tracks_to_voices,
+                            split_channels_to_voices,
+                        )
+                    ].append(note)
+
+        score = midani_smf._columnar_score(
+            voice_notes,
+            self.meta_score(tet=tet).meta_messages,
+            tet,
+            self.ticks_per_beat,
+            track_num_offset,
+            first_note_at_0=False,
+            min_attack_to_adjust=min_attack_to_adjust,
+            voices_to_keep=self._final_notes(
+                split_tracks_to_voices, split_channels_to_voices
+            ),
+        )
+        if displacement:
+            score.displace_passage(-displacement)
+            score.attacks_adjusted_by = -displacement
+        return score
+
+    def _read_track_window(
+        self, data, track, start_tick, end_tick, inverse_pb_tup_dict
+    ):
+        pos, track_end = track["span"]
+        tick = 0
+        running_status = None
+        pitch_bends = [0] * midani_smf.NUM_CHANNELS
+        note_ons = {}
+        released = set()
+        for checkpoint in track["checkpoints"]:
+            if checkpoint[3] > start_tick:
+                break
+            pos, tick, running_status, _, pitch_bends, sounding = checkpoint
+            pitch_bends = list(pitch_bends)
+            note_ons = {
+                key: (attack, velocity, pitch_bend)
+                for key, attack, velocity, pitch_bend, _ in sounding
+            }
+            released = {key for key, *_, is_released in sounding if is_released}
+        notes = []
+        stop_tick = end_tick
+        while True:
+            events, _, pos, tick, running_status = midani_smf._read_track(
+                data,
+                pos,
+                track_end,
+                keep_meta=False,
+                tick=tick,
+                running_status=running_status,
+                stop_tick=stop_tick,
+            )
+            notes.extend(
+                midani_smf._pair_notes(
+                    events,
+                    inverse_pb_tup_dict,
+                    note_ons=note_ons,
+                    pitch_bends=pitch_bends,
+                    released=released,
+                )
+            )
+            if pos >= track_end:
+                break
+            if all(
+                key in released or attack >= end_tick
+                for key, (attack, _, _) in note_ons.items()
+            ):
+                break
+            stop_tick += RELEASE_STEP_BEATS * self.ticks_per_beat
+        return notes
+
+
+def index_path(midi_fname, index_dir="") -> str:
+    """Returns the path at which the index of the midi file, as it is now, is
+    saved.
+
+    Args:
+        midi_fname: str.
+        index_dir: str. The cache directory. If empty, the value of
+            midani_cache.default_cache_dir() is used.
+
+    Raises:
+        OSError if the midi file can't be accessed.
+    """
+    stat = os.stat(midi_fname)
+    key = hashlib.sha256(
+        json.dumps(
+            [os.path.realpath(midi_fname), stat.st_size, stat.st_mtime_ns]
+        ).encode()
+    ).hexdigest()
+    return os.path.join(
+        index_dir if index_dir else midani_cache.default_cache_dir(),
+        INDEX_SUBDIR,
+        key + INDEX_SUFFIX,
+    )
+
+
+def _save_index(index, index_fname, max_bytes):
+    """Writes index to index_fname, then evicts least recently used entries
+    (see midani_cache.ScoreCache) if the cache is larger than max_bytes.
+    Errors are ignored, in which case the index is only kept in memory.
+    """
+    index_subdir = os.path.dirname(index_fname)
+    try:
+        os.makedirs(index_subdir, exist_ok=True)
+        # Write to a temporary file and then rename it, so that other
+        # processes never see partly written indexes
+        fd, temp_fname = tempfile.mkstemp(dir=index_subdir, prefix=".tmp")
+        try:
+            with open(fd, "w", encoding="utf-8") as outf:
+                outf.write(index.to_json())
+            os.replace(temp_fname, index_fname)
+        except OSError:
+            os.remove(temp_fname)
+            raise
+        midani_cache.ScoreCache(
+            os.path.dirname(index_subdir), max_bytes
+        ).evict()
+    except OSError:
+        pass
+
+
+def get_index(
+    midi_fname,
+    index_dir="",
+    save=True,
+    max_bytes=midani_cache.DEFAULT_MAX_BYTES,
+) -> SeekIndex:
+    """Returns the seek index of a midi file, loading it from the cache
+    directory index_dir (see index_path()) if it is there and up to date,
+    and otherwise building it (and, if save is True, trying to save it, in
+    which case the cache is kept to max_bytes).
+
+    Saved indexes are evicted from the cache along with its scores; if save
+    is True, loading an index marks it as recently used.
+
+    Raises:
+        midani_smf.SMFError if the file can't be read.
+    """
+    index = _INDEXES.get(midi_fname)
+    if index is not None and index.is_valid():
+        return index
+    try:
+        index_fname = index_path(midi_fname, index_dir)
+        with open(index_fname, "r", encoding="utf-8") as inf:
+            index = SeekIndex.from_json(midi_fname, inf.read())
+    except (OSError, ValueError, KeyError, TypeError):
+        index = None
+    else:
+        if save:
+            # As in midani_cache, the modification time records when the
+            # index was last used
+            try:
+                os.utime(index_fname)
+            except OSError:
+                pass
+    if index is None or not index.is_valid():
+        index = SeekIndex.build(midi_fname)
+        if save:
+            try:
+                index_fname = index_path(midi_fname, index_dir)
+            except OSError:
+                pass
+            else:
+                _save_index(index, index_fname, max_bytes)
+    _INDEXES[midi_fname] = index
+    return index
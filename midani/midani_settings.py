@@ -9,6 +9,7 @@ import math
 import numbers
 import os
 import random
+import re
 import sys
 import tempfile
 import typing
@@ -30,6 +31,9 @@ DEFAULT_CHANNEL_SETTINGS = {
 }
 
 TEMP_R_SCRIPT = "midani{:06d}.R"
+FRAME_STORE_EXT = ".frames"
+# Added to the names of the output files of shards (see `frame_range`)
+SHARD_SUFFIX_RE = re.compile(r"\.(\d+)-(\d+|end)$")
 
 DEFAULT_SHADOW_POSITIONS = lambda: []
 
@@ -84,6 +88,26 @@ DEFAULT_OUTPUT_PATH = "midani_output"
 DEFAULT_TEMP_R_PATH = ".temp_r_files"
 
 
+def shard_suffix(frame_range):
+    """Returns the suffix that is added to the names of the output files of
+    the shard that renders frame_range (see Settings.frame_range): e.g.,
+    ".000100-000200" for (100, 200), or ".000100-end" for (100, None).
+    """
+    start, end = frame_range
+    return f".{start:06d}-" + ("end" if end is None else f"{end:06d}")
+
+
+def parse_shard_suffix(fname):
+    """Returns the frame range of the shard whose output file is fname, or
+    None if fname isn't named like the output file of a shard.
+    """
+    match = SHARD_SUFFIX_RE.search(os.path.splitext(fname)[0])
+    if match is None:
+        return None
+    start, end = match.groups()
+    return int(start), (None if end == "end" else int(end))
+
+
 def read_settings_files_into_dict(settings_paths, use_eval):
     def _merge(dict1, dict2):
         for key, val in dict2.items():
@@ -539,6 +563,63 @@ class Settings:
             will be set to this constant length. (I have found that with some
             scores with a lot of staccato onsets, a constant note length
             looks better.)
+        midi_fast_reader: bool. If True, midi files are read with midani's own
+            Standard MIDI File reader, which is considerably faster than
+            reading them with mido. Files that it can't read (e.g., files with
+            SMPTE time division) are read with mido instead. Channel messages
+            other than notes and pitch bends are not read, since midani
+            doesn't use them.
+            Default: True
+        midi_seek_index: bool. If True, and only part of the score is to be
+            rendered (e.g., if `start_bar` or `end_time` is given), only that
+            part of the midi file(s) is read. To find it, an index of each
+            file is built the first time it is read. If `midi_cache` is True,
+            the index is saved in the cache directory (see `midi_cache_dir`);
+            otherwise it is only kept in memory. Ignored if
+            `midi_fast_reader` is False.
+            Default: True
+        midi_cache: bool. If True, scores read from midi files are cached on
+            disk, so that when the same files are rendered again with the same
+            settings, they don't need to be read again. The cache is keyed by
+            the contents of the files and the settings that affect reading
+            them (`tet`, `midi_tracks_to_voices`, `midi_channels_to_voices`,
+            `midi_reset_start_to_0`, `midi_constant_note_length`, and
+            `midi_fast_reader`). If False, nothing is written to the cache.
+            Default: False (but True when midani is run from the command
+            line)
+        midi_cache_dir: str. Directory of the cache (and of the indexes
+            written if `midi_seek_index` is True). If empty,
+            "$XDG_CACHE_HOME/midani" (or "~/.cache/midani") is used.
+            Default: ""
+        midi_cache_max_bytes: int. When the cache grows larger than this, the
+            least recently used scores (and seek indexes) are deleted from it.
+            Default: 268435456 (256 MiB)
+        midi_reader_processes: optional int. The number of worker processes
+            used to read midi files. If several files are read, they are read
+            in parallel; otherwise, the tracks of the file are read in
+            parallel. (Small files, and files read with mido because
+            `midi_fast_reader` is False, are always read in the main
+            process.) If None, the number of CPUs is used.
+            Default: None
+        midi_live_input: str. If passed, the video is played in real time
+            (see `python -m midani --live`) from midi that is read as it
+            arrives, rather than from `midi_fname` (which needn't be passed).
+            The midi must be a stream of raw midi messages (as from a midi
+            port; not a midi file), which are timed by when they arrive.
+            Possible values:
+                "-" : standard input.
+                "tcp://HOST:PORT" : a connection, which is accepted on
+                    HOST:PORT.
+                a path : a named pipe or device, read until it is closed, or
+                    a regular file, which is followed as it is appended to
+                    (from its end when it is opened).
+            If `midi_channels_to_voices` is True, each of the 16 midi channels
+            is a voice; otherwise, all notes are in one voice. The pitch range
+            of each channel grows as new pitches arrive (unless `l_pitch` and
+            `h_pitch` are set in `channel_settings`). The playback stops
+            `outro` seconds after the input ends. Set `frame_position` near 1
+            to leave room for the notes that have been played.
+            Default: ""
         output_dirname: str. path to folder where output images will be created.
             If a relative path, will be created relative to the current
             directory. If the path does not exist, it will be
@@ -576,6 +657,44 @@ class Settings:
             will not be deleted (and so can be inspected). If `process_video`
             is "no", then this setting is ignored.
             Default: True.
+        frame_range: optional tuple of form (int, optional int). If passed,
+            only frames START to END - 1 of the video (counting from 0) are
+            rendered, or, if END is None, frames START to the last frame. The
+            video file (or png files or frame store, if `process_video` is
+            "no") is named as usual but with ".START-END" added (e.g.,
+            "song.000100-000200.mp4"); see `python -m midani merge` for
+            joining them into the complete video. Thus a long video can be
+            rendered in "shards" in several processes or on several machines.
+            No audio is added to shards. If `seed` is None, it is set to 0,
+            so that random choices (e.g., of colors) are the same in each
+            shard.
+            Default: None
+        frame_format: str. How the frames are saved before they are encoded
+            (or, if `process_video` is "no", for later use). Possible values:
+                "png" : (Default) a png file per frame, in `output_dirname`.
+                "raw" : a single file of uncompressed frames (see
+                    midani_frame_store), which is written and read
+                    memory-mapped. It is named after `video_fname`, with the
+                    extension ".frames", and is in `output_dirname`. Unless
+                    frames are cropped from tiles (see `strip_render`), this
+                    requires matplotlib; frames plotted with R are always
+                    saved as pngs.
+        png_compression: optional int. zlib compression level (0 to 9) of png
+            files written by matplotlib or when frames are cropped from tiles.
+            Lower levels write faster but make larger files. (R's png device
+            doesn't have this option.) If None, the default is used.
+            Default: None
+        video_decoder_threads: optional int. The number of threads that read
+            png files while the video is encoded. If None, the number of CPUs
+            is used.
+            Default: None
+        video_encoder_processes: optional int. If more than 1, and ffmpeg is
+            available, png files are encoded into segments of the video by
+            this many worker processes at once, and the segments are then
+            joined (without re-encoding) with ffmpeg. If None, the number of
+            CPUs is used. (Only when the video is built from png files; short
+            videos are always encoded by a single process.)
+            Default: None
         tet: int. Set temperament.
             Default: 12 (for 12-tone equal temperament.)
         seed: int. Seed for python's random module.
@@ -980,6 +1099,16 @@ class Settings:
             callable needs to be able to handle zero values (e.g.,
             `lambda x: 1/x` will throw a ZeroDivisionError).
             Default: lambda x: x (i.e., linear)
+        lookup_table_max_error: float. Global setting only. Note and line
+            scaling (as determined by the previous settings) are precomputed
+            into lookup tables, which are then read with linear interpolation.
+            This setting is the approximate error of the interpolated scale
+            factors, as measured at the midpoints between the entries of the
+            tables. It is a proportion of the unscaled size (so the error in
+            the drawn size is roughly this times that size). If 0,
+            lookup tables are not used and the scale functions are evaluated
+            directly for every note on every frame.
+            Default: 1e-6
 
         Highlight
         =========
@@ -1258,8 +1387,92 @@ class Settings:
             Default: (0, 0, 0, 255).
         now_line_width: Number.
             Default: 5.0
-        now_line_zorder: Number. Higher brings it closer to the front.
+        now_line_zorder: Number. Higher brings it closer to the front. If it
+            is greater than 15 (the zorder of the notes), the now line is
+            drawn in front of the notes; otherwise, behind them.
             Default: 1.
+        cull_primitives: boolean. If True, notes, connection lines, and their
+            shadows that wouldn't be visible (because they are outside the
+            frame, or, with R, have no area or are less than `cull_min_pixels`
+            wide or high, or, for shadows, are entirely covered by an opaque
+            note) aren't drawn, and adjacent piano roll or metric column
+            rectangles of the same color are drawn as a single rectangle.
+            Default: True.
+        cull_min_pixels: float. If `cull_primitives` is True, note and shadow
+            rectangles narrower or shorter than this many pixels aren't drawn.
+            (Only with R: matplotlib draws an edge around each rectangle,
+            which is visible however thin the rectangle is, so such
+            rectangles are drawn.)
+            Default: 0.25
+        pixel_geometry: boolean. If True, the x coordinates of everything that
+            is drawn are whole pixels rather than seconds. A note is at the
+            same pixels in every frame, and successive frames are shifted by
+            whole pixels, so that the edges of notes don't shimmer as they
+            scroll, and frames that show the same thing are identical.
+            Default: False
+        strip_render: str. Possible values:
+                "auto" : (Default) if the appearance of notes doesn't change
+                    over time (i.e., notes don't grow, shrink, flutter,
+                    bounce, or get highlighted, they are drawn across the
+                    whole frame, and the background color is constant), the
+                    notes, piano roll, and metric columns are drawn only once,
+                    as a long image divided into tiles, and each frame is
+                    cropped from the tiles. The now line, lyrics, annotations,
+                    and brackets are then drawn on top of each frame. This is
+                    much faster than drawing every note on every frame. (If
+                    `now_line` is True, and `now_line_zorder` puts the now
+                    line behind the notes, every frame is drawn in full.)
+                "always" : frames are cropped from tiles even if the
+                    appearance of notes changes over time (in which case each
+                    tile shows the notes as they appear at the time it is
+                    drawn), and the now line is drawn on top of them
+                    whatever its zorder.
+                "never" : every frame is drawn in full.
+            Frames that are cropped from tiles are drawn with
+            `pixel_geometry`.
+        pipeline: boolean. If True, and frames are plotted with R (and not
+            cropped from tiles; see `strip_render`), Rscript is run on each R
+            script as soon as it is written, and the frames it plots are
+            added to the video as soon as they are plotted, so that writing
+            R scripts, plotting, and encoding the video run at the same time.
+            Default: True
+        pipeline_r_processes: optional int. If `pipeline` is True, the number
+            of Rscript processes that may run at once. If None, the number of
+            CPUs is used.
+            Default: None
+        pipeline_max_chunks: int. If `pipeline` is True, the maximum number of
+            R scripts (each of which plots up to 50 frames) that may have
+            been written but not yet added to the video. When there are this
+            many, writing R scripts waits, so that the temporary files take
+            up a bounded amount of disk space. Must be at least 1.
+            Default: 8
+        render_processes: optional int. If frames are plotted with
+            matplotlib, the video is encoded, `clean_up_png_files` is True,
+            and frames aren't cropped from tiles (see `strip_render`), the
+            frames are rendered by this many forked worker processes, and
+            passed to the encoder through shared memory rather than as png
+            files. If None, the number of CPUs is used. (Not available on
+            platforms that can't fork, where frames are saved as pngs.)
+            Default: None
+        frame_ring_slots: optional int. The number of rendered frames that may
+            be held in shared memory, waiting to be encoded, when frames are
+            rendered by `render_processes`. When the slots are full, the
+            worker processes wait. If None, twice `render_processes` is used.
+            Default: None
+        live_degrade_misses: int. When the video is played in real time
+            (with `python -m midani --live`), a frame misses its deadline if
+            it is rendered after the time at which it should be shown, and
+            the frames whose time has passed are skipped. When this many
+            frames within a second of the video miss their deadlines, the
+            quality is lowered to catch up: first the number of shadows is
+            halved (repeatedly), then flutter is turned off.
+            Default: 3
+        live_http_port: int. The port on which the video is served (on
+            localhost, as MJPEG) when it is played in real time over http.
+            Default: 8000
+        live_jpeg_quality: int. The quality (0 to 100) of the jpegs of which
+            the MJPEG stream is made.
+            Default: 80
     """
 
     midi_fname: typing.Union[  # pylint: disable=unsubscriptable-object
@@ -1269,6 +1482,13 @@ class Settings:
     midi_tracks_to_voices: bool = True
     midi_channels_to_voices: bool = False
     midi_constant_note_length: typing.Optional[numbers.Number] = None
+    midi_fast_reader: bool = True
+    midi_seek_index: bool = True
+    midi_cache: bool = False
+    midi_cache_dir: str = ""
+    midi_cache_max_bytes: int = 256 * 2**20
+    midi_reader_processes: typing.Optional[int] = None
+    midi_live_input: str = ""
     output_dirname: str = DEFAULT_OUTPUT_PATH
     resolution: typing.Tuple[int, int] = (1280, 720)
     _temp_r_dirname: typing.Optional[str] = None
@@ -1278,6 +1498,11 @@ class Settings:
     audio_offset: float = 0.0
     clean_up_r_files: bool = True
     clean_up_png_files: bool = True
+    frame_range: typing.Optional[typing.Tuple[int, typing.Optional[int]]] = None
+    frame_format: str = "png"
+    png_compression: typing.Optional[int] = None
+    video_decoder_threads: typing.Optional[int] = None
+    video_encoder_processes: typing.Optional[int] = None
     tet: int = 12
     seed: int = None
     add_annotations: list = dataclasses.field(default_factory=list)
@@ -1287,6 +1512,18 @@ class Settings:
     now_line_color: typing.Tuple[int, int, int, int] = (0, 0, 0, 255)
     now_line_width: numbers.Number = 5.0
     now_line_zorder: numbers.Number = 1
+    cull_primitives: bool = True
+    cull_min_pixels: float = 0.25
+    pixel_geometry: bool = False
+    strip_render: str = "auto"
+    pipeline: bool = True
+    pipeline_r_processes: typing.Optional[int] = None
+    pipeline_max_chunks: int = 8
+    render_processes: typing.Optional[int] = None
+    frame_ring_slots: typing.Optional[int] = None
+    live_degrade_misses: int = 3
+    live_http_port: int = 8000
+    live_jpeg_quality: int = 80
     _test: bool = False  # append "_test to output filename"
 
     # lyrics
@@ -1387,6 +1624,7 @@ class Settings:
     note_end_height: float = 1
     start_scale_function: typing.Callable = lambda x: x
     end_scale_function: typing.Callable = lambda x: x
+    lookup_table_max_error: float = 1e-6
 
     highlight_strength: float = 1
     highlight_start: float = 0.1
@@ -1498,10 +1736,10 @@ class Settings:
         if not isinstance(self.brackets, list):
             self.brackets = list(self.brackets)
 
-        if not self.midi_fname:
+        if not self.midi_fname and not self.midi_live_input:
             raise ValueError("no 'midi_fname' keyword argument to Settings()")
         if isinstance(self.midi_fname, str):
-            self.midi_fname = (self.midi_fname,)
+            self.midi_fname = (self.midi_fname,) if self.midi_fname else ()
         self.midi_fname = tuple(
             os.path.abspath(os.path.expandvars(os.path.expanduser(p)))
             for p in self.midi_fname
@@ -1510,6 +1748,9 @@ class Settings:
             if not os.path.exists(fname):
                 print(f"ERROR: Midi file `{fname}` does not exist!")
                 sys.exit(1)
+        if self.frame_range is not None and self.seed is None:
+            # So that all the shards choose the same random colors, etc.
+            self.seed = 0
         if self.seed is not None:
             random.seed(self.seed)
         if self.intro_bg_color is None:
@@ -1553,9 +1794,11 @@ class Settings:
         self.output_dirname = os.path.abspath(
             os.path.expandvars(os.path.expanduser(self.output_dirname))
         )
-        self.audio_fname = os.path.abspath(
-            os.path.expandvars(os.path.expanduser(self.audio_fname))
-        )
+        if self.audio_fname:
+            # (os.path.abspath("") is the working directory)
+            self.audio_fname = os.path.abspath(
+                os.path.expandvars(os.path.expanduser(self.audio_fname))
+            )
         self.temp_r_script_base = os.path.join(
             self._temp_r_dirname, TEMP_R_SCRIPT
         )
@@ -1563,21 +1806,41 @@ class Settings:
             self.video_fname = os.path.abspath(
                 os.path.expandvars(os.path.expanduser(self.video_fname))
             )
-        else:
+        elif self.midi_fname:
             self.video_fname = (
                 os.path.splitext(os.path.basename(self.midi_fname[0]))[0]
                 + ".mp4"
             )
+        else:
+            self.video_fname = "midani_live.mp4"
         if self.video_fname == os.path.basename(self.video_fname):
             self.video_fname = os.path.join(
                 self.output_dirname, self.video_fname
             )
+        if self.frame_range is not None:
+            root, ext = os.path.splitext(self.video_fname)
+            self.video_fname = root + shard_suffix(self.frame_range) + ext
         self.png_fname_base = os.path.join(
             self.output_dirname,
             os.path.splitext(os.path.basename(self.video_fname))[0],
         )
         if self.png_fname_base[-1].isdigit():
             self.png_fname_base += "_"
+        self.frame_store_fname = os.path.join(
+            self.output_dirname,
+            os.path.splitext(os.path.basename(self.video_fname))[0]
+            + FRAME_STORE_EXT,
+        )
+        if self.frame_format not in ("png", "raw"):
+            raise ValueError(
+                f"`frame_format` must be 'png' or 'raw', not "
+                f"{self.frame_format!r}"
+            )
+        if self.pipeline_max_chunks < 1:
+            raise ValueError(
+                f"`pipeline_max_chunks` must be at least 1, not "
+                f"{self.pipeline_max_chunks!r}"
+            )
         self.png_fnum_digits = 5
         if self._test:
             bits = os.path.splitext(self.video_fname)
@@ -1616,6 +1879,41 @@ class Settings:
         self.num_shadows = self.max_shadow_x_time = None
         self.min_shadow_x_time = None
 
+    def has_time_window(self):
+        """Returns True if only part of the score is to be rendered (or at
+        least, if a start or end is given).
+        """
+        return bool(
+            self.start_time
+            or self.start_bar
+            or self.start_beat
+            or self.end_time
+            or self.end_bar
+            or self.end_beat
+        )
+
+    def get_start_and_end_times(self, tempo_changes, get_total_len):
+        """Returns start_time and end_time, worked out from start_bar,
+        end_bar, etc., if they are given.
+
+        get_total_len is a function returning the total length of the score
+        in ticks; it is only called if the end of the score is needed.
+        """
+        start_time, end_time = self.start_time, self.end_time
+        if self.start_bar or self.start_beat:
+            start_beat = (self.start_bar - 1) * self.bar_length + (
+                self.start_beat - 1
+            )
+            start_time = tempo_changes.ctime_from_btime(start_beat)
+        if self.end_bar or self.end_beat:
+            end_beat = (self.end_bar - 1) * self.bar_length + (
+                self.end_beat - 1
+            )
+            end_time = tempo_changes.ctime_from_btime(end_beat)
+        elif not end_time:
+            end_time = tempo_changes.ctime_from_tick(get_total_len())
+        return start_time, end_time
+
     def update_from_score(self, score, tempo_changes):
         self.num_voices = score.num_voices
 
@@ -1640,20 +1938,9 @@ class Settings:
             self.voice_assmts[chan_i].append(voice_i)
 
         # Update start_time and end_time if necessary
-        if self.start_bar or self.start_beat:
-            start_beat = (self.start_bar - 1) * self.bar_length + (
-                self.start_beat - 1
-            )
-            self.start_time = tempo_changes.ctime_from_btime(start_beat)
-        if self.end_bar or self.end_beat:
-            end_beat = (self.end_bar - 1) * self.bar_length + (
-                self.end_beat - 1
-            )
-            self.end_time = tempo_changes.ctime_from_btime(end_beat)
-        elif not self.end_time:
-            self.end_time = tempo_changes.ctime_from_btime(
-                score.get_total_len()
-            )
+        self.start_time, self.end_time = self.get_start_and_end_times(
+            tempo_changes, score.get_total_len
+        )
 
         # Work out final_time
         if self.final_bar or self.final_beat:
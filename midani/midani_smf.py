@@ -0,0 +1,486 @@
+"""Provides a fast reader for Standard MIDI Files.
+
+read_smf() returns the same Score as
+midi_funcs.read_midi_to_internal_data(), but rather than building a mido
+message object for every event, it walks the bytes of each track once and
+only decodes the events that midani uses: note on/off, pitchwheel, and (on
+the first track) meta messages such as tempo changes.
+"""
+
+import fractions
+import functools
+import math
+import operator
+import typing
+import warnings
+
+import mido.midifiles.meta
+import numpy as np
+
+import midani.from_my_other_projects.midi_funcs as midi_funcs
+import midani.from_my_other_projects.note_classes as note_classes
+import midani.from_my_other_projects.tuning as tuning
+
+from . import midani_notes
+
+NUM_CHANNELS = midi_funcs.NUM_CHANNELS
+
+# When several events occur at the same tick, midi_funcs processes them
+# sorted by message type: "pitchwheel" first, then "note_off", then
+# "note_on". We reproduce this order by sorting on tick * 4 + rank.
+PITCHWHEEL_RANK = 0
+NOTE_OFF_RANK = 1
+NOTE_ON_RANK = 2
+
+
+class SMFError(Exception):
+    """Raised when read_smf() can't read a file.
+
+    Besides malformed files, this includes valid files that use features the
+    reader doesn't support (SMPTE time division and system common messages).
+    These can still be read with midi_funcs.read_midi_to_internal_data().
+    """
+
+
+def _read_var_len(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def _read_track(
+    data,
+    pos,
+    end,
+    keep_meta,
+    tick=0,
+    running_status=None,
+    stop_tick=math.inf,
+    checkpoints=None,
+    checkpoint_interval=math.inf,
+):
+    """Reads the events of one track chunk.
+
+    Reading can begin part way through a track, at the position, tick and
+    running status where an earlier call stopped (or that were saved in a
+    checkpoint).
+
+    Keyword args:
+        stop_tick: reading stops before the first event at or after this tick.
+        checkpoints: if a list is passed, whenever at least
+            checkpoint_interval note and pitchwheel events have been read
+            since the last checkpoint, a checkpoint is appended at the next
+            change of tick. Checkpoints are tuples of form (position, tick,
+            running status, number of events read so far, next tick), such
+            that reading can be resumed from the position, tick, and running
+            status, and no event read after that has a tick less than next
+            tick.
+
+    Returns:
+        A 5-tuple:
+            - list of note and pitchwheel events, as tuples of form (sort
+              key, status, data1, data2), sorted as described above.
+            - if keep_meta is True, list of meta events, as tuples of form
+              (tick, meta type, data). Otherwise empty.
+            - the position, tick and running status where reading stopped.
+    """
+    events = []
+    meta_events = []
+    next_checkpoint = checkpoint_interval
+    while pos < end:
+        if data[pos]:
+            delta_pos = pos
+            if data[pos] < 0x80:
+                # Most deltas fit in one byte
+                next_tick = tick + data[pos]
+                pos += 1
+            else:
+                delta, pos = _read_var_len(data, pos)
+                next_tick = tick + delta
+            if next_tick >= stop_tick:
+                pos = delta_pos
+                break
+            if len(events) >= next_checkpoint:
+                checkpoints.append(
+                    (delta_pos, tick, running_status, len(events), next_tick)
+                )
+                next_checkpoint = len(events) + checkpoint_interval
+            tick = next_tick
+        else:
+            pos += 1
+        status = data[pos]
+        if status < 0x80:
+            if running_status is None:
+                raise SMFError("running status without previous status")
+            status = running_status
+        else:
+            pos += 1
+            if status < 0xF0:
+                running_status = status
+        kind = status & 0xF0
+        if kind == 0x90:
+            events.append(
+                ((tick << 2) | NOTE_ON_RANK, status, data[pos], data[pos + 1])
+            )
+            pos += 2
+        elif kind == 0x80:
+            events.append(
+                ((tick << 2) | NOTE_OFF_RANK, status, data[pos], data[pos + 1])
+            )
+            pos += 2
+        elif kind == 0xE0:
+            events.append(
+                (
+                    (tick << 2) | PITCHWHEEL_RANK,
+                    status,
+                    data[pos],
+                    data[pos + 1],
+                )
+            )
+            pos += 2
+        elif kind in (0xA0, 0xB0):
+            pos += 2
+        elif kind in (0xC0, 0xD0):
+            pos += 1
+        elif status == 0xFF:
+            meta_type = data[pos]
+            length, pos = _read_var_len(data, pos + 1)
+            if keep_meta:
+                meta_events.append((tick, meta_type, data[pos : pos + length]))
+            pos += length
+        elif status in (0xF0, 0xF7):
+            length, pos = _read_var_len(data, pos)
+            pos += length
+        else:
+            raise SMFError(f"unsupported status byte {status:#x}")
+    else:
+        if pos != end:
+            raise SMFError("track chunk ends in the middle of an event")
+    events.sort(key=operator.itemgetter(0))
+    return events, meta_events, pos, tick, running_status
+
+
+def _read_chunks(data):
+    """Returns (format, num_tracks, ticks_per_beat, list of track spans)."""
+    if data[:4] != b"MThd":
+        raise SMFError("no MThd header")
+    header_len = int.from_bytes(data[4:8], "big")
+    if header_len < 6:
+        raise SMFError("MThd header too short")
+    smf_format = int.from_bytes(data[8:10], "big")
+    num_tracks = int.from_bytes(data[10:12], "big")
+    division = int.from_bytes(data[12:14], "big")
+    if division & 0x8000:
+        raise SMFError("SMPTE time division is not supported")
+    pos = 8 + header_len
+    track_spans = []
+    while len(track_spans) < num_tracks:
+        if pos + 8 > len(data):
+            raise SMFError("file has fewer track chunks than its header says")
+        chunk_len = int.from_bytes(data[pos + 4 : pos + 8], "big")
+        start = pos + 8
+        end = start + chunk_len
+        if end > len(data):
+            raise SMFError("truncated track chunk")
+        if data[pos : pos + 4] == b"MTrk":
+            track_spans.append((start, end))
+        # Chunks of other types are skipped, as the standard prescribes
+        pos = end
+    return smf_format, num_tracks, division, track_spans
+
+
+def _pair_notes(
+    events,
+    inverse_pb_tup_dict=None,
+    note_ons=None,
+    pitch_bends=None,
+    released=None,
+):
+    """Pairs the note on and note off events of a track.
+
+    Args:
+        events: list of events from _read_track().
+        inverse_pb_tup_dict: dict mapping (midi number, pitch bend) tuples to
+            pitches. Should be passed if tet != 12.
+
+    Keyword args:
+        note_ons, pitch_bends, released: the state of the track at the start
+            of events, which is updated in place. This allows a track to be
+            paired in several pieces.
+                - note_ons: dict. Keys are channel * 128 + midi number, values
+                  are (attack tick, velocity, pitch bend). As in midi_funcs,
+                  entries are not removed at note off.
+                - pitch_bends: list of the current pitch bend on each channel.
+                - released: if a set is passed, the keys of note_ons whose
+                  latest note has been released are kept in it.
+
+    Returns:
+        A list of notes, as tuples of form (pitch, attack tick, duration in
+        ticks, velocity, channel), in the order in which they are released.
+    """
+    notes = []
+    if pitch_bends is None:
+        pitch_bends = [0] * NUM_CHANNELS
+    if note_ons is None:
+        note_ons = {}
+    for key, status, data1, data2 in events:
+        channel = status & 0x0F
+        rank = key & 3
+        if rank == PITCHWHEEL_RANK:
+            pitch_bends[channel] = (data1 | (data2 << 7)) - 8192
+        elif rank == NOTE_ON_RANK and data2 > 0:
+            note_key = (channel << 7) | data1
+            note_ons[note_key] = (key >> 2, data2, pitch_bends[channel])
+            if released is not None:
+                released.discard(note_key)
+        elif rank == NOTE_ON_RANK and data1 == 0:
+            # JRP scores seem to have note_on events with velocity and
+            # note 0 at the end of scores. We can ignore these.
+            continue
+        else:
+            note_key = (channel << 7) | data1
+            try:
+                tick_attack, velocity, pitch_bend = note_ons[note_key]
+            except KeyError:
+                continue
+            if inverse_pb_tup_dict is not None:
+                pitch = inverse_pb_tup_dict[(data1, pitch_bend)]
+            else:
+                pitch = data1
+            dur = (key >> 2) - tick_attack
+            notes.append((pitch, tick_attack, dur, velocity, channel))
+            if released is not None:
+                released.add(note_key)
+    return notes
+
+
+@functools.lru_cache(maxsize=None)
+def _inverse_pb_tup_dict(tet):
+    if tet == 12:
+        return None
+    return {
+        pb_tup: pitch
+        for pitch, pb_tup in tuning.return_pitch_bend_tuple_dict(tet).items()
+    }
+
+
+def _voice_slot(
+    track_i, channel, split_tracks_to_voices, split_channels_to_voices
+):
+    """Returns the index (possibly -1) of the voice that the notes of a track
+    and channel are read into.
+
+    As in note_classes.VoiceList, notes on the first track go to the last
+    voice (index -1).
+    """
+    voice_i = track_i - 1 if split_tracks_to_voices else 0
+    if split_channels_to_voices:
+        return voice_i * NUM_CHANNELS + channel
+    return voice_i
+
+
+def _meta_messages(meta_events, ticks, ticks_per_beat):
+    meta_msgs = []
+    for tick, meta_type, meta_data in meta_events:
+        msg = mido.midifiles.meta.build_meta_message(meta_type, list(meta_data))
+        msg.time = tick if ticks else fractions.Fraction(tick, ticks_per_beat)
+        meta_msgs.append(msg)
+    # midi_funcs sorts messages by type and then (stably) by time
+    meta_msgs.sort(key=lambda msg: msg.type)
+    meta_msgs.sort(key=lambda msg: msg.time)
+    return meta_msgs
+
+
+def _read_track_notes(track_data, keep_meta, tet):
+    """Reads a track chunk (given as bytes) and pairs its notes.
+
+    This is a module-level function so that it can be run in a worker
+    process.
+
+    Returns:
+        A 2-tuple of the notes (see _pair_notes()) and the meta events (see
+        _read_track()) of the track.
+    """
+    try:
+        events, meta_events, _, _, _ = _read_track(
+            track_data, 0, len(track_data), keep_meta
+        )
+    except IndexError as exc:
+        raise SMFError("unexpected end of data") from exc
+    return _pair_notes(events, _inverse_pb_tup_dict(tet)), meta_events
+
+
+def read_smf(
+    in_midi_fname,
+    tet=12,
+    time_sig=None,
+    track_num_offset=0,
+    max_denominator=8192,
+    first_note_at_0=False,
+    min_attack_to_adjust=4,
+    split_tracks_to_voices=True,
+    split_channels_to_voices=False,
+    ticks=False,
+    columnar=False,
+    executor=None,
+) -> typing.Union[note_classes.Score, midani_notes.ColumnarScore]:
+    """Reads midi file into a Score() instance.
+
+    The arguments and the returned Score are the same as for
+    midi_funcs.read_midi_to_internal_data() (including the ticks keyword
+    argument), with these exceptions:
+        - channel messages other than note on/off and pitchwheel, and meta
+          messages on tracks other than the first, are not read (midani
+          doesn't use them).
+        - note off events with no preceding note on event are ignored
+          (rather than raising a KeyError).
+        - if tet != 12, notes that are attacked before any pitchwheel event
+          on their channel are read with a pitch bend of 0.
+
+    Keyword args:
+        columnar: boolean. If True, a midani_notes.ColumnarScore is returned
+            instead of a Score. Times are then always in ticks (i.e., ticks
+            is taken to be True) and time_sig is ignored.
+            Default: False
+        executor: optional concurrent.futures.Executor. If passed, the tracks
+            are read in parallel with it (e.g., with a ProcessPoolExecutor).
+            The result is the same as when they are read one at a time.
+
+    Raises:
+        SMFError if the file can't be read (see SMFError).
+    """
+    with open(in_midi_fname, "rb") as inf:
+        data = inf.read()
+    try:
+        _, num_tracks, ticks_per_beat, track_spans = _read_chunks(data)
+    except IndexError as exc:
+        raise SMFError("unexpected end of data") from exc
+    track_args = [
+        (data[start:end], track_i == 0, tet)
+        for track_i, (start, end) in enumerate(track_spans)
+    ]
+    if executor is None:
+        tracks = [_read_track_notes(*args) for args in track_args]
+    else:
+        futures = [
+            executor.submit(_read_track_notes, *args) for args in track_args
+        ]
+        tracks = [future.result() for future in futures]
+    if num_tracks == 1:
+        warnings.warn(
+            "Midi files of just one track exported from Logic "
+            "don't put meta messages on a separate track. Support "
+            "for these is not yet implemented and there is likely to "
+            "be a crash very soon..."
+        )
+    if columnar:
+        ticks = True
+
+    num_voices = num_tracks - 1 if split_tracks_to_voices else 1
+    if split_channels_to_voices:
+        num_voices *= NUM_CHANNELS
+
+    voice_notes = [[] for _ in range(num_voices)]
+    for track_i, (notes, _) in enumerate(tracks):
+        if split_channels_to_voices:
+            for note in notes:
+                voice_notes[
+                    _voice_slot(track_i, note[4], split_tracks_to_voices, True)
+                ].append(note)
+        else:
+            voice_notes[
+                _voice_slot(track_i, 0, split_tracks_to_voices, False)
+            ].extend(notes)
+
+    meta_msgs = _meta_messages(
+        tracks[0][1] if tracks else (), ticks, ticks_per_beat
+    )
+
+    if columnar:
+        return _columnar_score(
+            voice_notes,
+            meta_msgs,
+            tet,
+            ticks_per_beat,
+            track_num_offset,
+            first_note_at_0,
+            min_attack_to_adjust,
+        )
+
+    if max_denominator == 0:
+        max_denominator = 8192
+
+    @functools.lru_cache(maxsize=None)
+    def _beats(tick):
+        out = fractions.Fraction(tick, ticks_per_beat)
+        # If ticks_per_beat <= max_denominator, the denominator of out is
+        # already small enough
+        if ticks_per_beat > max_denominator:
+            out = out.limit_denominator(max_denominator=max_denominator)
+        return out
+
+    internal_data = note_classes.Score(
+        tet=tet,
+        num_voices=num_voices,
+        time_sig=time_sig,
+        ticks_per_beat=ticks_per_beat if ticks else 1,
+    )
+    for voice, notes in zip(internal_data.voices, voice_notes):
+        if track_num_offset:
+            voice.voice_i += track_num_offset
+        for pitch, attack, dur, velocity, channel in notes:
+            if not ticks:
+                attack = _beats(attack)
+                dur = _beats(dur)
+            voice.add_note_object(
+                note_classes.Note(
+                    pitch, attack, dur, velocity=velocity, choir=channel
+                ),
+                update_sort=False,
+            )
+    for msg in meta_msgs:
+        internal_data.add_meta_message(msg)
+
+    return midi_funcs.finish_score(
+        internal_data,
+        first_note_at_0,
+        min_attack_to_adjust * internal_data.ticks_per_beat,
+    )
+
+
+def _columnar_score(
+    voice_notes,
+    meta_msgs,
+    tet,
+    ticks_per_beat,
+    track_num_offset,
+    first_note_at_0,
+    min_attack_to_adjust,
+    voices_to_keep=None,
+):
+    """Used by read_smf() and midani_seek.
+
+    If voices_to_keep is None, empty voices are removed. Otherwise, only the
+    voices whose indices are in voices_to_keep are kept, whether they are
+    empty or not.
+    """
+    score = midani_notes.ColumnarScore(tet=tet, ticks_per_beat=ticks_per_beat)
+    for voice_i, notes in enumerate(voice_notes):
+        if voices_to_keep is not None and voice_i not in voices_to_keep:
+            continue
+        columns = np.array(notes, dtype=np.int64).reshape(-1, 5).T
+        score.add_voice(
+            midani_notes.ColumnarVoice(
+                *columns, voice_i=voice_i + track_num_offset, tet=tet
+            )
+        )
+    score.meta_messages = meta_msgs
+    if voices_to_keep is None:
+        score.remove_empty_voices()
+    if first_note_at_0:
+        score.move_first_note_to_0(min_attack_to_adjust * ticks_per_beat)
+    return score
@@ -0,0 +1,275 @@
+"""Provides functions for rendering frames as crops of one long image.
+
+When the appearance of notes doesn't change over time, every frame shows the
+same image, shifted horizontally. With pixel geometry (see
+Settings.pixel_geometry), it is shifted by whole pixels, so the notes can be
+drawn once, as a "strip" running the length of the video, and each frame can
+be cropped from it.
+
+The strip is drawn as a sequence of tiles, each of which is a frame-sized png
+drawn by the plot boss. Only the middle of each tile is used, since notes near
+the edges of a frame may be drawn differently (e.g., a connection line isn't
+drawn until the note it leads to is in the frame). Everything that isn't part
+of the strip (the now line, lyrics, etc.) is drawn by the plot boss on a
+transparent background, and composited onto the crop.
+"""
+import collections
+import math
+import os
+
+import cv2
+import numpy as np
+
+from . import midani_av
+from . import midani_misc_classes
+
+# The maximum number of tiles that are kept in memory while compositing
+TILE_CACHE_SIZE = 4
+
+# The background of the overlays
+TRANSPARENT = (0, 0, 0, 0)
+
+
+def is_time_invariant(settings) -> bool:
+    """Returns True if the appearance of notes doesn't change over time, so
+    that each frame is a crop of the strip.
+    """
+    if settings.bg_clock_times:
+        # The background color, and hence the shadow color, changes
+        return False
+    for voice_i in settings.voices_to_render:
+        voice_settings = settings[voice_i]
+        if (
+            voice_settings.note_start < 1
+            or voice_settings.note_end < 1
+            or voice_settings.note_start_width != 1
+            or voice_settings.note_end_width != 1
+            or voice_settings.note_start_height != 1
+            or voice_settings.note_end_height != 1
+            or voice_settings.highlight_strength > 0
+            or voice_settings.max_flutter_size > 0
+            or voice_settings.bounce_radius > 0
+        ):
+            return False
+        if voice_settings.connection_lines and (
+            voice_settings.line_start < 1
+            or voice_settings.line_end < 1
+            or voice_settings.line_start_size != 1
+            or voice_settings.line_end_size != 1
+        ):
+            return False
+    return True
+
+
+def now_line_in_front(settings) -> bool:
+    """Returns True if there is no now line, or it is in front of the notes
+    (i.e., its zorder is greater than that of the notes), so that drawing it
+    over the crops of the strip gives the same frames as drawing it with the
+    notes.
+    """
+    return (
+        not settings.now_line
+        or settings.now_line_zorder
+        > midani_misc_classes.PrimitiveBuckets.NOTE_Z
+    )
+
+
+def tile_margin(settings) -> int:
+    """Returns the width in pixels of the edges of each tile that aren't
+    used.
+
+    Anything that overlaps the middle of a tile belongs to a note (or a
+    connection line between notes) that starts or ends within this distance
+    of it, and so is drawn in the tile.
+    """
+    x_scale = settings.out_width / settings.frame_len
+    shadow_time = max(
+        abs(settings.max_shadow_x_time), abs(settings.min_shadow_x_time)
+    )
+    line_time = line_width = 0
+    for voice_i in settings.voices_to_render:
+        if settings[voice_i].connection_lines:
+            line_time = max(
+                line_time, settings[voice_i].max_connection_line_duration
+            )
+            line_width = max(line_width, settings[voice_i].con_line_width)
+    return (
+        math.ceil((shadow_time + line_time) * x_scale)
+        + math.ceil(line_width)
+        + 2
+    )
+
+
+def use_strip(settings) -> bool:
+    """Returns True if frames should be cropped from a strip, according to
+    settings.strip_render.
+    """
+    if settings.strip_render == "never":
+        return False
+    if settings.out_width - 2 * tile_margin(settings) < 1:
+        # The tiles would have no middle
+        return False
+    if settings.strip_render == "always":
+        return True
+    if settings.strip_render == "auto":
+        return is_time_invariant(settings) and now_line_in_front(settings)
+    raise ValueError(
+        f"`strip_render` must be 'auto', 'always', or 'never', not "
+        f"{settings.strip_render!r}"
+    )
+
+
+class OverlayWindow:
+    """Wraps a Window so that frames are drawn with a transparent
+    background.
+    """
+
+    bg_color = TRANSPARENT
+
+    def __init__(self, window):
+        self._window = window
+
+    def __getattr__(self, name):
+        return getattr(self._window, name)
+
+
+class Strip:
+    """Keeps track of the tiles of the strip and composites frames from them.
+
+    Args:
+        settings: Settings.
+        frame_x_starts: list of int. The x coordinate (in pixels) of the
+            start of each frame, in order.
+    """
+
+    def __init__(self, settings, frame_x_starts):
+        self.settings = settings
+        self.frame_x_starts = frame_x_starts
+        self.width = settings.out_width
+        self.margin = tile_margin(settings)
+        # The width of the part of each tile that is used
+        self.step = self.width - 2 * self.margin
+        self.origin = min(frame_x_starts, default=0)
+        # The indices of the tiles that are needed, in order. Tile i covers
+        # the pixels from origin + i * step to origin + (i + 1) * step.
+        self.tiles = sorted(
+            {
+                tile_i
+                for x_start in frame_x_starts
+                for tile_i, _, _ in self._tile_slices(x_start)
+            }
+        )
+        self._tile_fnames = {}
+
+    def tile_x_start(self, tile_i):
+        """Returns the x coordinate of the start of the frame in which tile
+        tile_i is drawn.
+        """
+        return self.origin + tile_i * self.step - self.margin
+
+    def _tile_slices(self, x_start):
+        """Yields (tile index, first column, last column + 1) for each of the
+        tiles that make up the frame starting at x_start, from left to right.
+        The columns are columns of the tile png.
+        """
+        x = x_start
+        x_end = x_start + self.width
+        while x < x_end:
+            tile_i = (x - self.origin) // self.step
+            tile_start = self.origin + tile_i * self.step
+            end = min(x_end, tile_start + self.step)
+            yield (
+                tile_i,
+                x - tile_start + self.margin,
+                end - tile_start + self.margin,
+            )
+            x = end
+
+    def set_tile_fnumbers(self, first_fnumber):
+        """Records that the tiles were drawn in order, starting with png number
+        first_fnumber.
+        """
+        self._tile_fnames = {
+            tile_i: midani_av.png_path(self.settings, first_fnumber + i)
+            for i, tile_i in enumerate(self.tiles)
+        }
+
+    def composite(self, store=None) -> bool:
+        """Crops each frame from the tiles and composites its overlay (the png
+        with the same number) onto it, replacing the overlay. Then removes the
+        tiles.
+
+        If store (a midani_frame_store.FrameStore) is passed, the frames are
+        written to it instead, and the overlays are removed.
+
+        Returns False if any png couldn't be read.
+        """
+        success = True
+        tile_cache = collections.OrderedDict()
+
+        def _get_tile(tile_i):
+            if tile_i in tile_cache:
+                tile_cache.move_to_end(tile_i)
+                return tile_cache[tile_i]
+            tile = cv2.imread(  # pylint: disable=no-member
+                self._tile_fnames[tile_i],
+                cv2.IMREAD_COLOR,  # pylint: disable=no-member
+            )
+            if tile is None:
+                raise OSError(f"couldn't read {self._tile_fnames[tile_i]}")
+            tile_cache[tile_i] = tile
+            if len(tile_cache) > TILE_CACHE_SIZE:
+                tile_cache.popitem(last=False)
+            return tile
+
+        print(f"Compositing {len(self.frame_x_starts)} frames")
+        for frame_i, x_start in enumerate(self.frame_x_starts):
+            png_fname = midani_av.png_path(self.settings, frame_i + 1)
+            try:
+                frame = np.concatenate(
+                    [
+                        _get_tile(tile_i)[:, start:end]
+                        for tile_i, start, end in self._tile_slices(x_start)
+                    ],
+                    axis=1,
+                )
+            except OSError as exc:
+                print(f"Error: {exc}")
+                success = False
+                continue
+            overlay = cv2.imread(  # pylint: disable=no-member
+                png_fname, cv2.IMREAD_UNCHANGED  # pylint: disable=no-member
+            )
+            if overlay is None:
+                print(f"Error: couldn't read {png_fname}")
+                success = False
+                continue
+            if overlay.ndim != 3 or overlay.shape[2] != 4:
+                print(f"Error: overlay {png_fname} has no alpha channel")
+                success = False
+                continue
+            alpha = overlay[:, :, 3:]
+            if alpha.all():
+                # It would hide the notes
+                print(f"Error: overlay {png_fname} has no transparent pixels")
+                success = False
+                continue
+            if alpha.any():
+                alpha = alpha.astype(np.uint16)
+                frame = (
+                    (frame * (255 - alpha) + overlay[:, :, :3] * alpha + 127)
+                    // 255
+                ).astype(np.uint8)
+            if store is not None:
+                store[frame_i][...] = frame
+                os.remove(png_fname)
+            else:
+                cv2.imwrite(  # pylint: disable=no-member
+                    png_fname, frame, midani_av.png_write_params(self.settings)
+                )
+        for tile_fname in self._tile_fnames.values():
+            try:
+                os.remove(tile_fname)
+            except OSError:
+                pass
+        return success
@@ -1,57 +1,127 @@
 """Provides TempoChanges class.
 """
 
-import midani.from_my_other_projects.mal_misc as mal_misc
+import numpy as np
+
 import midani.from_my_other_projects.note_classes as note_classes
 
+# The tempo that applies, according to the midi standard, when a file has no
+# tempo changes
+DEFAULT_TEMPO = 120.0
+
 
 class TempoChanges:
-    """Uses tempo changes from Score to convert between beats and clock times."""
+    """Uses tempo changes from Score to convert between beats and clock times.
+
+    The breakpoints of the tempo map are kept in NumPy arrays so that whole
+    arrays of times can be converted at once with ctimes_from_btimes() and
+    btimes_from_ctimes(). The scalar methods ctime_from_btime() and
+    btime_from_ctime() are wrappers around these.
+
+    Score times are in ticks (see Score.ticks_per_beat), and can be converted
+    directly with ctimes_from_ticks() and ticks_from_ctimes() and their
+    scalar wrappers.
+    """
 
     def __init__(self, score: note_classes.Score):
+        self.ticks_per_beat = score.ticks_per_beat
         self.t_changes_btimes = {
-            beat: tempo
-            for (tempo, beat) in score.get_tempo_changes_from_meta_messages()
+            tick / self.ticks_per_beat: tempo
+            for (tempo, tick) in sorted(
+                score.get_tempo_changes_from_meta_messages(),
+                key=lambda x: x[1],
+            )
         }
+        if not self.t_changes_btimes:
+            self.t_changes_btimes[0.0] = DEFAULT_TEMPO
         self.beat_times = list(self.t_changes_btimes.keys())
-        self.t_changes_ctimes = {}
-        self.beat_time_to_clock_time = {}
-        self.clock_time_to_beat_time = {}
-        clock_time = 0
-        prev_beat = 0
-        for new_beat in self.beat_times:
-            if new_beat == 0:
-                pass
-            else:
-                clock_time += (
-                    (new_beat - prev_beat)
-                    * 60
-                    / self.t_changes_btimes[prev_beat]
-                )
-            self.t_changes_ctimes[clock_time] = self.t_changes_btimes[new_beat]
-            self.beat_time_to_clock_time[new_beat] = clock_time
-            self.clock_time_to_beat_time[clock_time] = new_beat
-            prev_beat = new_beat
-        self.clock_times = list(self.t_changes_ctimes.keys())
+        self._beat_array = np.array(self.beat_times, dtype=float)
+        self._tempo_array = np.array(
+            list(self.t_changes_btimes.values()), dtype=float
+        )
+        self._sixties = np.full_like(self._tempo_array, 60)
+        self._tick_array = self._beat_array * self.ticks_per_beat
+        self._tick_tempo_array = self._tempo_array * self.ticks_per_beat
+        # Clock time of each tempo change is the clock time of the previous
+        # one plus the length of the intervening beats at the previous tempo.
+        # (If the first tempo change is not at beat 0, its tempo is taken to
+        # apply from beat 0.)
+        self._clock_array = np.cumsum(
+            np.diff(self._beat_array, prepend=0.0)
+            * 60
+            / np.concatenate((self._tempo_array[:1], self._tempo_array[:-1]))
+        )
+        self.clock_times = self._clock_array.tolist()
+        self.t_changes_ctimes = dict(
+            zip(self.clock_times, self.t_changes_btimes.values())
+        )
+        self.beat_time_to_clock_time = dict(
+            zip(self.beat_times, self.clock_times)
+        )
+        self.clock_time_to_beat_time = dict(
+            zip(self.clock_times, self.beat_times)
+        )
+
+    @staticmethod
+    def _convert(times, from_array, to_array, numerators, denominators):
+        times = np.asarray(times, dtype=float)
+        # Index of the last tempo change at or before each time (or of the
+        # first tempo change, for times before it)
+        i = np.searchsorted(from_array, times, side="right") - 1
+        i = np.maximum(i, 0)
+        return (
+            to_array[i]
+            + (times - from_array[i]) * numerators[i] / denominators[i]
+        )
+
+    def ctimes_from_btimes(self, beat_times):
+        """Converts an array of beat times to an array of clock times."""
+        return self._convert(
+            beat_times,
+            self._beat_array,
+            self._clock_array,
+            self._sixties,
+            self._tempo_array,
+        )
+
+    def btimes_from_ctimes(self, clock_times):
+        """Converts an array of clock times to an array of beat times."""
+        return self._convert(
+            clock_times,
+            self._clock_array,
+            self._beat_array,
+            self._tempo_array,
+            self._sixties,
+        )
 
     def ctime_from_btime(self, beat_time):
-        tempo_btime = self.beat_times[
-            mal_misc.binary_search(
-                self.beat_times, beat_time, not_found="force_lower"
-            )
-        ]
-        tempo = self.t_changes_btimes[tempo_btime]
-        tempo_start = self.beat_time_to_clock_time[tempo_btime]
-        beat_delta = beat_time - tempo_btime
-        return tempo_start + beat_delta * 60 / tempo
+        return float(self.ctimes_from_btimes(beat_time))
 
     def btime_from_ctime(self, clock_time):
-        tempo_ctime = self.clock_times[
-            mal_misc.binary_search(
-                self.clock_times, clock_time, not_found="force_lower"
-            )
-        ]
-        tempo = self.t_changes_ctimes[tempo_ctime]
-        tempo_start = self.clock_time_to_beat_time[tempo_ctime]
-        clock_delta = clock_time - tempo_ctime
-        return tempo_start + clock_delta * tempo / 60
+        return float(self.btimes_from_ctimes(clock_time))
+
+    def ctimes_from_ticks(self, ticks):
+        """Converts an array of tick times to an array of clock times."""
+        return self._convert(
+            ticks,
+            self._tick_array,
+            self._clock_array,
+            self._sixties,
+            self._tick_tempo_array,
+        )
+
+    def ticks_from_ctimes(self, clock_times):
+        """Converts an array of clock times to an array of tick times."""
+        return self._convert(
+            clock_times,
+            self._clock_array,
+            self._tick_array,
+            self._tick_tempo_array,
+            self._sixties,
+        )
+
+    def ctime_from_tick(self, tick):
+        return float(self.ctimes_from_ticks(tick))
+
+    def tick_from_ctime(self, clock_time):
+        return float(self.ticks_from_ctimes(clock_time))
@@ -11,6 +11,7 @@ class MultiBoss:
     def __init__(self, settings):
         self.rboss = RBoss(settings)
         self.plot_boss = MPLBoss(settings)
+        self.rect_edge_width = self.plot_boss.rect_edge_width
 
     @contextlib.contextmanager
     def make_png(self, *args):
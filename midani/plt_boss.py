@@ -1,16 +1,31 @@
 import contextlib
-import typing as t
 
 import matplotlib
 import matplotlib.lines as lines
 import matplotlib.patches as patches
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 import numpy as np
 
+from . import midani_colors
+
 
 class MPLBoss:
-    def __init__(self, settings):
+    """Plots frames with matplotlib.
+
+    By default, each frame is saved as a png. If frame_sink is passed, each
+    frame is instead rasterized in memory, and frame_sink is called with it
+    (as a uint8 array of shape (height, width, 4), in RGBA order, that is only
+    valid during the call).
+    """
+
+    def __init__(self, settings, frame_sink=None):
+        self.frame_sink = frame_sink
+        self._pil_kwargs = None
+        if settings.png_compression is not None:
+            self._pil_kwargs = {"compress_level": settings.png_compression}
         self.outf_dirname = settings._temp_r_dirname
         self.png_dirname = settings.output_dirname
         self.png_fname_base = (
@@ -24,13 +39,21 @@ class MPLBoss:
         # dpi more or less chosen arbitrarily; I'm not sure how important this
         # value is. Its purpose is to scale width and height (because mpl
         # understands these in terms of inches and dpi, rather than pixels.)
-        # The actually realized size in pixels seems to be slightly smaller
-        # than one would expect---e.g., I'm asking for 1280x720 and getting
-        # 1270x710. I'm not sure what to do about this.
+        # The axes fill the whole figure (see init_png()), so that the png is
+        # exactly out_width x out_height pixels and a unit along the x axis is
+        # a pixel when settings.pixel_geometry is True. (Previously,
+        # tight_layout() left a margin, and asking for 1280x720 gave a plot
+        # of 1270x710.)
         self._dpi = 96
 
         self.out_width = settings.out_width / self._dpi
         self.out_height = settings.out_height / self._dpi
+        # Rects are drawn with an edge (of the default patch linewidth, in
+        # points), so that even a rect with no area is visible (see
+        # midani_misc_classes.PrimitiveBuckets)
+        self.rect_edge_width = (
+            matplotlib.rcParams["patch.linewidth"] * self._dpi / 72
+        )
 
     @contextlib.contextmanager
     def make_png(self, window):
@@ -41,40 +64,53 @@ class MPLBoss:
             self.close_png(window)
 
     def init_png(self, window):
-        print(f"Writing frame {self.plot_count} \r", end="")
-
         assert self._ax is None
-        self._fig, self._ax = plt.subplots(
-            figsize=(self.out_width, self.out_height), dpi=self._dpi
-        )
-        plt.axis("off")
-
-        self._ax.set_xlim(window.start, window.end)
+        if self.frame_sink is not None:
+            # Not pyplot, which keeps track of figures globally, so that
+            # frames can be rendered in forked processes
+            self._fig = Figure(
+                figsize=(self.out_width, self.out_height), dpi=self._dpi
+            )
+            FigureCanvasAgg(self._fig)
+        else:
+            print(f"Writing frame {self.plot_count} \r", end="")
+            self._fig = plt.figure(
+                figsize=(self.out_width, self.out_height), dpi=self._dpi
+            )
+        self._ax = self._fig.add_axes((0, 0, 1, 1))
+        self._ax.axis("off")
+
+        self._ax.set_xlim(window.x_start, window.x_end)
         self._ax.set_ylim(window.bottom, window.top)
 
     def close_png(self, window):
+        if self.frame_sink is not None:
+            self._fig.set_facecolor(self.hex_color(window.bg_color))
+            self._fig.canvas.draw()
+            self.frame_sink(np.asarray(self._fig.canvas.buffer_rgba()))
+            self._fig = self._ax = None
+            self.plot_count += 1
+            return
         png_fname = self.png_fname_base.format(png_fnumber=self.plot_count + 1)
-        self._fig.tight_layout()
         # Infuriatingly, savefig overrides any value of facecolor set
         # previously
         self._fig.savefig(
             png_fname,
             dpi="figure",
             facecolor=self.hex_color(window.bg_color),
+            pil_kwargs=self._pil_kwargs,
         )
         plt.close(self._fig)
         self._fig = self._ax = None
         self.plot_count += 1
 
-    @staticmethod
-    def hex_color(color: t.Tuple[int, int, int, int]):
-        # Will raise a ValueError if color has floats (rather than ints)
-        return f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}{color[3]:02x}"
+    # Accepts tuples or packed colors, and formats each color only once
+    hex_color = staticmethod(midani_colors.hex_color)
 
     def now_line(self, now, window, color, width, zorder):
-        # TODO implement color, width, zorder
-        line = lines.Line2D([now, now], [window.bottom, window.top], zorder=30)
-        self._ax.add_line(line)
+        self.plot_line(
+            now, now, window.bottom, window.top, color, width, zorder
+        )
 
     def plot_rect(self, x1, x2, y1, y2, color, zorder):
         rect = patches.Polygon(
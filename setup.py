@@ -30,6 +30,6 @@ setuptools.setup(
     package_dir={"": "."},
     packages=setuptools.find_packages(where="."),
     python_requires=">=3.8",
-    install_requires=["opencv_python", "mido"],
+    install_requires=["opencv_python", "mido", "numpy"],
     entry_points={"console_scripts": ["midani = midani.__main__:main"]},
 )
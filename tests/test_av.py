@@ -3,8 +3,14 @@
 import dataclasses
 import os
 import shutil
+import typing
+
+import cv2
+import numpy as np
 
 from midani import midani_av
+from midani import midani_frame_store
+from midani import midani_settings
 
 SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
 OUT_PATH = os.path.join(SCRIPT_PATH, "test_out")
@@ -22,6 +28,11 @@ class DummySettings:  # pylint: disable=missing-class-docstring
     intro: float = 0.0
     audio_fname: str = os.path.join(SCRIPT_PATH, "test_audio/effrhy_732.mp3")
     audio_offset: float = 0.0
+    video_decoder_threads: typing.Optional[int] = None
+    video_encoder_processes: typing.Optional[int] = None
+    frame_format: str = "png"
+    frame_store_fname: str = os.path.join(OUT_PATH, "test_video.frames")
+    png_compression: typing.Optional[int] = None
 
 
 def test_video():
@@ -35,6 +46,156 @@ def test_video():
     print(f"test_video() output is in {settings.video_fname}")
 
 
+def test_png_reader():
+    settings = DummySettings(video_decoder_threads=3)
+    with midani_av.PngReader(settings) as reader:
+        frames = list(reader.read(2, 30))
+    assert [i for i, _ in frames] == list(
+        range(2, 31)
+    ), "frames not read in order"
+    for i, frame in frames:
+        expected = cv2.imread(  # pylint: disable=no-member
+            midani_av.png_path(settings, i)
+        )
+        assert np.array_equal(frame, expected), f"frame {i} differs"
+
+
+def test_segment_bounds():
+    for n, n_segments in ((31, 1), (31, 4), (300, 7), (8, 8)):
+        # pylint: disable=protected-access
+        bounds = midani_av._segment_bounds(n, n_segments)
+        assert len(bounds) == n_segments, "wrong number of segments"
+        assert [first for first, _ in bounds] == [1] + [
+            last + 1 for _, last in bounds[:-1]
+        ], "segments aren't contiguous"
+        assert bounds[-1][1] == n, "segments don't end at frame n"
+        lens = [last - first + 1 for first, last in bounds]
+        assert max(lens) - min(lens) <= 1, "segments are unequal"
+
+
+def test_process_segments():
+    if not shutil.which("ffmpeg"):
+        # The segments are joined with ffmpeg
+        print("ffmpeg not found, skipping test_process_segments()")
+        return
+    if not os.path.exists(OUT_PATH):
+        os.makedirs(OUT_PATH)
+    settings = DummySettings(
+        video_fname=os.path.join(OUT_PATH, "test_segments.mp4")
+    )
+    if os.path.exists(settings.video_fname):
+        os.remove(settings.video_fname)
+    # pylint: disable=protected-access
+    assert midani_av._process_segments(
+        settings, 31, 3
+    ), "_process_segments() failed"
+    cap = cv2.VideoCapture(settings.video_fname)  # pylint: disable=no-member
+    n_frames = 0
+    while cap.read()[0]:
+        n_frames += 1
+    cap.release()
+    assert n_frames == 31, "wrong number of frames"
+    # The segments are encoded in a temporary directory next to the video
+    assert not any(
+        fname.startswith("tmp") for fname in os.listdir(OUT_PATH)
+    ), "segments not cleaned up"
+
+
+def test_frame_store():
+    if not os.path.exists(OUT_PATH):
+        os.makedirs(OUT_PATH)
+    settings = DummySettings(
+        frame_format="raw",
+        video_fname=os.path.join(OUT_PATH, "test_frame_store.mp4"),
+        clean_up_png_files=True,
+    )
+    frames = [
+        cv2.imread(midani_av.png_path(settings, i))  # pylint: disable=no-member
+        for i in range(1, 32)
+    ]
+    with midani_frame_store.FrameStore.create(
+        settings.frame_store_fname, len(frames), *frames[0].shape[:2]
+    ) as store:
+        for i, frame in enumerate(frames):
+            store[i][...] = frame
+    with midani_frame_store.FrameStore.open(
+        settings.frame_store_fname
+    ) as store:
+        assert len(store) == len(frames), "wrong number of frames"
+        for frame, stored in zip(frames, store):
+            assert np.array_equal(frame, stored), "stored frame differs"
+    midani_av.process_video(settings, len(frames))
+    assert os.path.exists(settings.video_fname), "video not written"
+    assert not os.path.exists(
+        settings.frame_store_fname
+    ), "frame store not removed"
+
+
+def test_check_shards():
+    # pylint: disable=protected-access
+    assert midani_av._check_shards(
+        ["a.000010-end.mp4", "a.000000-000005.mp4", "a.000005-000010.mp4"]
+    ) == [
+        "a.000000-000005.mp4",
+        "a.000005-000010.mp4",
+        "a.000010-end.mp4",
+    ], "shards not sorted"
+    for shard_fnames in (
+        ["a.mp4"],
+        ["a.000000-000005.mp4", "a.000006-end.mp4"],
+        ["a.000000-000005.mp4", "a.000004-end.mp4"],
+        ["a.000000-end.mp4", "a.000005-end.mp4"],
+        ["a.000000-000005.frames", "a.000005-end.mp4"],
+        # The start or end of the video is missing
+        ["a.000005-000010.mp4", "a.000010-end.mp4"],
+        ["a.000000-000005.mp4", "a.000005-000010.mp4"],
+    ):
+        try:
+            midani_av._check_shards(shard_fnames)
+        except ValueError:
+            pass
+        else:
+            assert False, f"{shard_fnames} shouldn't be mergeable"
+
+
+def test_merge_shards():
+    if not os.path.exists(OUT_PATH):
+        os.makedirs(OUT_PATH)
+    settings = DummySettings(
+        video_fname=os.path.join(OUT_PATH, "test_merge_shards.mp4")
+    )
+    frames = [
+        cv2.imread(midani_av.png_path(settings, i))  # pylint: disable=no-member
+        for i in range(1, 32)
+    ]
+    shard_fnames = []
+    for start, end in ((0, 10), (10, None)):
+        shard_fname = os.path.join(
+            OUT_PATH,
+            "test_merge_shards"
+            + midani_settings.shard_suffix((start, end))
+            + midani_settings.FRAME_STORE_EXT,
+        )
+        shard_frames = frames[start:end]
+        with midani_frame_store.FrameStore.create(
+            shard_fname, len(shard_frames), *frames[0].shape[:2]
+        ) as store:
+            for i, frame in enumerate(shard_frames):
+                store[i][...] = frame
+        shard_fnames.append(shard_fname)
+    if os.path.exists(settings.video_fname):
+        os.remove(settings.video_fname)
+    assert midani_av.merge_shards(
+        settings, shard_fnames[::-1]
+    ), "merge_shards() failed"
+    cap = cv2.VideoCapture(settings.video_fname)  # pylint: disable=no-member
+    n_frames = 0
+    while cap.read()[0]:
+        n_frames += 1
+    cap.release()
+    assert n_frames == len(frames), "wrong number of frames"
+
+
 def test_audio():
     print("Running test_audio()")
     if not os.path.exists(OUT_PATH):
@@ -55,5 +216,17 @@ if __name__ == "__main__":
     print("=" * os.get_terminal_size().columns)
     test_video()
     print("=" * os.get_terminal_size().columns)
+    test_png_reader()
+    print("=" * os.get_terminal_size().columns)
+    test_segment_bounds()
+    print("=" * os.get_terminal_size().columns)
+    test_process_segments()
+    print("=" * os.get_terminal_size().columns)
+    test_frame_store()
+    print("=" * os.get_terminal_size().columns)
+    test_check_shards()
+    print("=" * os.get_terminal_size().columns)
+    test_merge_shards()
+    print("=" * os.get_terminal_size().columns)
     test_audio()
     print("=" * os.get_terminal_size().columns)
@@ -0,0 +1,115 @@
+"""Tests the on-disk score cache in midani_cache.
+"""
+import glob
+import os
+import shutil
+
+import numpy as np
+
+from midani import midani_cache
+from midani import midani_score
+from midani import midani_settings
+from midani import midani_smf
+
+SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
+SAMPLE_MUSIC_DIR = os.path.join(SCRIPT_PATH, "..", "sample_music")
+SAMPLE_PATHS = sorted(glob.glob(os.path.join(SAMPLE_MUSIC_DIR, "*.mid")))
+CACHE_DIR = os.path.join(SCRIPT_PATH, "test_out", "cache")
+
+
+def _clear_cache_dir():
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+
+
+def _voices(score):
+    return [
+        (voice.voice_i, [tuple(note) for note in voice])
+        for voice in score.voices
+    ]
+
+
+def test_store_and_load():
+    _clear_cache_dir()
+    cache = midani_cache.ScoreCache(CACHE_DIR)
+    for i, path in enumerate(SAMPLE_PATHS):
+        score = midani_smf.read_smf(path, columnar=True, first_note_at_0=True)
+        if i == 0:
+            score.set_dur(score.ticks_per_beat / 2)
+        key = midani_cache.cache_key([path], path=path)
+        assert cache.load(key) is None, "cache.load(key) is not None"
+        cache.store(key, score)
+        cached = cache.load(key)
+        assert _voices(cached) == _voices(score), "cached notes differ"
+        assert (
+            cached.get_tempo_changes_from_meta_messages()
+            == score.get_tempo_changes_from_meta_messages()
+        ), "cached tempo changes differ"
+        for attr in ("num_voices", "ticks_per_beat", "attacks_adjusted_by"):
+            assert getattr(cached, attr) == getattr(
+                score, attr
+            ), f"cached.{attr} != score.{attr}"
+        # The notes are memory-mapped from the cache
+        assert all(
+            isinstance(voice.attack.base, np.memmap) for voice in cached.voices
+        ), "cached notes are not memory-mapped"
+
+
+def test_cache_key():
+    path1, path2 = SAMPLE_PATHS[:2]
+    key = midani_cache.cache_key([path1], tet=12)
+    assert key == midani_cache.cache_key(
+        [path1], tet=12
+    ), "cache_key() is not deterministic"
+    for other_key in (
+        midani_cache.cache_key([path1], tet=31),
+        midani_cache.cache_key([path2], tet=12),
+        midani_cache.cache_key([path1, path2], tet=12),
+    ):
+        assert key != other_key, "key == other_key"
+
+
+def test_eviction():
+    _clear_cache_dir()
+    score = midani_smf.read_smf(SAMPLE_PATHS[0], columnar=True)
+    cache = midani_cache.ScoreCache(CACHE_DIR)
+    cache.store("a", score)
+    entry_size = sum(entry[1] for entry in cache._entries())
+    # Room for two entries
+    cache.max_bytes = 2 * entry_size
+    cache.store("b", score)
+    # Make "a" the most recently used
+    os.utime(os.path.join(CACHE_DIR, "b", midani_cache.SCORE_FNAME), ns=(0, 0))
+    cache.load("a")
+    cache.store("c", score)
+    assert cache.load("a") is not None, "cache.load('a') is None"
+    assert cache.load("b") is None, "cache.load('b') is not None"
+    assert cache.load("c") is not None, "cache.load('c') is None"
+
+
+def test_read_score():
+    _clear_cache_dir()
+    settings_kwargs = {
+        "midi_fname": SAMPLE_PATHS[0],
+        "midi_cache": True,
+        "midi_cache_dir": CACHE_DIR,
+    }
+    score = midani_score.read_score(midani_settings.Settings(**settings_kwargs))
+    assert len(os.listdir(CACHE_DIR)) == 1, "len(os.listdir(CACHE_DIR)) != 1"
+    cached = midani_score.read_score(
+        midani_settings.Settings(**settings_kwargs)
+    )
+    assert _voices(cached) == _voices(score), "cached notes differ"
+    midani_score.read_score(
+        midani_settings.Settings(
+            midi_channels_to_voices=True, **settings_kwargs
+        )
+    )
+    assert len(os.listdir(CACHE_DIR)) == 2, "len(os.listdir(CACHE_DIR)) != 2"
+
+
+if __name__ == "__main__":
+    test_store_and_load()
+    test_cache_key()
+    test_eviction()
+    test_read_score()
@@ -1,9 +1,12 @@
 """Tests for classes from midani_misc_classes.
 """
+import math
 import os
+import random
 
 
 from midani import midani_misc_classes
+from midani import midani_settings
 
 
 def test_flutter():
@@ -34,7 +37,100 @@ def test_flutter():
         )
 
 
+def test_flutter_memo():
+    random.seed(0)
+    flutter = midani_misc_classes.PitchFlutter(
+        max_flutter_size=4,
+        min_flutter_size=1,
+        max_flutter_period=3,
+        min_flutter_period=3,
+    )
+    for now in (0, 0, 0.5, 0.5, 0.25, 0):
+        expected = (
+            math.sin((now + flutter.flutter_offset) * flutter.flutter_sin_factor)
+            * flutter.flutter_size
+        )
+        assert flutter(now) == expected, f"flutter({now}) != {expected}"
+
+
+def test_lookup_table():
+    max_error = 1e-6
+    funcs = (
+        lambda x: x,
+        lambda x: x**2,
+        lambda x: math.sin(x * math.pi / 2),
+        lambda x: 1 - math.sqrt(1 - x),
+    )
+    for func in funcs:
+        table = midani_misc_classes.LookupTable(func, 0, 1, max_error)
+        for i in range(1001):
+            x = i / 1000
+            assert abs(func(x) - table(x)) <= max_error, (
+                f"abs(func({x}) - table({x})) > {max_error}"
+            )
+    # A discontinuous function can't be tabulated within the error bound so
+    # it should be evaluated directly
+    step = lambda x: 0 if x < 0.3 else 1
+    table = midani_misc_classes.LookupTable(step, 0, 1, max_error)
+    assert not table.tabulated, "table.tabulated"
+    assert table(0.29) == 0 and table(0.31) == 1, "table(0.29) != 0 or ..."
+    # Outside the domain, the function is called directly
+    table = midani_misc_classes.LookupTable(funcs[1], 0, 1, max_error)
+    assert table(2) == 4, "table(2) != 4"
+
+
+def test_channel_layout():
+    settings = midani_settings.Settings(
+        midi_fname=os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            "..",
+            "sample_music",
+            "effrhy_732.mid",
+        ),
+        num_channels=2,
+    )
+    for channel_i in range(2):
+        channel = midani_misc_classes.Channel(channel_i, settings)
+        channel.update_from_pitch(40)
+        channel.update_from_pitch(79)
+
+        def _y_position(pitch):
+            # The formula that the tables are computed from
+            return (
+                round(
+                    (
+                        (pitch - channel.l_pitch)
+                        / channel.pitch_range
+                        * channel.non_padding
+                        + channel.l_padding
+                    )
+                    * channel.height
+                )
+                + channel.offset
+            )
+
+        for i in range(35 * 16 + 1):
+            pitch = 38 + i / 16
+            assert channel.y_position(pitch) == _y_position(
+                pitch
+            ), f"channel.y_position({pitch}) != _y_position({pitch})"
+        unit = _y_position(41) - _y_position(40)
+        for i in range(100):
+            height = i / 25
+            assert channel.pixel_height(height) == round(
+                unit * height
+            ), f"channel.pixel_height({height}) != round(unit * {height})"
+        # The tables are updated when the range changes
+        channel.update_from_pitch(90)
+        assert channel.y_position(79) == _y_position(
+            79
+        ), "channel.y_position(79) != _y_position(79)"
+
+
 if __name__ == "__main__":
     print("=" * os.get_terminal_size().columns)
     test_flutter()
+    test_flutter_memo()
+    test_lookup_table()
+    test_channel_layout()
     print("=" * os.get_terminal_size().columns)
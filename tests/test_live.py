@@ -0,0 +1,121 @@
+"""Tests real-time playback with midani_live, with a simulated clock.
+"""
+import os
+import urllib.request
+
+import cv2
+import numpy as np
+
+from midani import midani_live
+from midani import midani_settings
+
+SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
+OUT_PATH = os.path.join(SCRIPT_PATH, "test_out/live")
+
+N_FRAMES = 12
+
+
+class FakeClock:
+    """A clock that advances by `step` seconds whenever it is read, as if
+    each step of rendering took that long, and by the time slept.
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.time = 0.0
+        self.slept = 0.0
+
+    def __call__(self):
+        self.time += self.step
+        return self.time
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.time += seconds
+
+
+def _play(step, **kwargs):
+    settings = midani_settings.Settings(
+        midi_fname=os.path.join(
+            SCRIPT_PATH, "..", "sample_music", "effrhy_732.mid"
+        ),
+        output_dirname=OUT_PATH,
+        midi_cache=False,
+        frame_range=(0, N_FRAMES),
+        **kwargs,
+    )
+    clock = FakeClock(step)
+    shown = []
+    player = midani_live.Player(
+        settings,
+        lambda frame: shown.append(frame.shape),
+        clock=clock,
+        sleep=clock.sleep,
+    )
+    stats = player.play()
+    return settings, clock, shown, stats
+
+
+def test_player():
+    # Rendering is much faster than real time
+    settings, clock, shown, stats = _play(0.0001)
+    assert stats.shown == N_FRAMES == len(shown), "frames not shown"
+    assert not stats.skipped and not stats.missed, "frames missed"
+    assert not stats.degradations, "quality lowered"
+    assert shown[0] == (
+        settings.out_height,
+        settings.out_width,
+        3,
+    ), "wrong frame shape"
+    assert clock.slept > 0, "frames shown before they were due"
+
+    # Rendering is much slower than real time
+    settings, clock, shown, stats = _play(
+        0.02,
+        frame_increment=1 / 30,
+        shadow_positions=[(3, -3), (6, -6)],
+        live_degrade_misses=2,
+    )
+    assert stats.shown + stats.skipped == N_FRAMES, "frames lost"
+    assert stats.skipped and stats.missed, "frames not missed"
+    assert stats.degradations == [
+        "reduced shadows from 2 to 1",
+        "reduced shadows from 1 to 0",
+        "turned off flutter",
+    ], "quality not lowered"
+    assert all(
+        settings[voice_i].max_flutter_size == 0
+        for voice_i in settings.voice_order
+    ), "flutter not turned off"
+    assert not clock.slept, "waited although behind"
+
+
+def test_mjpeg_server():
+    frame = np.zeros((24, 32, 3), dtype=np.uint8)
+    frame[:, 16:] = 255
+    with midani_live.MJPEGServer(0) as server:
+        with urllib.request.urlopen(server.url, timeout=10) as response:
+            assert response.headers.get_content_type() == (
+                "multipart/x-mixed-replace"
+            ), "wrong content type"
+            server(frame)
+            assert response.readline() == b"--frame\r\n", "no boundary"
+            headers = {}
+            while line := response.readline().strip():
+                name, value = line.decode().split(": ")
+                headers[name] = value
+            assert headers["Content-Type"] == "image/jpeg", "not a jpeg"
+            jpeg = response.read(int(headers["Content-Length"]))
+    decoded = cv2.imdecode(  # pylint: disable=no-member
+        np.frombuffer(jpeg, dtype=np.uint8),
+        cv2.IMREAD_COLOR,  # pylint: disable=no-member
+    )
+    assert decoded.shape == frame.shape, "wrong frame shape"
+    assert (
+        np.abs(decoded.astype(int) - frame).mean() < 8
+    ), "frame decoded wrongly"
+
+
+if __name__ == "__main__":
+    test_player()
+    test_mjpeg_server()
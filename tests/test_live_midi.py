@@ -0,0 +1,194 @@
+"""Tests adding notes to a PitchTable as they arrive, and playing midi input
+in real time with midani_live_midi, with a simulated clock.
+"""
+import os
+import tempfile
+import threading
+import time
+
+import mido
+
+from midani import midani_live_midi
+from midani import midani_misc_classes
+from midani import midani_notes
+from midani import midani_settings
+from midani import midani_time
+
+from test_live import FakeClock
+
+SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
+OUT_PATH = os.path.join(SCRIPT_PATH, "test_out/live_midi")
+
+
+def _settings(**kwargs):
+    return midani_settings.Settings(
+        midi_live_input="-",
+        output_dirname=OUT_PATH,
+        frame_len=1,
+        frame_increment=0.1,
+        **kwargs,
+    )
+
+
+def test_incremental_table():
+    settings = _settings()
+    score = midani_notes.ColumnarScore()
+    score.add_voice()
+    tempo_changes = midani_time.TempoChanges(score)
+    settings.update_from_score(score, tempo_changes)
+    table = midani_misc_classes.PitchTable(score, settings, tempo_changes)
+    channel = table.channels[0]
+    assert channel.l_pitch is None, "empty channel has a range"
+
+    note = table.add_note(0, 60, 0.0)
+    assert (channel.l_pitch, channel.h_pitch) == (60, 60), "range not set"
+    table.extend_open_notes(0.5)
+    assert note.end == 0.5 and note.mid == 0.25, "open note not extended"
+    table.close_note(note, 0.75)
+    table.extend_open_notes(1.0)
+    assert note.end == 0.75 and note.dur == 0.75, "closed note extended"
+
+    unit_height = channel.pixel_height(1)
+    table.add_note(0, 48, 1.0, 1.5)
+    table.add_note(0, 72, 2.0, 2.5)
+    assert (channel.l_pitch, channel.h_pitch) == (48, 72), "range not grown"
+    assert (table.l_pitch, table.h_pitch) == (48, 72), "range not grown"
+    assert channel.pixel_height(1) < unit_height, "layout not updated"
+    assert set(table.pitch_flutters[0]) == set(
+        range(48, 73)
+    ), "flutter not added"
+
+    # The first two notes are long gone, but connection lines are drawn
+    # from the second
+    table.drop_past_notes(100.0)
+    assert [note.pitch for note in table[0]] == [72], "notes not dropped"
+    assert table[0].first_note_i == 2, "dropped notes not counted"
+    table.add_note(0, 60, 101.0)
+    table.drop_past_notes(200.0)
+    assert [note.pitch for note in table[0]] == [
+        72,
+        60,
+    ], "open note dropped"
+
+
+class FakeMidiInput:
+    """Returns each message once the clock has reached the time at which it
+    arrives, and closes at close_time.
+    """
+
+    def __init__(self, clock, messages, close_time):
+        self.clock = clock
+        self.messages = list(messages)
+        self.close_time = close_time
+
+    @property
+    def closed(self):
+        return self.clock.time >= self.close_time
+
+    def poll(self):
+        out = [item for item in self.messages if item[0] <= self.clock.time]
+        self.messages = self.messages[len(out) :]
+        return out
+
+
+def test_live_midi_player():
+    settings = _settings(intro=0, outro=0.5, frame_position=0.9)
+    clock = FakeClock(0.0001)
+    midi_input = FakeMidiInput(
+        clock,
+        [
+            (0.2, mido.Message("note_on", note=60, velocity=64)),
+            (0.5, mido.Message("note_off", note=60)),
+            (0.6, mido.Message("note_on", note=67, velocity=64)),
+            # A note_on with velocity 0 is a note_off
+            (0.9, mido.Message("note_on", note=67, velocity=0)),
+            (1.0, mido.Message("note_on", note=64, velocity=64)),
+        ],
+        close_time=1.5,
+    )
+    shown = []
+    player = midani_live_midi.LiveMidiPlayer(
+        settings,
+        lambda frame: shown.append(frame.shape),
+        midi_input,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+    stats = player.play()
+    assert not stats.missed and not stats.skipped, "frames missed"
+    # Playback stops outro seconds after the frame at which the input was
+    # found to have closed
+    assert 20 <= stats.shown <= 23, "wrong number of frames"
+    notes = [
+        (note.pitch, round(note.start, 1), round(note.end, 1))
+        for note in player._table[0]  # pylint: disable=protected-access
+    ]
+    # Each message is timed by when it arrived; the note that was never
+    # released is closed when the input closes, and the first note has
+    # scrolled out of the frame
+    assert notes == [(67, 0.6, 0.9), (64, 1.0, 1.6)], "wrong notes"
+    # pylint: disable=protected-access
+    assert player._table[0].first_note_i == 1, "dropped notes not counted"
+
+
+def _read_messages(midi_input, n, timeout=10):
+    messages = []
+    deadline = time.monotonic() + timeout
+    while len(messages) < n and time.monotonic() < deadline:
+        messages.extend(msg for _, msg in midi_input.poll())
+        time.sleep(0.01)
+    return messages
+
+
+def _wait_closed(midi_input, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not midi_input.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return midi_input.closed
+
+
+def test_midi_input():
+    sent = [
+        mido.Message("note_on", note=60, velocity=64),
+        mido.Message("note_off", note=60),
+        mido.Message("note_on", channel=3, note=72, velocity=100),
+    ]
+    data = b"".join(bytes(msg.bytes()) for msg in sent)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # A named pipe is read until the writer closes it
+        fifo = os.path.join(temp_dir, "midi.fifo")
+        os.mkfifo(fifo)
+
+        def _write():
+            with open(fifo, "wb") as outf:
+                # Messages may be split between reads
+                outf.write(data[:4])
+                outf.flush()
+                time.sleep(0.05)
+                outf.write(data[4:])
+
+        writer = threading.Thread(target=_write)
+        writer.start()
+        midi_input = midani_live_midi.MidiInput(fifo)
+        assert _read_messages(midi_input, 3) == sent, "wrong messages"
+        writer.join()
+        assert _wait_closed(midi_input), "input not closed"
+
+        # A regular file is followed from its end
+        fname = os.path.join(temp_dir, "midi.raw")
+        with open(fname, "wb") as outf:
+            outf.write(bytes(mido.Message("note_on", note=1).bytes()))
+        midi_input = midani_live_midi.MidiInput(fname)
+        time.sleep(0.1)
+        with open(fname, "ab") as outf:
+            outf.write(data)
+        assert _read_messages(midi_input, 3) == sent, "wrong messages"
+        assert not midi_input.closed, "followed file closed"
+        midi_input.close()
+        assert _wait_closed(midi_input), "input not closed"
+
+
+if __name__ == "__main__":
+    test_incremental_table()
+    test_live_midi_player()
+    test_midi_input()
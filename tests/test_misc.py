@@ -1,10 +1,21 @@
 """Misc tests for midani
 """
 import os
+import random
 import sys
+import tracemalloc
 
+import cv2
+import numpy as np
+
+from midani import midani_av
+from midani import midani_colors
+from midani import midani_frame_store
+from midani import midani_misc_classes
+from midani import midani_plot
 from midani import midani_score
 from midani import midani_settings
+from midani import midani_strip
 from midani import midani_time
 
 SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
@@ -42,5 +53,467 @@ def test_bg_beat_times():
     ], "settings.bg_clock_times != [i + 0.5 for i in range(33)]"
 
 
+def test_frame_allocations():
+    midi_fname = "../sample_music/effrhy_732.mid"
+    # Colors from a color loop are also read without allocating
+    for kwargs in ({}, {"color_loop": 4}):
+        settings = midani_settings.Settings(
+            midi_fname=os.path.join(SCRIPT_PATH, midi_fname),
+            midi_cache=False,
+            **kwargs,
+        )
+        score = midani_score.read_score(settings)
+        tempo_changes = midani_time.TempoChanges(score)
+        settings.update_from_score(score, tempo_changes)
+        score = midani_score.crop_score(score, settings, tempo_changes)
+        table = midani_misc_classes.PitchTable(score, settings, tempo_changes)
+        nows = [i * 0.5 for i in range(20)]
+        rect_tuples = line_tuples = None
+        # The first pass grows the record lists to the size they need
+        for now in nows:
+            rect_tuples, line_tuples = midani_plot.get_voice_and_line_tuples(
+                now, settings, table, rect_tuples, line_tuples
+            )
+        for now in nows:
+            tracemalloc.start()
+            before, _ = tracemalloc.get_traced_memory()
+            rect_tuples, line_tuples = midani_plot.get_voice_and_line_tuples(
+                now, settings, table, rect_tuples, line_tuples
+            )
+            after, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            num_records = sum(map(len, rect_tuples)) + sum(
+                map(len, line_tuples)
+            )
+            assert num_records > 100, "num_records <= 100"
+            # Constructing a record for each note would take far more than
+            # this
+            assert peak - before < 4096, f"{peak - before} bytes allocated"
+            assert after <= before, f"{after - before} bytes retained"
+
+
+class RecordingBoss:
+    rect_edge_width = 0
+
+    def __init__(self):
+        self.zorders = []
+        self.rects = []
+        self.lines = []
+
+    def plot_rect(self, x1, x2, y1, y2, color, zorder):
+        self.zorders.append(zorder)
+        self.rects.append((x1, x2, y1, y2, color))
+
+    def plot_line(self, x1, x2, y1, y2, color, width, zorder):
+        self.zorders.append(zorder)
+        self.lines.append((x1, x2, y1, y2, color, width))
+
+
+def test_primitive_buckets():
+    midi_fname = "../sample_music/effrhy_732.mid"
+    settings = midani_settings.Settings(
+        midi_fname=os.path.join(SCRIPT_PATH, midi_fname),
+        midi_cache=False,
+        shadow_positions=[(3, -3), (6, -6)],
+        voice_settings={0: {"connection_lines": True}},
+    )
+    score = midani_score.read_score(settings)
+    tempo_changes = midani_time.TempoChanges(score)
+    settings.update_from_score(score, tempo_changes)
+    score = midani_score.crop_score(score, settings, tempo_changes)
+    table = midani_misc_classes.PitchTable(score, settings, tempo_changes)
+    window = midani_misc_classes.Window(settings)
+    buckets = midani_misc_classes.PrimitiveBuckets(settings)
+    boss = RecordingBoss()
+    now = 4.0
+    window.update(now)
+    rect_tuples, _ = midani_plot.get_voice_and_line_tuples(
+        now, settings, table, window=window, buckets=buckets
+    )
+    buckets.flush(boss)
+    # For each shadow, line shadows then note shadows; then lines; then notes
+    runs = [
+        zorder
+        for i, zorder in enumerate(boss.zorders)
+        if not i or zorder != boss.zorders[i - 1]
+    ]
+    assert runs == [1, 5, 1, 5, 10, 15], f"runs == {runs}"
+    assert boss.zorders.count(15) == sum(
+        map(len, rect_tuples)
+    ), "not one note rect per RectTuple"
+    num_primitives = len(boss.zorders)
+    buckets.flush(boss)
+    assert len(boss.zorders) == num_primitives, "buckets not emptied by flush()"
+
+
+def test_packed_colors():
+    random.seed(0)
+    for _ in range(1000):
+        base = tuple(random.randrange(256) for _ in range(4))
+        added = tuple(random.randrange(256) for _ in range(4))
+        blend = random.random()
+        packed = midani_colors.pack_color(base)
+        assert midani_colors.unpack_color(packed) == base, "unpack != base"
+        assert midani_colors.hex_color(packed) == midani_colors.hex_color(
+            base
+        ), "hex_color(packed) != hex_color(base)"
+        blended = midani_colors.unpack_color(
+            midani_colors.blend_packed(
+                packed, midani_colors.pack_color(added), blend
+            )
+        )
+        expected = midani_colors.blend_colors(base, added, blend)
+        # blend_packed() quantizes blend, so may differ by 1
+        assert all(
+            abs(x - y) <= 1 for x, y in zip(blended, expected)
+        ), f"{blended} != {expected}"
+        for exact_blend in (0, 0.5, 1):
+            assert midani_colors.unpack_color(
+                midani_colors.blend_packed(
+                    packed, midani_colors.pack_color(added), exact_blend
+                )
+            ) == midani_colors.blend_colors(
+                base, added, exact_blend
+            ), "blend_packed() != blend_colors()"
+    # 0.3 isn't a multiple of 1 / BLEND_STEPS, but the blend is exact
+    for base, added, expected in ((200, 100, 170), (100, 200, 130)):
+        assert midani_colors.unpack_color(
+            midani_colors.blend_packed(
+                midani_colors.pack_color((base, base, base, base)),
+                midani_colors.pack_color((added, added, added, added)),
+                0.3,
+            )
+        ) == (expected,) * 4, f"{base} blended toward {added} != {expected}"
+
+
+def test_cull_primitives():
+    midi_fname = "../sample_music/effrhy_732.mid"
+    # The shadows are smaller than the notes and directly behind them, so
+    # most of them are hidden
+    settings = midani_settings.Settings(
+        midi_fname=os.path.join(SCRIPT_PATH, midi_fname),
+        midi_cache=False,
+        shadow_positions=[(0, 0)],
+        shadow_scale=0.6,
+        metric_columns={
+            (0, 1): (40, 40, 40, 255),
+            (1, 2): (40, 40, 40, 255),
+            (2, 4): (60, 60, 60, 255),
+        },
+    )
+    score = midani_score.read_score(settings)
+    tempo_changes = midani_time.TempoChanges(score)
+    settings.update_from_score(score, tempo_changes)
+    score = midani_score.crop_score(score, settings, tempo_changes)
+    table = midani_misc_classes.PitchTable(score, settings, tempo_changes)
+    window = midani_misc_classes.Window(settings)
+    buckets = midani_misc_classes.PrimitiveBuckets(settings)
+    now = 4.0
+    window.update(now)
+    boss = RecordingBoss()
+    midani_plot.get_voice_and_line_tuples(
+        now, settings, table, window=window, buckets=buckets
+    )
+    buckets.flush(boss)
+    unculled = len(boss.zorders)
+    boss = RecordingBoss()
+    midani_plot.get_voice_and_line_tuples(
+        now, settings, table, window=window, buckets=buckets
+    )
+    buckets.flush(boss, window)
+    counts = buckets.last_counts
+    assert counts["occluded"] > 0, "no shadows culled"
+    assert counts["drawn"] == len(boss.zorders), "counts['drawn'] is wrong"
+    assert (
+        sum(
+            counts[key]
+            for key in ("drawn", "occluded", "offscreen", "subpixel")
+        )
+        == unculled
+    ), "counts don't add up"
+    notes = [rect for rect, z in zip(boss.rects, boss.zorders) if z == 15]
+    for x1, x2, y1, y2, _ in boss.rects:
+        assert (
+            max(x1, x2) >= window.start and min(x1, x2) <= window.end
+        ), "rect outside frame"
+        # No drawn shadow is inside a note
+        assert not any(
+            n_x1 < x1 and n_x2 > x2 and n_y1 < y1 and n_y2 > y2
+            for n_x1, n_x2, n_y1, n_y2, _ in notes
+        ), "shadow inside note not culled"
+
+    # Rects with an edge (as drawn by matplotlib) are visible however thin
+    # they are
+    boss = RecordingBoss()
+    boss.rect_edge_width = 1.0
+    midani_plot.get_voice_and_line_tuples(
+        now, settings, table, window=window, buckets=buckets
+    )
+    buckets.flush(boss, window)
+    assert counts["subpixel"], "no rects culled for being too thin"
+    assert not buckets.last_counts["subpixel"], "rect with an edge culled"
+
+    boss = RecordingBoss()
+    midani_plot.draw_metric_columns(window, settings, boss, buckets.counts)
+    # The first two columns of each cycle are merged
+    assert any(
+        (x1, x2) == (0, 2) for x1, x2, _, _, _ in boss.rects
+    ), "metric columns not merged"
+    assert buckets.counts["merged"] > 0, "merged columns not counted"
+
+
+def test_pixel_geometry():
+    midi_fname = "../sample_music/effrhy_732.mid"
+    settings = midani_settings.Settings(
+        midi_fname=os.path.join(SCRIPT_PATH, midi_fname),
+        midi_cache=False,
+        pixel_geometry=True,
+        shadow_positions=[(3, -3)],
+        voice_settings={0: {"connection_lines": True}},
+    )
+    score = midani_score.read_score(settings)
+    tempo_changes = midani_time.TempoChanges(score)
+    settings.update_from_score(score, tempo_changes)
+    score = midani_score.crop_score(score, settings, tempo_changes)
+    table = midani_misc_classes.PitchTable(score, settings, tempo_changes)
+    window = midani_misc_classes.Window(settings)
+    buckets = midani_misc_classes.PrimitiveBuckets(settings)
+    frames = []
+    for now in (4.0, 4.0 + settings.frame_increment):
+        window.update(now)
+        assert (
+            window.x_end - window.x_start == settings.out_width
+        ), "frame isn't out_width pixels wide"
+        boss = RecordingBoss()
+        midani_plot.get_voice_and_line_tuples(
+            now, settings, table, window=window, buckets=buckets
+        )
+        buckets.flush(boss, window)
+        assert boss.rects and boss.lines, "nothing drawn"
+        for primitive in boss.rects + boss.lines:
+            assert isinstance(primitive[0], int) and isinstance(
+                primitive[1], int
+            ), "x coordinate isn't an int"
+        frames.append((window.x_start, window.x_end, set(boss.rects)))
+    # Notes that are entirely inside both frames are at the same x pixels in
+    # each of them (their y positions may change as the pitch range of their
+    # channel changes)
+    (start1, end1, rects1), (start2, _, rects2) = frames
+    assert start2 > start1, "frame didn't move"
+    inside = {
+        (x1, x2) for x1, x2, _, _, _ in rects1 if start2 < x1 and x2 < end1
+    }
+    assert inside and inside <= {
+        (x1, x2) for x1, x2, _, _, _ in rects2
+    }, "notes moved between frames"
+
+
+def test_strip():
+    midi_fname = "../sample_music/effrhy_732.mid"
+    static_kwargs = {
+        "highlight_strength": 0,
+        "max_flutter_size": 0,
+        "bounce_size": 0,
+    }
+    for kwargs, time_invariant in (
+        ({}, False),
+        (static_kwargs, True),
+        (dict(static_kwargs, note_end=0.5), False),
+        (dict(static_kwargs, voice_settings={1: {"bounce_size": 0.5}}), False),
+    ):
+        settings = midani_settings.Settings(
+            midi_fname=os.path.join(SCRIPT_PATH, midi_fname),
+            midi_cache=False,
+            shadow_positions=[(3, -3)],
+            **kwargs,
+        )
+        score = midani_score.read_score(settings)
+        tempo_changes = midani_time.TempoChanges(score)
+        settings.update_from_score(score, tempo_changes)
+        assert (
+            midani_strip.is_time_invariant(settings) == time_invariant
+        ), f"is_time_invariant() != {time_invariant} with {kwargs}"
+
+    settings.pixel_geometry = True
+    window = midani_misc_classes.Window(settings)
+    frame_x_starts = []
+    now = window.get_first_now()
+    while window.in_range(now):
+        window.update(now)
+        frame_x_starts.append(window.x_start)
+        now += settings.frame_increment
+    strip = midani_strip.Strip(settings, frame_x_starts)
+    for tile_i in strip.tiles:
+        x_start = strip.tile_x_start(tile_i)
+        window.update(window.time_at_x_start(x_start))
+        assert window.x_start == x_start, "tile drawn in wrong frame"
+    # Each frame is made up of the middles of consecutive tiles
+    for x_start in frame_x_starts:
+        # pylint: disable=protected-access
+        slices = list(strip._tile_slices(x_start))
+        assert (
+            sum(end - start for _, start, end in slices) == settings.out_width
+        ), "slices don't make up a frame"
+        for tile_i, start, end in slices:
+            assert tile_i in strip.tiles, "tile not drawn"
+            assert (
+                strip.margin <= start < end <= strip.margin + strip.step
+            ), "slice outside middle of tile"
+        for (tile_i, _, end), (next_tile_i, next_start, _) in zip(
+            slices, slices[1:]
+        ):
+            assert next_tile_i == tile_i + 1, "tiles not consecutive"
+            assert (
+                end == strip.margin + strip.step and next_start == strip.margin
+            ), "gap between slices"
+
+
+def test_strip_overlays():
+    out_path = os.path.join(SCRIPT_PATH, "test_out", "strip_overlays")
+    os.makedirs(out_path, exist_ok=True)
+    settings = midani_settings.Settings(
+        midi_fname=os.path.join(SCRIPT_PATH, "../sample_music/effrhy_732.mid"),
+        output_dirname=out_path,
+        resolution=(320, 180),
+        pixel_geometry=True,
+    )
+    score = midani_score.read_score(settings)
+    settings.update_from_score(score, midani_time.TempoChanges(score))
+    shape = (settings.out_height, settings.out_width)
+    tile = np.full(shape + (3,), 100, dtype=np.uint8)
+    # A transparent overlay with a line drawn on it
+    line_overlay = np.zeros(shape + (4,), dtype=np.uint8)
+    line_overlay[:, 10] = (0, 0, 255, 255)
+    for overlay, expected in (
+        # Without an alpha channel, the overlay can't be composited
+        (np.zeros(shape + (3,), dtype=np.uint8), False),
+        # An opaque overlay would hide the notes
+        (np.full(shape + (4,), 255, dtype=np.uint8), False),
+        (line_overlay, True),
+    ):
+        strip = midani_strip.Strip(settings, [0])
+        strip.set_tile_fnumbers(2)
+        for i in range(len(strip.tiles)):
+            # pylint: disable=no-member
+            cv2.imwrite(midani_av.png_path(settings, i + 2), tile)
+        cv2.imwrite(  # pylint: disable=no-member
+            midani_av.png_path(settings, 1), overlay
+        )
+        assert strip.composite() == expected, f"composite() != {expected}"
+    frame = cv2.imread(  # pylint: disable=no-member
+        midani_av.png_path(settings, 1)
+    )
+    assert (frame[:, 10] == (0, 0, 255)).all(), "overlay not composited"
+    assert (frame[:, 11] == 100).all(), "tile not composited"
+
+
+def test_strip_now_line():
+    out_path = os.path.join(SCRIPT_PATH, "test_out", "strip_now_line")
+    frames = {}
+    for strip_render in ("always", "never"):
+        settings = midani_settings.Settings(
+            midi_fname=os.path.join(
+                SCRIPT_PATH, "../sample_music/effrhy_732.mid"
+            ),
+            midi_cache=False,
+            output_dirname=os.path.join(out_path, strip_render),
+            frame_format="raw",
+            resolution=(320, 180),
+            pixel_geometry=True,
+            highlight_strength=0,
+            max_flutter_size=0,
+            bounce_size=0,
+            now_line=True,
+            now_line_color=(0, 255, 0, 255),
+            now_line_zorder=20,
+            strip_render=strip_render,
+        )
+        os.makedirs(settings.output_dirname, exist_ok=True)
+        success, n_frames = midani_plot.plot(settings, True, [2.0, 2.5])
+        assert success and n_frames == 2, "plotting failed"
+        with midani_frame_store.FrameStore.open(
+            settings.frame_store_fname
+        ) as store:
+            frames[strip_render] = [np.array(frame) for frame in store]
+    # Notes at the edges of a frame are drawn differently (see
+    # midani_strip), so only the columns around the now line are compared
+    now_x = round(settings.frame_position * settings.out_width)
+    columns = slice(now_x - 10, now_x + 10)
+    for composited, full in zip(frames["always"], frames["never"]):
+        composited, full = composited[:, columns], full[:, columns]
+        assert (full[:, :, 1] > 200).any(), "now line not drawn"
+        # The now line is antialiased over a transparent background, rather
+        # than over the notes, so its edges may differ slightly
+        diff = np.abs(composited.astype(int) - full.astype(int))
+        assert diff.max() <= 2, "composited frame differs from full render"
+
+    # Behind the notes, the now line can't be drawn over the crops
+    settings.strip_render = "auto"
+    assert midani_strip.use_strip(settings), "strip not used"
+    settings.now_line_zorder = 1
+    assert not midani_strip.use_strip(settings), "now line drawn over the notes"
+
+
+def test_plot_keeps_settings():
+    out_path = os.path.join(SCRIPT_PATH, "test_out", "plot_settings")
+    os.makedirs(out_path, exist_ok=True)
+    settings = midani_settings.Settings(
+        midi_fname=os.path.join(SCRIPT_PATH, "../sample_music/effrhy_732.mid"),
+        midi_cache=False,
+        output_dirname=out_path,
+        strip_render="always",
+        frame_format="raw",
+        resolution=(320, 180),
+    )
+    success, n_frames = midani_plot.plot(settings, True, [2.0, 2.5])
+    assert success and n_frames == 2, "plotting failed"
+    # The strip is drawn with pixel geometry, but the caller's settings are
+    # unchanged
+    assert not settings.pixel_geometry, "settings.pixel_geometry changed"
+    assert settings.frame_format == "raw", "settings.frame_format changed"
+    assert (
+        midani_plot.saved_frame_format(settings, True) == "raw"
+    ), "raw frames not saved"
+    settings.strip_render = "never"
+    assert (
+        midani_plot.saved_frame_format(settings, False) == "png"
+    ), "frames plotted with R not saved as pngs"
+
+
+def test_frame_range():
+    midi_fname = os.path.join(SCRIPT_PATH, "../sample_music/effrhy_732.mid")
+
+    def _frame_times(frame_range):
+        settings = midani_settings.Settings(
+            midi_fname=midi_fname, midi_cache=False, frame_range=frame_range
+        )
+        score = midani_score.read_score(settings)
+        tempo_changes = midani_time.TempoChanges(score)
+        settings.update_from_score(score, tempo_changes)
+        window = midani_misc_classes.Window(settings)
+        # pylint: disable=protected-access
+        return settings, list(midani_plot._frame_times(settings, window, None))
+
+    _, all_times = _frame_times(None)
+    for start, end in ((0, 10), (10, None), (5, 7), (len(all_times), None)):
+        settings, times = _frame_times((start, end))
+        assert times == all_times[start:end], f"frames {start}:{end} differ"
+        assert settings.seed == 0, "shard not seeded"
+        assert midani_settings.parse_shard_suffix(settings.video_fname) == (
+            start,
+            end,
+        ), "shard suffix doesn't round trip"
+
+
 if __name__ == "__main__":
     test_bg_beat_times()
+    test_frame_allocations()
+    test_primitive_buckets()
+    test_packed_colors()
+    test_cull_primitives()
+    test_pixel_geometry()
+    test_strip()
+    test_strip_overlays()
+    test_strip_now_line()
+    test_plot_keeps_settings()
+    test_frame_range()
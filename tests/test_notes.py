@@ -0,0 +1,190 @@
+"""Tests that ColumnarScore from midani_notes behaves like note_classes.Score.
+"""
+import glob
+import os
+
+import numpy as np
+
+from midani import midani_notes
+from midani import midani_smf
+
+SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
+SAMPLE_MUSIC_DIR = os.path.join(SCRIPT_PATH, "..", "sample_music")
+SAMPLE_PATHS = sorted(glob.glob(os.path.join(SAMPLE_MUSIC_DIR, "*.mid")))
+
+
+def _note_tuple(note):
+    return (
+        note.pitch,
+        note.attack_time,
+        note.dur,
+        note.velocity,
+        note.choir,
+        note.voice,
+    )
+
+
+def _voices(score):
+    return [[_note_tuple(note) for note in voice] for voice in score.voices]
+
+
+def _onsets(score):
+    return [sorted(_note_tuple(note) for note in onset) for onset in score]
+
+
+def _assert_same(score, columnar_score):
+    assert (
+        score.num_voices == columnar_score.num_voices
+    ), "score.num_voices != columnar_score.num_voices"
+    assert len(score) == len(
+        columnar_score
+    ), "len(score) != len(columnar_score)"
+    assert _voices(score) == _voices(
+        columnar_score
+    ), "_voices(score) != _voices(columnar_score)"
+    assert (
+        score.get_total_len() == columnar_score.get_total_len()
+    ), "score.get_total_len() != columnar_score.get_total_len()"
+
+
+def test_columnar_score():
+    for path in SAMPLE_PATHS:
+        for kwargs in (
+            {},
+            {"split_channels_to_voices": True},
+            {"first_note_at_0": True},
+        ):
+            score = midani_smf.read_smf(path, ticks=True, **kwargs)
+            columnar_score = midani_smf.read_smf(path, columnar=True, **kwargs)
+            _assert_same(score, columnar_score)
+            _assert_same(
+                score, midani_notes.ColumnarScore.from_score(score)
+            )
+            assert _onsets(score) == _onsets(
+                columnar_score
+            ), "_onsets(score) != _onsets(columnar_score)"
+            assert (
+                score.attacks_adjusted_by == columnar_score.attacks_adjusted_by
+            ), "score.attacks_adjusted_by != columnar_score.attacks_adjusted_by"
+
+
+def test_get_passage():
+    for path in SAMPLE_PATHS:
+        score = midani_smf.read_smf(path, ticks=True)
+        columnar_score = midani_smf.read_smf(path, columnar=True)
+        total_len = score.get_total_len()
+        for start, end in (
+            (None, None),
+            (None, total_len // 3),
+            (total_len // 3, None),
+            (total_len // 4, 3 * total_len // 4),
+            (total_len + 1, None),
+        ):
+            for dont_overlap_start in (True, False):
+                for end_time_refers_to_attack in (True, False):
+                    kwargs = dict(
+                        passage_start_time=start,
+                        passage_end_time=end,
+                        dont_overlap_start=dont_overlap_start,
+                        end_time_refers_to_attack=end_time_refers_to_attack,
+                    )
+                    passage = score.get_passage(**kwargs)
+                    columnar_passage = columnar_score.get_passage(**kwargs)
+                    assert _voices(passage) == _voices(
+                        columnar_passage
+                    ), "_voices(passage) != _voices(columnar_passage)"
+                    tempo_changes = (
+                        passage.get_tempo_changes_from_meta_messages()
+                    )
+                    columnar_tempo_changes = (
+                        columnar_passage.get_tempo_changes_from_meta_messages()
+                    )
+                    assert (
+                        tempo_changes == columnar_tempo_changes
+                    ), "tempo_changes != columnar_tempo_changes"
+
+
+def test_voice_operations():
+    path = SAMPLE_PATHS[0]
+    score = midani_smf.read_smf(path, columnar=True)
+    num_notes = len(score)
+    # Per note: int16 pitch, int64 attack and dur, uint8 velocity and channel
+    assert score.nbytes == 20 * num_notes, "score.nbytes != 20 * num_notes"
+
+    num_voices = score.num_voices
+    score.add_voice(midani_notes.ColumnarVoice())
+    assert (
+        score.num_voices == num_voices + 1
+    ), "score.num_voices != num_voices + 1"
+    score.remove_empty_voices()
+    assert score.num_voices == num_voices, "score.num_voices != num_voices"
+
+    attacks = score.voices[0].attack.copy()
+    score.rescale_ticks(3)
+    assert (
+        score.voices[0].attack == attacks * 3
+    ).all(), "(score.voices[0].attack != attacks * 3).any()"
+
+    score.set_dur(score.ticks_per_beat / 4)
+    assert (
+        score.voices[0].dur == score.ticks_per_beat / 4
+    ).all(), "(score.voices[0].dur != score.ticks_per_beat / 4).any()"
+    last_attack = max(voice.attack[-1] for voice in score.voices)
+    assert (
+        score.get_total_len() == last_attack + score.ticks_per_beat / 4
+    ), "score.get_total_len() != last_attack + score.ticks_per_beat / 4"
+
+
+def test_passage_views():
+    path = SAMPLE_PATHS[0]
+    score = midani_smf.read_smf(path, columnar=True)
+    total_len = score.get_total_len()
+    passage = score.get_passage(
+        passage_start_time=total_len // 4, passage_end_time=total_len // 2
+    )
+    for voice, passage_voice in zip(score.voices, passage.voices):
+        assert np.shares_memory(
+            voice.attack, passage_voice.attack
+        ), "not np.shares_memory(voice.attack, passage_voice.attack)"
+    # Changing the passage must not change the original score
+    tempo_changes = score.get_tempo_changes_from_meta_messages()
+    passage.displace_passage(-(total_len // 4))
+    passage.rescale_ticks(2)
+    assert (
+        score.get_tempo_changes_from_meta_messages() == tempo_changes
+    ), "score.get_tempo_changes_from_meta_messages() != tempo_changes"
+    assert (
+        score.get_total_len() == total_len
+    ), "score.get_total_len() != total_len"
+
+
+def test_passage_overlapping_start():
+    # One long note followed by many short ones
+    attack = [0] + list(range(10, 1000, 10))
+    dur = [900] + [5] * 99
+    voice = midani_notes.ColumnarVoice(
+        [60] * 100, attack, dur, [64] * 100, [0] * 100
+    )
+    passage = voice.get_passage(
+        passage_start_time=500, passage_end_time=600, dont_overlap_start=False
+    )
+    assert passage.attack.tolist() == [0] + list(
+        range(500, 600, 10)
+    ), "passage.attack.tolist() != [0] + list(range(500, 600, 10))"
+    passage = voice.get_passage(
+        passage_start_time=493,
+        passage_end_time=600,
+        dont_overlap_start=False,
+        end_time_refers_to_attack=False,
+    )
+    assert passage.attack.tolist() == list(
+        range(490, 600, 10)
+    ), "passage.attack.tolist() != list(range(490, 600, 10))"
+
+
+if __name__ == "__main__":
+    test_columnar_score()
+    test_get_passage()
+    test_voice_operations()
+    test_passage_views()
+    test_passage_overlapping_start()
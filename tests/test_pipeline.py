@@ -0,0 +1,207 @@
+"""Tests that midani_pipeline.Pipeline encodes the frames in order, bounds the
+number of chunks in flight, and reports errors rather than hanging.
+
+Except in test_encoder_error(), Rscript is replaced by a shell script that
+runs each "R script" with sh, so that the chunks can be made to finish in
+any order.
+"""
+import contextlib
+import dataclasses
+import os
+import threading
+import time
+import typing
+
+import cv2
+import numpy as np
+
+from midani import midani_av
+from midani import midani_pipeline
+from midani import midani_settings
+
+SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
+OUT_PATH = os.path.join(SCRIPT_PATH, "test_out", "pipeline")
+
+
+@dataclasses.dataclass
+class DummySettings:  # pylint: disable=missing-class-docstring
+    output_dirname: str = OUT_PATH
+    pipeline_r_processes: typing.Optional[int] = 1
+    pipeline_max_chunks: int = 1
+    # The video can't be written, since its directory is a file
+    video_fname: str = os.path.join(OUT_PATH, "not_a_dir", "video.mp4")
+    frame_increment: float = 1 / 30
+    out_width: int = 1280
+    out_height: int = 720
+    png_fname_base: str = os.path.join(OUT_PATH, "frame_")
+    png_fnum_digits: int = 5
+    video_decoder_threads: typing.Optional[int] = 1
+    clean_up_png_files: bool = True
+
+
+@contextlib.contextmanager
+def _fake_rscript():
+    bin_dir = os.path.join(OUT_PATH, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    rscript = os.path.join(bin_dir, "Rscript")
+    with open(rscript, "w", encoding="utf-8") as outf:
+        outf.write('#!/bin/sh\nexec sh "$1"\n')
+    os.chmod(rscript, 0o755)
+    path = os.environ["PATH"]
+    os.environ["PATH"] = bin_dir + os.pathsep + path
+    try:
+        yield
+    finally:
+        os.environ["PATH"] = path
+
+
+def _write_script(name, lines):
+    script_fname = os.path.join(OUT_PATH, name)
+    with open(script_fname, "w", encoding="utf-8") as outf:
+        outf.write("\n".join(lines) + "\n")
+    return script_fname
+
+
+def _run_in_thread(target, timeout=30):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=timeout)
+    assert not thread.is_alive(), "pipeline hung"
+
+
+def test_frame_order():
+    os.makedirs(OUT_PATH, exist_ok=True)
+    settings = DummySettings(
+        pipeline_r_processes=3,
+        pipeline_max_chunks=3,
+        video_fname=os.path.join(OUT_PATH, "order.mp4"),
+        out_width=64,
+        out_height=64,
+    )
+    log_fname = os.path.join(OUT_PATH, "order.log")
+    if os.path.exists(log_fname):
+        os.remove(log_fname)
+    # Each chunk "plots" two frames, by copying pngs of increasing
+    # brightness, and the later chunks finish first
+    scripts = []
+    for chunk_i, delay in enumerate((1.0, 0.5, 0.0)):
+        lines = [f"sleep {delay}"]
+        for png_i in (2 * chunk_i + 1, 2 * chunk_i + 2):
+            src = os.path.join(OUT_PATH, f"src_{png_i}.png")
+            cv2.imwrite(  # pylint: disable=no-member
+                src, np.full((64, 64, 3), 40 * png_i, dtype=np.uint8)
+            )
+            lines.append(f"cp {src} {midani_av.png_path(settings, png_i)}")
+        lines.append(f"echo {chunk_i} >> {log_fname}")
+        scripts.append(
+            (_write_script(f"order_{chunk_i}.R", lines), 2 * chunk_i + 1)
+        )
+    result = []
+
+    def _run():
+        pipeline = midani_pipeline.Pipeline(settings, clean_up=False)
+        for script_fname, first_png in scripts:
+            pipeline.submit(script_fname, first_png, first_png + 1)
+        result.append(pipeline.finish())
+
+    with _fake_rscript():
+        _run_in_thread(_run)
+    assert result == [True], "pipeline failed"
+    with open(log_fname, "r", encoding="utf-8") as inf:
+        assert inf.read().split() == ["2", "1", "0"], "chunks finished in order"
+    cap = cv2.VideoCapture(settings.video_fname)  # pylint: disable=no-member
+    brightness = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        brightness.append(frame.mean())
+    cap.release()
+    assert len(brightness) == 6, "wrong number of frames"
+    for png_i, value in enumerate(brightness, start=1):
+        assert abs(value - 40 * png_i) < 10, "frames out of order"
+
+
+def test_max_chunks():
+    os.makedirs(OUT_PATH, exist_ok=True)
+    settings = DummySettings(pipeline_r_processes=2, pipeline_max_chunks=2)
+    release_fname = os.path.join(OUT_PATH, "release")
+    if os.path.exists(release_fname):
+        os.remove(release_fname)
+    # The first chunk is stuck until release_fname exists
+    stuck_fname = _write_script(
+        "stuck.R",
+        [f"while [ ! -e {release_fname} ]; do sleep 0.01; done"],
+    )
+    done_fname = _write_script("done.R", ["true"])
+    submitted = []
+    result = []
+    pipeline = midani_pipeline.Pipeline(settings, encode=False, clean_up=False)
+
+    def _run():
+        for i, script_fname in enumerate(
+            (stuck_fname, done_fname, done_fname, done_fname)
+        ):
+            pipeline.submit(script_fname, 10 * i + 1, 10 * i + 10)
+            submitted.append(i)
+        result.append(pipeline.finish())
+
+    with _fake_rscript():
+        thread = threading.Thread(target=_run, daemon=True)
+        thread.start()
+        time.sleep(1)
+        # The second chunk has finished, but its slot isn't released until
+        # the first (before it in the video) has
+        assert submitted == [0, 1], "submit() didn't wait for a slot"
+        with open(release_fname, "w", encoding="utf-8"):
+            pass
+        thread.join(timeout=30)
+    assert not thread.is_alive(), "pipeline hung"
+    assert submitted == [0, 1, 2, 3], "chunks not submitted"
+    assert result == [True], "pipeline failed"
+
+
+def test_invalid_max_chunks():
+    try:
+        midani_settings.Settings(
+            midi_fname=os.path.join(
+                SCRIPT_PATH, "..", "sample_music", "effrhy_732.mid"
+            ),
+            pipeline_max_chunks=0,
+        )
+    except ValueError:
+        pass
+    else:
+        assert False, "pipeline_max_chunks=0 accepted"
+
+
+def test_encoder_error():
+    settings = DummySettings()
+    os.makedirs(OUT_PATH, exist_ok=True)
+    with open(os.path.dirname(settings.video_fname), "w", encoding="utf-8"):
+        pass
+    script_fname = os.path.join(OUT_PATH, "script.R")
+    with open(script_fname, "w", encoding="utf-8") as outf:
+        outf.write("quit(status = 1)\n")
+    pipeline = midani_pipeline.Pipeline(settings, clean_up=False)
+    result = []
+
+    def _run():
+        # More chunks than pipeline_max_chunks, so submit() waits for the
+        # encoder to release their slots
+        for i in range(4):
+            pipeline.submit(script_fname, 10 * i + 1, 10 * i + 10)
+        try:
+            pipeline.finish()
+        except OSError as exc:
+            result.append(exc)
+
+    _run_in_thread(_run)
+    assert result, "error not raised by finish()"
+
+
+if __name__ == "__main__":
+    test_frame_order()
+    test_max_chunks()
+    test_invalid_max_chunks()
+    test_encoder_error()
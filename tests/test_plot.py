@@ -1,9 +1,11 @@
 """Write pngs with midani_plot.py to verify it is working as expected.
 """
 
+import itertools
 import os
 import sys
 
+from midani import midani_annotations
 from midani import midani_plot
 from midani import midani_settings
 
@@ -27,7 +29,95 @@ def test_plot():
     print(f"Wrote test pngs to folder {OUT_PATH}")
 
 
+def test_iter_frames():
+    settings_kwargs = dict(
+        midi_fname=os.path.join(
+            SCRIPT_PATH, "..", "sample_music", "effrhy_732.mid"
+        ),
+        output_dirname=OUT_PATH,
+        seed=0,
+    )
+    settings = midani_settings.Settings(**settings_kwargs)
+    # Frames are rendered lazily, so taking the first few of a long video is
+    # quick
+    frames = list(itertools.islice(midani_plot.iter_frames(settings), 3))
+    assert [frame_i for frame_i, _, _ in frames] == [
+        0,
+        1,
+        2,
+    ], "wrong frame indices"
+    for _, _, frame in frames:
+        assert frame.shape == (
+            settings.out_height,
+            settings.out_width,
+            3,
+        ), "wrong frame shape"
+    assert frames[0][2] is not frames[1][2], "frame reused"
+    settings = midani_settings.Settings(frame_range=(1, 3), **settings_kwargs)
+    # Nothing is cached (neither the score nor the seek index used to read
+    # just the frame range)
+    cache_home = os.path.join(OUT_PATH, "cache_home")
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = cache_home
+    try:
+        shard_frames = list(midani_plot.iter_frames(settings))
+    finally:
+        if xdg_cache_home is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = xdg_cache_home
+    assert not os.path.exists(cache_home), "iter_frames() wrote to the cache"
+    assert [(frame_i, now) for frame_i, now, _ in shard_frames] == [
+        (frame_i, now) for frame_i, now, _ in frames[1:]
+    ], "frame range differs"
+    for (_, _, frame), (_, _, shard_frame) in zip(frames[1:], shard_frames):
+        assert (frame == shard_frame).all(), "frame range frames differ"
+
+
+
+def test_shard_lyrics():
+    settings_kwargs = dict(
+        midi_fname=os.path.join(
+            SCRIPT_PATH, "..", "sample_music", "effrhy_732.mid"
+        ),
+        output_dirname=OUT_PATH,
+        midi_cache=False,
+        resolution=(320, 180),
+        seed=0,
+        # The first three lyrics are less than a frame apart
+        lyrics={0.0: "one", 0.01: "two", 0.02: "three", 0.5: "four"},
+    )
+    settings = midani_settings.Settings(**settings_kwargs)
+    frames = list(
+        itertools.takewhile(
+            lambda frame: frame[1] < 0.7, midani_plot.iter_frames(settings)
+        )
+    )
+    # A shard that starts after all the lyrics have appeared shows the last
+    # of them, as the full render does
+    start = next(frame_i for frame_i, now, _ in frames if now >= 0.6)
+    settings = midani_settings.Settings(
+        frame_range=(start, start + 2), **settings_kwargs
+    )
+    shard_frames = list(midani_plot.iter_frames(settings))
+    assert len(shard_frames) == 2, "wrong number of frames"
+    for (_, _, frame), (_, _, shard_frame) in zip(frames[start:], shard_frames):
+        assert (frame == shard_frame).all(), "shard lyrics differ"
+    # Each frame shows the last lyric that has appeared
+    lyricist = midani_annotations.Lyricist(settings)
+    assert [lyricist(now) for now in (-0.1, 0.03, 0.04, 0.6)] == [
+        None,
+        "three",
+        "three",
+        "four",
+    ], "wrong lyrics"
+
+
 if __name__ == "__main__":
     print("=" * os.get_terminal_size().columns)
     test_plot()
     print("=" * os.get_terminal_size().columns)
+    test_iter_frames()
+    print("=" * os.get_terminal_size().columns)
+    test_shard_lyrics()
+    print("=" * os.get_terminal_size().columns)
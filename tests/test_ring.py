@@ -0,0 +1,106 @@
+"""Tests that frames passed through midani_ring.FrameRing by several processes
+are consumed in order.
+"""
+import multiprocessing
+import random
+import time
+
+from midani import midani_plot
+from midani import midani_ring
+
+N_FRAMES = 40
+HEIGHT = 6
+WIDTH = 10
+
+
+def _write_frames(ring, worker_i, n_workers):
+    for i in range(worker_i, N_FRAMES, n_workers):
+        time.sleep(random.random() * 0.01)
+        with ring.slot(i) as slot:
+            slot[:] = i
+
+
+def test_ring_order():
+    context = multiprocessing.get_context("fork")
+    for n_slots, n_workers in ((1, 1), (2, 3), (8, 4)):
+        ring = midani_ring.FrameRing(n_slots, HEIGHT, WIDTH, context)
+        workers = [
+            context.Process(
+                target=_write_frames, args=(ring, worker_i, n_workers)
+            )
+            for worker_i in range(n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for i, frame in enumerate(ring.frames(N_FRAMES)):
+                assert frame.shape == (HEIGHT, WIDTH, 3), "wrong frame shape"
+                assert (frame == i).all(), f"frame {i} out of order"
+        finally:
+            for worker in workers:
+                worker.join()
+            ring.close()
+        assert all(worker.exitcode == 0 for worker in workers), "worker failed"
+
+
+def test_ring_check():
+    ring = midani_ring.FrameRing(2, HEIGHT, WIDTH)
+    poll_interval = midani_ring.POLL_INTERVAL
+    midani_ring.POLL_INTERVAL = 0.01
+    calls = []
+
+    def _check(i):
+        calls.append(i)
+        raise RuntimeError
+
+    try:
+        # No frame is ever written
+        next(ring.frames(1, check=_check))
+    except RuntimeError:
+        pass
+    else:
+        assert False, "frames() returned an unwritten frame"
+    finally:
+        midani_ring.POLL_INTERVAL = poll_interval
+        ring.close()
+    assert calls == [0], "check not called with the unwritten frame"
+
+
+def test_ring_worker_exits():
+    context = multiprocessing.get_context("fork")
+    ring = midani_ring.FrameRing(2, HEIGHT, WIDTH, context)
+    poll_interval = midani_ring.POLL_INTERVAL
+    midani_ring.POLL_INTERVAL = 0.01
+    # The second worker exits successfully without writing its frames
+    workers = [
+        context.Process(target=_write_frames, args=(ring, 0, 2)),
+        context.Process(target=lambda: None),
+    ]
+    for worker in workers:
+        worker.start()
+    consumed = []
+    try:
+        for frame in ring.frames(
+            N_FRAMES,
+            # pylint: disable=protected-access
+            check=lambda i: midani_plot._check_render_workers(workers, i),
+        ):
+            consumed.append(frame[0, 0, 0])
+    except RuntimeError:
+        pass
+    else:
+        assert False, "frames() waited for frames that were never written"
+    finally:
+        midani_ring.POLL_INTERVAL = poll_interval
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        ring.close()
+    assert consumed == [0], "wrong frames consumed"
+
+
+if __name__ == "__main__":
+    test_ring_order()
+    test_ring_check()
+    test_ring_worker_exits()
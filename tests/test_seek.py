@@ -0,0 +1,201 @@
+"""Tests that reading a window of a midi file with midani_seek gives the same
+notes as reading the whole file and cropping it.
+"""
+import glob
+import os
+import shutil
+
+from midani import midani_cache
+from midani import midani_score
+from midani import midani_seek
+from midani import midani_settings
+from midani import midani_smf
+from midani import midani_time
+
+SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
+SAMPLE_MUSIC_DIR = os.path.join(SCRIPT_PATH, "..", "sample_music")
+SAMPLE_PATHS = sorted(glob.glob(os.path.join(SAMPLE_MUSIC_DIR, "*.mid")))
+OUT_DIR = os.path.join(SCRIPT_PATH, "test_mid", "seek")
+INDEX_DIR = os.path.join(OUT_DIR, "cache")
+
+
+def _copy_samples():
+    # So that the midi files can be changed
+    if not os.path.exists(OUT_DIR):
+        os.makedirs(OUT_DIR)
+    shutil.rmtree(INDEX_DIR, ignore_errors=True)
+    paths = []
+    for path in SAMPLE_PATHS:
+        out_path = os.path.join(OUT_DIR, os.path.basename(path))
+        shutil.copyfile(path, out_path)
+        paths.append(out_path)
+    midani_seek._INDEXES.clear()  # pylint: disable=protected-access
+    return paths
+
+
+def _voices(score):
+    return [
+        [
+            (note.pitch, note.attack_time, note.dur, note.velocity, note.choir)
+            for note in voice
+        ]
+        for voice in score.voices
+    ]
+
+
+def test_read_window():
+    checkpoint_interval = midani_seek.CHECKPOINT_INTERVAL
+    # So that the sample files have several checkpoints per track
+    midani_seek.CHECKPOINT_INTERVAL = 16
+    try:
+        paths = _copy_samples()
+    finally:
+        midani_seek.CHECKPOINT_INTERVAL = checkpoint_interval
+    for path in paths:
+        index = midani_seek.get_index(path, INDEX_DIR)
+        for kwargs in (
+            {},
+            {"split_channels_to_voices": True},
+            {"first_note_at_0": True},
+        ):
+            score = midani_smf.read_smf(path, columnar=True, **kwargs)
+            total_len = score.get_total_len()
+            assert total_len == max(
+                attack + dur for attack, dur in index.final_notes(**kwargs)
+            ), "total_len != index.final_notes()"
+            for start, end in (
+                (0, total_len // 3),
+                (total_len // 3, 2 * total_len // 3),
+                (3 * total_len // 4, total_len),
+            ):
+                window = index.read_window(start, end, **kwargs)
+                assert (
+                    window.num_voices == score.num_voices
+                ), "window.num_voices != score.num_voices"
+                assert (
+                    window.attacks_adjusted_by == score.attacks_adjusted_by
+                ), "window.attacks_adjusted_by != score.attacks_adjusted_by"
+                for dont_overlap_start in (True, False):
+                    passage_kwargs = dict(
+                        passage_start_time=start,
+                        passage_end_time=end,
+                        dont_overlap_start=dont_overlap_start,
+                        end_time_refers_to_attack=True,
+                    )
+                    passage = score.get_passage(**passage_kwargs)
+                    window_passage = window.get_passage(**passage_kwargs)
+                    assert _voices(passage) == _voices(
+                        window_passage
+                    ), "_voices(passage) != _voices(window_passage)"
+                    assert (
+                        passage.get_tempo_changes_from_meta_messages()
+                        == window_passage.get_tempo_changes_from_meta_messages()
+                    ), "tempo changes differ"
+
+
+def test_index_reused():
+    path = _copy_samples()[0]
+    index_path = midani_seek.index_path(path, INDEX_DIR)
+    index = midani_seek.get_index(path, INDEX_DIR)
+    assert os.path.exists(index_path), "index file not written"
+    assert os.listdir(os.path.dirname(index_path)) == [
+        os.path.basename(index_path)
+    ], "temporary files left behind"
+    assert not glob.glob(
+        os.path.join(OUT_DIR, "*" + midani_seek.INDEX_SUFFIX)
+    ), "index file written next to the midi file"
+    midani_seek._INDEXES.clear()  # pylint: disable=protected-access
+    # Loading the index touches it (see test_index_eviction()), but doesn't
+    # replace it
+    inode = os.stat(index_path).st_ino
+    reloaded = midani_seek.get_index(path, INDEX_DIR)
+    assert (
+        reloaded.to_json() == index.to_json()
+    ), "reloaded.to_json() != index.to_json()"
+    assert os.stat(index_path).st_ino == inode, "index file was rewritten"
+    # If the midi file changes, the index is rebuilt
+    shutil.copyfile(SAMPLE_PATHS[1], path)
+    rebuilt = midani_seek.get_index(path, INDEX_DIR)
+    assert (
+        rebuilt.to_json() != index.to_json()
+    ), "rebuilt.to_json() == index.to_json()"
+    assert os.path.exists(
+        midani_seek.index_path(path, INDEX_DIR)
+    ), "rebuilt index not written"
+
+
+def test_index_eviction():
+    paths = _copy_samples()[:2]
+    index_paths = [midani_seek.index_path(path, INDEX_DIR) for path in paths]
+    for path in paths:
+        midani_seek.get_index(path, INDEX_DIR)
+    cache = midani_cache.ScoreCache(INDEX_DIR)
+    # pylint: disable=protected-access
+    assert sorted(entry[2] for entry in cache._entries()) == sorted(
+        index_paths
+    ), "indexes not counted as cache entries"
+    # Loading the first index marks it as used after the second
+    os.utime(index_paths[0], ns=(0, 0))
+    os.utime(index_paths[1], ns=(1, 1))
+    midani_seek._INDEXES.clear()
+    midani_seek.get_index(paths[0], INDEX_DIR)
+    assert os.stat(index_paths[0]).st_mtime_ns > 1, "index not touched"
+    # Saving a new index for the second file (e.g., after it has changed)
+    # evicts the least recently used index, that of the first file, which
+    # is no longer used
+    os.utime(index_paths[0], ns=(0, 0))
+    midani_seek._INDEXES.clear()
+    # Room for the new index only
+    max_bytes = os.path.getsize(index_paths[1])
+    os.remove(index_paths[1])
+    midani_seek.get_index(paths[1], INDEX_DIR, max_bytes=max_bytes)
+    assert not os.path.exists(index_paths[0]), "old index not evicted"
+    assert os.path.exists(index_paths[1]), "new index evicted"
+
+
+def _read_and_crop(settings_kwargs):
+    settings = midani_settings.Settings(
+        midi_cache=False, midi_cache_dir=INDEX_DIR, **settings_kwargs
+    )
+    score = midani_score.read_score(settings)
+    tempo_changes = midani_time.TempoChanges(score)
+    settings.update_from_score(score, tempo_changes)
+    score = midani_score.crop_score(score, settings, tempo_changes)
+    return score, settings
+
+
+def test_read_score_window():
+    paths = _copy_samples()
+    for settings_kwargs in (
+        {
+            "midi_fname": paths[0],
+            "start_bar": 5,
+            "end_bar": 9,
+            "bar_length": 4,
+        },
+        {"midi_fname": paths[1], "start_time": 10.0},
+        {
+            "midi_fname": paths[2:4],
+            "end_beat": 20,
+            "midi_reset_start_to_0": True,
+            "midi_constant_note_length": 0.5,
+        },
+    ):
+        score, settings = _read_and_crop(settings_kwargs)
+        full_score, full_settings = _read_and_crop(
+            dict(settings_kwargs, midi_seek_index=False)
+        )
+        assert _voices(score) == _voices(
+            full_score
+        ), "_voices(score) != _voices(full_score)"
+        for attr in ("start_time", "end_time", "final_time"):
+            assert getattr(settings, attr) == getattr(
+                full_settings, attr
+            ), f"settings.{attr} != full_settings.{attr}"
+
+
+if __name__ == "__main__":
+    test_read_window()
+    test_index_reused()
+    test_index_eviction()
+    test_read_score_window()
@@ -0,0 +1,212 @@
+"""Test that midani_smf.read_smf() reads midi files the same way as
+midi_funcs.read_midi_to_internal_data().
+"""
+import concurrent.futures
+import glob
+import os
+
+import mido
+
+import midani.from_my_other_projects.midi_funcs as midi_funcs
+import midani.from_my_other_projects.tuning as tuning
+from midani import midani_score
+from midani import midani_settings
+from midani import midani_smf
+
+SCRIPT_PATH = os.path.dirname((os.path.realpath(__file__)))
+SAMPLE_MUSIC_DIR = os.path.join(SCRIPT_PATH, "..", "sample_music")
+OUT_DIR = os.path.join(SCRIPT_PATH, "test_mid")
+
+
+def _score_contents(score):
+    notes = [
+        [
+            (n.pitch, n.attack_time, n.dur, n.velocity, n.choir, n.voice)
+            for n in voice
+        ]
+        for voice in score.voices
+    ]
+    # midi_funcs also puts channel messages from the first track among the
+    # meta messages; read_smf() doesn't read these.
+    meta_messages = [
+        (msg.type, msg.time, vars(msg))
+        for msg in score.meta_messages
+        if msg.is_meta
+    ]
+    return score.num_voices, notes, meta_messages
+
+
+def _compare(path, **kwargs):
+    mido_score = midi_funcs.read_midi_to_internal_data(path, **kwargs)
+    smf_score = midani_smf.read_smf(path, **kwargs)
+    assert _score_contents(mido_score) == _score_contents(
+        smf_score
+    ), f"_score_contents(mido_score) != _score_contents(smf_score) for {path}"
+
+
+def test_sample_music():
+    for path in glob.glob(os.path.join(SAMPLE_MUSIC_DIR, "*.mid")):
+        _compare(path)
+        _compare(path, split_channels_to_voices=True)
+        _compare(path, first_note_at_0=True)
+        _compare(path, ticks=True)
+        _compare(path, ticks=True, first_note_at_0=True)
+
+
+def test_tet():
+    tet = 31
+    pitch_bend_tuple_dict = tuning.return_pitch_bend_tuple_dict(tet)
+    mid = mido.MidiFile()
+    meta_track = mido.MidiTrack()
+    meta_track.append(mido.MetaMessage("set_tempo", tempo=400000))
+    track = mido.MidiTrack()
+    mid.tracks.extend([meta_track, track])
+    # Overlapping notes on alternating channels, each preceded by a pitch
+    # bend at the same tick (but after the note_on in the file, to check
+    # that pitchwheel events are processed first)
+    pitches = [tet * 5 + i for i in range(0, 62, 3)]
+    for i, pitch in enumerate(pitches):
+        channel = i % 2
+        midinum, pitch_bend = pitch_bend_tuple_dict[pitch]
+        track.append(
+            mido.Message("note_on", note=midinum, channel=channel, time=0)
+        )
+        track.append(
+            mido.Message(
+                "pitchwheel", pitch=pitch_bend, channel=channel, time=0
+            )
+        )
+        track.append(
+            mido.Message(
+                "note_off",
+                note=midinum,
+                channel=channel,
+                time=mid.ticks_per_beat // 3,
+            )
+        )
+    if not os.path.exists(OUT_DIR):
+        os.makedirs(OUT_DIR)
+    path = os.path.join(OUT_DIR, "tet31.mid")
+    mid.save(path)
+    _compare(path, tet=tet)
+    score = midani_smf.read_smf(path, tet=tet)
+    assert [
+        note.pitch for note in score.voices[0]
+    ] == pitches, "[note.pitch for note in score.voices[0]] != pitches"
+
+
+def test_running_status():
+    def _var_len(value):
+        out = [value & 0x7F]
+        value >>= 7
+        while value:
+            out.insert(0, (value & 0x7F) | 0x80)
+            value >>= 7
+        return bytes(out)
+
+    def _chunk(name, data):
+        return name + len(data).to_bytes(4, "big") + data
+
+    ticks_per_beat = 480
+    header = _chunk(
+        b"MThd",
+        (1).to_bytes(2, "big")
+        + (2).to_bytes(2, "big")
+        + ticks_per_beat.to_bytes(2, "big"),
+    )
+    meta_track = _chunk(
+        b"MTrk", b"\x00\xff\x51\x03\x07\xa1\x20\x00\xff\x2f\x00"
+    )
+    track = _chunk(
+        b"MTrk",
+        # note on, then two more note ons with running status
+        b"\x00\x90\x3c\x40"
+        + b"\x00\x40\x40"
+        + _var_len(ticks_per_beat)
+        + b"\x43\x40"
+        # a sysex event and a control change
+        + b"\x00\xf0\x03\x01\x02\xf7" + b"\x00\xb0\x40\x7f"
+        # note offs as note ons with velocity 0, using running status
+        + _var_len(ticks_per_beat)
+        + b"\x90\x3c\x00"
+        + b"\x00\x40\x00"
+        + b"\x00\x43\x00"
+        + b"\x00\xff\x2f\x00",
+    )
+    # Unknown chunk types should be skipped
+    data = header + _chunk(b"XFIH", b"\x00" * 5) + meta_track + track
+    if not os.path.exists(OUT_DIR):
+        os.makedirs(OUT_DIR)
+    path = os.path.join(OUT_DIR, "running_status.mid")
+    with open(path, "wb") as outf:
+        outf.write(data)
+    score = midani_smf.read_smf(path)
+    notes = [
+        (note.pitch, note.attack_time, note.dur) for note in score.voices[0]
+    ]
+    assert notes == [
+        (60, 0, 2),
+        (64, 0, 2),
+        (67, 1, 1),
+    ], "notes != [(60, 0, 2), (64, 0, 2), (67, 1, 1)]"
+    assert score.get_tempo_changes_from_meta_messages() == [
+        (120, 0)
+    ], "score.get_tempo_changes_from_meta_messages() != [(120, 0)]"
+
+
+def test_unsupported():
+    if not os.path.exists(OUT_DIR):
+        os.makedirs(OUT_DIR)
+    path = os.path.join(OUT_DIR, "smpte.mid")
+    with open(path, "wb") as outf:
+        outf.write(b"MThd\x00\x00\x00\x06\x00\x01\x00\x00\xe7\x28")
+    try:
+        midani_smf.read_smf(path)
+    except midani_smf.SMFError:
+        pass
+    else:
+        assert False, "read_smf() did not raise SMFError for SMPTE file"
+
+
+def test_parallel():
+    paths = sorted(glob.glob(os.path.join(SAMPLE_MUSIC_DIR, "*.mid")))
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        for path in paths:
+            for kwargs in ({}, {"split_channels_to_voices": True}):
+                score = midani_smf.read_smf(path, **kwargs)
+                parallel_score = midani_smf.read_smf(
+                    path, executor=executor, **kwargs
+                )
+                assert _score_contents(score) == _score_contents(
+                    parallel_score
+                ), f"parallel read of {path} differs"
+
+    parallel_min_bytes = midani_score.PARALLEL_MIN_BYTES
+    midani_score.PARALLEL_MIN_BYTES = 0
+    try:
+        for midi_fname in (paths[:1], paths[:3]):
+            scores = [
+                midani_score.read_score(
+                    midani_settings.Settings(
+                        midi_fname=midi_fname,
+                        midi_cache=False,
+                        midi_reader_processes=processes,
+                    )
+                )
+                for processes in (1, 2)
+            ]
+            score, parallel_score = (
+                [(voice.voice_i, list(voice)) for voice in score.voices]
+                for score in scores
+            )
+            assert score == parallel_score, "parallel read_score() differs"
+    finally:
+        midani_score.PARALLEL_MIN_BYTES = parallel_min_bytes
+
+
+if __name__ == "__main__":
+    test_sample_music()
+    test_tet()
+    test_running_status()
+    test_unsupported()
+    test_parallel()
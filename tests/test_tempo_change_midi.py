@@ -6,6 +6,8 @@ import os
 from typing import Optional
 
 import mido
+import numpy as np
+
 from midani import midani_score
 from midani import midani_time
 
@@ -23,6 +25,10 @@ class DummySettings:  # pylint: disable=missing-class-docstring
     midi_channels_to_voices: bool = False
     midi_reset_start_to_0: bool = False
     midi_constant_note_length: Optional[float] = None
+    midi_fast_reader: bool = True
+    midi_seek_index: bool = False
+    midi_cache: bool = False
+    midi_reader_processes: Optional[int] = 1
 
 
 def test_tempo_changes():
@@ -69,8 +75,44 @@ def test_tempo_changes():
         # Times do not agree exactly because tempos don't come out exactly
         # from mido conversion (e.g., 144 becomes 143.99988480009216)
         assert (
-            abs(time - tempo_changes.ctime_from_btime(note.attack_time)) < 1e-6
-        ), "abs(time - tempo_changes.ctime_from_btime(note.attack_time)) >= 1e-6"
+            abs(time - tempo_changes.ctime_from_tick(note.attack_time)) < 1e-6
+        ), "abs(time - tempo_changes.ctime_from_tick(note.attack_time)) >= 1e-6"
+
+    # The vectorized conversions against hand-computed values: the tempo is
+    # 120 bpm until beat 2.5, then 144 until beat 5, then 160 until beat 7.5,
+    # then 176. Times before the first tempo change are at its tempo.
+    t1, t2, t3, t4 = (60 / tempo for tempo in TEMPOS)
+    beat_times = np.array([-1, 0, 1, 2.5, 3, 5, 6, 7.5, 10])
+    clock_times = np.array(
+        [
+            -t1,
+            0,
+            t1,
+            t1 * 2.5,
+            t1 * 2.5 + t2 * 0.5,
+            t1 * 2.5 + t2 * 2.5,
+            t1 * 2.5 + t2 * 2.5 + t3 * 1,
+            t1 * 2.5 + t2 * 2.5 + t3 * 2.5,
+            t1 * 2.5 + t2 * 2.5 + t3 * 2.5 + t4 * 2.5,
+        ]
+    )
+    # As above, tempos don't come out exactly from mido conversion
+    assert np.allclose(
+        tempo_changes.ctimes_from_btimes(beat_times), clock_times, atol=1e-5
+    ), "not np.allclose(tempo_changes.ctimes_from_btimes(...), clock_times)"
+    assert np.allclose(
+        tempo_changes.btimes_from_ctimes(clock_times), beat_times, atol=1e-5
+    ), "not np.allclose(tempo_changes.btimes_from_ctimes(...), beat_times)"
+    assert np.allclose(
+        tempo_changes.ctimes_from_ticks(beat_times * ticks_per_beat),
+        clock_times,
+        atol=1e-5,
+    ), "not np.allclose(tempo_changes.ctimes_from_ticks(...), clock_times)"
+    assert np.allclose(
+        tempo_changes.ticks_from_ctimes(clock_times),
+        beat_times * ticks_per_beat,
+        atol=1e-2,
+    ), "not np.allclose(tempo_changes.ticks_from_ctimes(...), ...)"
 
     # t1 = 60 / 120
     # t2 = 60 / 144
@@ -90,5 +132,37 @@ def test_tempo_changes():
     # print(t1 * 2.5 + t2 * 2.5 + t3 * 2.5 + t4 * 1.5)
 
 
+def test_different_ticks_per_beat():
+    paths = []
+    for ticks_per_beat in (96, 480):
+        mid = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+        meta_track = mido.MidiTrack()
+        meta_track.append(mido.MetaMessage("set_tempo", tempo=400000))
+        track = mido.MidiTrack()
+        mid.tracks.extend([meta_track, track])
+        for i in range(4):
+            track.append(
+                mido.Message("note_on", note=60 + i, time=ticks_per_beat // 4)
+            )
+            track.append(
+                mido.Message("note_off", note=60 + i, time=ticks_per_beat // 2)
+            )
+        if not os.path.exists(OUT_DIR):
+            os.makedirs(OUT_DIR)
+        path = os.path.join(OUT_DIR, f"tpb{ticks_per_beat}.mid")
+        mid.save(path)
+        paths.append(path)
+    settings = DummySettings(tuple(paths))
+    score = midani_score.read_score(settings)
+    assert score.ticks_per_beat == 480, "score.ticks_per_beat != 480"
+    notes = [
+        [(note.pitch, note.attack_time, note.dur) for note in voice]
+        for voice in score.voices
+    ]
+    assert notes[0] == notes[1], "notes[0] != notes[1]"
+    assert notes[0][1] == (61, 480, 240), "notes[0][1] != (61, 480, 240)"
+
+
 if __name__ == "__main__":
     test_tempo_changes()
+    test_different_ticks_per_beat()